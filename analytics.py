@@ -0,0 +1,224 @@
+from datetime import date, time
+from operator import attrgetter
+
+numpy = None
+
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DEFAULT_OPENING_TIME = time(7, 0)
+DEFAULT_CLOSING_TIME = time(21, 0)
+PEAK_HOUR_COUNT = 3
+# Upper bound on room x day x slot cells held at once; longer ranges are processed
+# in consecutive day chunks and only the reductions are kept.
+MAX_CHUNK_CELLS = 1 << 25
+WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+_record_room_id = attrgetter("room_id")
+_record_times = attrgetter("date_ordinal", "start_minute", "end_minute")
+
+
+def _require_numpy():
+    # NumPy is imported on first use; importing it up front would more than double
+    # the time the interactive menu takes to appear.
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            raise ImportError("Utilisation analytics need NumPy; install it with 'pip install numpy'.")
+        numpy = numpy_module
+
+
+def _slot_of(time_value):
+    return (time_value.hour * 60 + time_value.minute) // SLOT_MINUTES
+
+
+class OccupancyData:
+    # Scheduled intervals as parallel arrays: room index, day index (0 = first_date),
+    # first slot and end slot (exclusive) in 5-minute steps.
+    def __init__(self, room_ids, first_date, day_count, room_indexes, day_indexes, start_slots, end_slots):
+        self.room_ids = room_ids
+        self.first_date = first_date
+        self.day_count = day_count
+        self.room_indexes = room_indexes
+        self.day_indexes = day_indexes
+        self.start_slots = start_slots
+        self.end_slots = end_slots
+
+    def occupancy_matrix(self, first_day_index=0, end_day_index=None):
+        # Boolean room x day x slot matrix for [first_day_index, end_day_index):
+        # +1/-1 at interval ends, then one cumulative sum along the slot axis.
+        end_day_index = self.day_count if end_day_index is None else end_day_index
+        selected = (self.day_indexes >= first_day_index) & (self.day_indexes < end_day_index)
+        room_indexes = self.room_indexes[selected]
+        day_indexes = self.day_indexes[selected] - first_day_index
+
+        boundaries = numpy.zeros((len(self.room_ids), end_day_index - first_day_index, SLOTS_PER_DAY + 1), dtype=numpy.int16)
+        numpy.add.at(boundaries, (room_indexes, day_indexes, self.start_slots[selected]), 1)
+        numpy.add.at(boundaries, (room_indexes, day_indexes, self.end_slots[selected]), -1)
+        return numpy.cumsum(boundaries[:, :, :SLOTS_PER_DAY], axis=2, dtype=numpy.int16) > 0
+
+
+def build_occupancy_data(reservation_book, first_date=None, last_date=None):
+    _require_numpy()
+
+    room_ids = sorted(reservation_book.classrooms_by_id)
+    room_positions = {room_id: room_position for room_position, room_id in enumerate(room_ids)}
+    records = list(reservation_book.iter_scheduled_records(first_date=first_date, last_date=last_date))
+    record_times = numpy.array(list(map(_record_times, records)), dtype=numpy.int64).reshape(len(records), 3)
+    date_ordinals = record_times[:, 0]
+    first_date_ordinal = first_date.toordinal() if first_date is not None else (
+        int(date_ordinals.min()) if len(date_ordinals) else None
+    )
+    last_date_ordinal = last_date.toordinal() if last_date is not None else (
+        int(date_ordinals.max()) if len(date_ordinals) else None
+    )
+    if first_date_ordinal is None or last_date_ordinal is None or first_date_ordinal > last_date_ordinal:
+        return OccupancyData(room_ids, None, 0, *(numpy.zeros(0, dtype=numpy.int64) for _ in range(4)))
+
+    return OccupancyData(
+        room_ids,
+        date.fromordinal(first_date_ordinal),
+        last_date_ordinal - first_date_ordinal + 1,
+        numpy.fromiter(
+            map(room_positions.__getitem__, map(_record_room_id, records)),
+            dtype=numpy.int64,
+            count=len(records),
+        ),
+        date_ordinals - first_date_ordinal,
+        record_times[:, 1] // SLOT_MINUTES,
+        -(-record_times[:, 2] // SLOT_MINUTES),
+    )
+
+
+def _rounded(values):
+    return [round(float(value), 4) for value in values]
+
+
+def utilisation_report(
+    reservation_book,
+    first_date=None,
+    last_date=None,
+    opening_time=DEFAULT_OPENING_TIME,
+    closing_time=DEFAULT_CLOSING_TIME,
+):
+    # Utilisation is the share of opening-hours slots in which a room is booked;
+    # "seat" figures weight every room by Classroom.capacity.
+    _require_numpy()
+    if opening_time >= closing_time:
+        raise ValueError("Opening time must be earlier than closing time.")
+    if first_date is not None and last_date is not None and first_date > last_date:
+        raise ValueError("First date must not be after last date.")
+
+    occupancy_data = build_occupancy_data(reservation_book, first_date=first_date, last_date=last_date)
+    room_ids = occupancy_data.room_ids
+    report = {
+        "first_date": occupancy_data.first_date.isoformat() if occupancy_data.first_date is not None else None,
+        "last_date": None,
+        "days": occupancy_data.day_count,
+        "slot_minutes": SLOT_MINUTES,
+        "opening_time": opening_time.strftime("%H:%M"),
+        "closing_time": closing_time.strftime("%H:%M"),
+        "rooms": [],
+        "buildings": [],
+        "weekdays": [],
+        "hours": [],
+        "peak_hours": [],
+        "unused_rooms": list(room_ids),
+    }
+    if not room_ids or occupancy_data.day_count == 0:
+        return report
+    report["last_date"] = date.fromordinal(occupancy_data.first_date.toordinal() + occupancy_data.day_count - 1).isoformat()
+
+    classrooms = [reservation_book.classrooms_by_id[room_id] for room_id in room_ids]
+    capacities = numpy.array([classroom.capacity for classroom in classrooms], dtype=numpy.float64)
+    building_names = sorted({classroom.building_name for classroom in classrooms})
+    building_indexes = numpy.array(
+        [building_names.index(classroom.building_name) for classroom in classrooms],
+        dtype=numpy.int64,
+    )
+
+    opening_slot = _slot_of(opening_time)
+    closing_slot = _slot_of(closing_time)
+    window_slot_count = closing_slot - opening_slot
+    day_weekdays = (numpy.arange(occupancy_data.day_count) + occupancy_data.first_date.weekday()) % 7
+
+    room_slot_counts = numpy.zeros((len(room_ids), window_slot_count), dtype=numpy.int64)
+    room_weekday_counts = numpy.zeros((len(room_ids), 7), dtype=numpy.int64)
+    room_any_use = numpy.zeros(len(room_ids), dtype=bool)
+
+    chunk_days = max(1, MAX_CHUNK_CELLS // (len(room_ids) * SLOTS_PER_DAY))
+    for first_day_index in range(0, occupancy_data.day_count, chunk_days):
+        end_day_index = min(first_day_index + chunk_days, occupancy_data.day_count)
+        occupancy = occupancy_data.occupancy_matrix(first_day_index, end_day_index)
+        room_any_use |= occupancy.any(axis=(1, 2))
+
+        window = occupancy[:, :, opening_slot:closing_slot]
+        room_slot_counts += window.sum(axis=1)
+        room_day_counts = window.sum(axis=2)
+        weekday_columns = numpy.eye(7, dtype=numpy.int64)[day_weekdays[first_day_index:end_day_index]]
+        room_weekday_counts += room_day_counts @ weekday_columns
+
+    available_room_slots = occupancy_data.day_count * window_slot_count
+    room_used_slots = room_slot_counts.sum(axis=1)
+    room_utilisation = room_used_slots / available_room_slots
+
+    report["rooms"] = [
+        {
+            "room_id": room_ids[room_position],
+            "building": classrooms[room_position].building_name,
+            "capacity": classrooms[room_position].capacity,
+            "booked_hours": round(float(room_used_slots[room_position]) * SLOT_MINUTES / 60, 2),
+            "utilisation": round(float(room_utilisation[room_position]), 4),
+        }
+        for room_position in numpy.lexsort((numpy.arange(len(room_ids)), -room_utilisation))
+    ]
+
+    building_room_counts = numpy.bincount(building_indexes, minlength=len(building_names))
+    building_used_slots = numpy.bincount(building_indexes, weights=room_used_slots, minlength=len(building_names))
+    building_seat_slots = numpy.bincount(building_indexes, weights=room_used_slots * capacities, minlength=len(building_names))
+    building_capacities = numpy.bincount(building_indexes, weights=capacities, minlength=len(building_names))
+    report["buildings"] = [
+        {"building": building_name, "rooms": int(room_count), "utilisation": utilisation, "seat_utilisation": seat_utilisation}
+        for building_name, room_count, utilisation, seat_utilisation in zip(
+            building_names,
+            building_room_counts,
+            _rounded(building_used_slots / (building_room_counts * available_room_slots)),
+            _rounded(building_seat_slots / (building_capacities * available_room_slots)),
+        )
+    ]
+
+    weekday_day_counts = numpy.bincount(day_weekdays, minlength=7)
+    weekday_used_slots = room_weekday_counts.sum(axis=0)
+    weekday_seat_slots = capacities @ room_weekday_counts
+    report["weekdays"] = [
+        {
+            "weekday": WEEKDAY_NAMES[weekday],
+            "days": int(weekday_day_counts[weekday]),
+            "utilisation": utilisation,
+            "seat_utilisation": seat_utilisation,
+        }
+        for weekday, utilisation, seat_utilisation in zip(
+            range(7),
+            _rounded(weekday_used_slots / (len(room_ids) * numpy.maximum(weekday_day_counts, 1) * window_slot_count)),
+            _rounded(weekday_seat_slots / (capacities.sum() * numpy.maximum(weekday_day_counts, 1) * window_slot_count)),
+        )
+        if weekday_day_counts[weekday]
+    ]
+
+    slot_hours = (numpy.arange(opening_slot, closing_slot) * SLOT_MINUTES) // 60
+    hour_values = numpy.unique(slot_hours)
+    hour_positions = numpy.searchsorted(hour_values, slot_hours)
+    hour_slot_counts = numpy.bincount(hour_positions)
+    hour_used_slots = numpy.bincount(hour_positions, weights=room_slot_counts.sum(axis=0))
+    hour_seat_slots = numpy.bincount(hour_positions, weights=capacities @ room_slot_counts)
+    hour_utilisation = hour_used_slots / (len(room_ids) * occupancy_data.day_count * hour_slot_counts)
+    hour_seat_utilisation = hour_seat_slots / (capacities.sum() * occupancy_data.day_count * hour_slot_counts)
+    report["hours"] = [
+        {"hour": "{:02d}:00".format(int(hour)), "utilisation": utilisation, "seat_utilisation": seat_utilisation}
+        for hour, utilisation, seat_utilisation in zip(hour_values, _rounded(hour_utilisation), _rounded(hour_seat_utilisation))
+    ]
+    report["peak_hours"] = sorted(report["hours"], key=lambda hour_data: (-hour_data["seat_utilisation"], hour_data["hour"]))[:PEAK_HOUR_COUNT]
+    report["unused_rooms"] = [room_ids[room_position] for room_position in numpy.flatnonzero(~room_any_use)]
+    return report
@@ -0,0 +1,77 @@
+import threading
+import time
+from classroom import classroom_from_dict
+from binary_snapshot import is_binary_snapshot
+
+
+class BackgroundBookLoad:
+    # Loads a book file on a daemon thread while the menu is already usable. Once
+    # the JSON document is decoded its classrooms are published on their own, and
+    # the same thread then builds the indexed book. A binary snapshot is also
+    # memory-mapped here, so its classrooms and listings are available at once.
+    def __init__(self, storage, filename):
+        self.storage = storage
+        self.filename = filename
+        self.classrooms = None
+        self.snapshot = None
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._reservation_book = None
+        self._error = None
+        self._classrooms_published = threading.Event()
+        self._finished = threading.Event()
+        self._open_snapshot()
+        self._thread = threading.Thread(target=self._run, name="book-loader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._reservation_book = self.storage.load_from_file(
+                self.filename,
+                book_data_callback=self._publish_classrooms,
+            )
+        except Exception as error:
+            self._error = error
+        finally:
+            self.finished_at = time.perf_counter()
+            self._classrooms_published.set()
+            self._finished.set()
+
+    def _open_snapshot(self):
+        # The loader thread maps the file again and reports any error itself.
+        try:
+            if is_binary_snapshot(self.filename):
+                self.snapshot = self.storage.open_binary_snapshot(self.filename)
+        except (OSError, ValueError):
+            return
+        if self.snapshot is not None:
+            self.classrooms = self.snapshot.list_classrooms()
+            self._classrooms_published.set()
+
+    def _publish_classrooms(self, book_data):
+        self.classrooms = sorted(
+            (classroom_from_dict(classroom_data) for classroom_data in book_data.get("classrooms", [])),
+            key=lambda classroom: (classroom.building_name, classroom.room_id),
+        )
+        self._classrooms_published.set()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def elapsed_seconds(self):
+        return (self.finished_at if self.finished_at is not None else time.perf_counter()) - self.started_at
+
+    def wait_for_classrooms(self):
+        # None when the file is not JSON or failed to load; the full book is
+        # then the only source of classrooms.
+        self._classrooms_published.wait()
+        return self.classrooms
+
+    def wait(self):
+        self._finished.wait()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+        if self._error is not None:
+            raise self._error
+        return self._reservation_book
@@ -0,0 +1,330 @@
+import io
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+from errors import ReservationConflictError, NotFoundError
+from cli import AppContext
+from reservation_query import reservation_query_from_fields
+from exporters import EXPORT_FORMATS, export_csv, export_icalendar, export_json_lines
+from room_assignment import assign_rooms, read_assignment_requests
+import handlers
+
+
+OUTPUT_FLUSH_INTERVAL = 1000
+
+
+def _answer_reader(answers):
+    remaining_answers = iter(answers)
+
+    def read_answer(prompt_text):
+        return next(remaining_answers)
+
+    return read_answer
+
+
+def _field_text(command_data, field_name):
+    value = command_data.get(field_name)
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    return str(value).strip()
+
+
+def _parse_filters(app_context, command_data):
+    room_id = None
+    reservation_date = None
+    if command_data.get("room_id") is not None:
+        room_id = app_context.validator.require_non_empty_text(command_data["room_id"], "Room ID")
+    if command_data.get("date") is not None:
+        reservation_date = app_context.validator.parse_iso_date(command_data["date"])
+    return room_id, reservation_date
+
+
+def _reservation_result(reservation):
+    reservation_data = reservation.to_dict()
+    reservation_data["reservation_id"] = reservation.reservation_id
+    if reservation.series_id is not None:
+        reservation_data["series_id"] = reservation.series_id
+    return reservation_data
+
+
+def _series_result(series):
+    series_data = series.to_dict()
+    series_data["series_id"] = series.series_id
+    return series_data
+
+
+def run_add_classroom(app_context, command_data):
+    handlers.add_classroom(app_context, _answer_reader([
+        _field_text(command_data, "room_id"),
+        _field_text(command_data, "building"),
+        _field_text(command_data, "capacity"),
+        _field_text(command_data, "equipment"),
+    ]))
+    return {}
+
+
+def run_add_reservation(app_context, command_data):
+    reservation_id = handlers.add_reservation(app_context, _answer_reader([
+        _field_text(command_data, "room_id"),
+        _field_text(command_data, "person"),
+        _field_text(command_data, "purpose"),
+        _field_text(command_data, "date"),
+        _field_text(command_data, "start_time"),
+        _field_text(command_data, "end_time"),
+    ]), offer_alternatives=False)
+    return {"reservation_id": reservation_id}
+
+
+def run_remove(app_context, command_data):
+    if command_data.get("reservation_id") is not None:
+        reservation_id = app_context.validator.require_positive_integer(
+            command_data["reservation_id"],
+            "Reservation ID",
+        )
+        removed = app_context.reservation_book.remove_reservation_by_id(reservation_id)
+    else:
+        room_id, reservation_date = _parse_filters(app_context, command_data)
+        reservation_number = app_context.validator.require_positive_integer(
+            _field_text(command_data, "number"),
+            "Index",
+        )
+        removed = app_context.reservation_book.remove_reservation(
+            reservation_number,
+            room_id=room_id,
+            reservation_date=reservation_date,
+        )
+    return {"removed": _reservation_result(removed)}
+
+
+def run_list(app_context, command_data):
+    room_id, reservation_date = _parse_filters(app_context, command_data)
+    reservation_list = app_context.reservation_book.list_reservations(
+        room_id=room_id,
+        reservation_date=reservation_date,
+    )
+    return {"reservations": [_reservation_result(reservation) for reservation in reservation_list]}
+
+
+def run_add_series(app_context, command_data):
+    series_id = handlers.add_series(app_context, _answer_reader([
+        _field_text(command_data, "room_id"),
+        _field_text(command_data, "person"),
+        _field_text(command_data, "purpose"),
+        _field_text(command_data, "first_date"),
+        _field_text(command_data, "last_date"),
+        _field_text(command_data, "interval_days"),
+        _field_text(command_data, "start_time"),
+        _field_text(command_data, "end_time"),
+        _field_text(command_data, "excluded_dates"),
+    ]))
+    return {"series_id": series_id}
+
+
+def run_list_series(app_context, command_data):
+    return {"series": [_series_result(series) for series in app_context.reservation_book.list_series()]}
+
+
+def run_remove_series(app_context, command_data):
+    series_id = app_context.validator.require_positive_integer(_field_text(command_data, "series_id"), "Series ID")
+    return {"removed": _series_result(app_context.reservation_book.remove_series(series_id))}
+
+
+def run_list_classrooms(app_context, command_data):
+    return {"classrooms": [classroom.to_dict() for classroom in app_context.reservation_book.list_classrooms()]}
+
+
+def run_save(app_context, command_data):
+    handlers.save_book_to_file(app_context, _answer_reader([_field_text(command_data, "filename")]))
+    return {}
+
+
+def run_load(app_context, command_data):
+    handlers.load_book_from_file(app_context, _answer_reader([_field_text(command_data, "filename")]))
+    return {}
+
+
+def run_export(app_context, command_data):
+    export_format = _field_text(command_data, "format")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Format must be one of: {}.".format(", ".join(EXPORT_FORMATS)))
+    filename = app_context.validator.require_non_empty_text(_field_text(command_data, "filename"), "Filename")
+
+    if export_format == "ics":
+        room_id = _field_text(command_data, "room_id") or None
+        person_name = _field_text(command_data, "person") or None
+        export_icalendar(
+            app_context.reservation_book,
+            filename,
+            room_id=room_id,
+            person_name=person_name,
+            calendar_name=room_id or person_name or "Reservations",
+        )
+    elif export_format == "csv":
+        export_csv(
+            app_context.reservation_book,
+            filename,
+            query=reservation_query_from_fields(command_data, app_context.validator),
+        )
+    else:
+        export_json_lines(
+            app_context.reservation_book,
+            filename,
+            query=reservation_query_from_fields(command_data, app_context.validator),
+        )
+    return {"filename": filename}
+
+
+def run_assign_rooms(app_context, command_data):
+    # Either a request file or the requests inline; "preview": true only reports.
+    if isinstance(command_data.get("requests"), list):
+        requests_data = command_data["requests"]
+    else:
+        requests_data = read_assignment_requests(
+            app_context.validator.require_non_empty_text(_field_text(command_data, "filename"), "Filename")
+        )
+    report = assign_rooms(
+        app_context.reservation_book,
+        requests_data,
+        app_context.validator,
+        commit=not command_data.get("preview", False),
+    )
+    return {
+        "placed": report["placed"],
+        "unplaced": report["unplaced"],
+        "committed": report["committed"],
+    }
+
+
+def run_transaction(app_context, command_data):
+    # The nested "commands" run all or nothing: if one fails, the book is left as
+    # it was before the first and the error names the failing command.
+    nested_commands = command_data.get("commands")
+    if not isinstance(nested_commands, list):
+        raise ValueError("Transaction needs a list of commands.")
+
+    results = []
+    with app_context.reservation_book.transaction():
+        for command_number, nested_command in enumerate(nested_commands, start=1):
+            if isinstance(nested_command, dict) and nested_command.get("command") == "load":
+                raise ValueError("Command #{}: 'load' cannot run inside a transaction.".format(command_number))
+            try:
+                results.append(run_batch_command(app_context, nested_command))
+            except ReservationConflictError as error:
+                raise ReservationConflictError("Command #{}: {}".format(command_number, error))
+            # Not type(error): some errors, e.g. UnicodeDecodeError, cannot be
+            # built from a message alone.
+            except (ValueError, NotFoundError, OSError) as error:
+                raise ValueError("Command #{}: {}".format(command_number, error)) from error
+    return {"results": results}
+
+
+BATCH_COMMANDS = {
+    "add_classroom": run_add_classroom,
+    "add_reservation": run_add_reservation,
+    "remove": run_remove,
+    "list": run_list,
+    "list_classrooms": run_list_classrooms,
+    "add_series": run_add_series,
+    "list_series": run_list_series,
+    "remove_series": run_remove_series,
+    "save": run_save,
+    "load": run_load,
+    "export": run_export,
+    "assign_rooms": run_assign_rooms,
+    "transaction": run_transaction,
+}
+
+
+def run_batch_command(app_context, command_data):
+    if not isinstance(command_data, dict):
+        raise ValueError("Command must be a JSON object.")
+
+    command_name = command_data.get("command")
+    command_runner = BATCH_COMMANDS.get(command_name)
+    if command_runner is None:
+        raise ValueError("Unknown command '{}'.".format(command_name))
+
+    return command_runner(app_context, command_data)
+
+
+def run_batch(app_context, command_lines, output_stream):
+    pending_results = []
+    succeeded_count = 0
+    failed_count = 0
+    started_at = time.perf_counter()
+
+    # Handlers report through print(); capture it per command instead of showing it.
+    captured_output = io.StringIO()
+    with redirect_stdout(captured_output):
+        for line_number, line in enumerate(command_lines, start=1):
+            if not line.strip():
+                continue
+
+            command_name = None
+            captured_output.seek(0)
+            captured_output.truncate()
+
+            try:
+                command_data = json.loads(line)
+                if isinstance(command_data, dict):
+                    command_name = command_data.get("command")
+                result = {"line": line_number, "command": command_name, "status": "ok"}
+                result.update(run_batch_command(app_context, command_data))
+                succeeded_count += 1
+            except json.JSONDecodeError as error:
+                result = {"line": line_number, "command": None, "status": "error",
+                          "message": "Invalid JSON: {}".format(error)}
+                failed_count += 1
+            except ReservationConflictError as error:
+                result = {"line": line_number, "command": command_name, "status": "conflict", "message": str(error)}
+                failed_count += 1
+            except (ValueError, NotFoundError, OSError, FileNotFoundError) as error:
+                result = {"line": line_number, "command": command_name, "status": "error", "message": str(error)}
+                failed_count += 1
+
+            printed_text = captured_output.getvalue().strip()
+            if printed_text and "message" not in result:
+                result["message"] = printed_text
+
+            pending_results.append(json.dumps(result, ensure_ascii=False))
+            if len(pending_results) >= OUTPUT_FLUSH_INTERVAL:
+                output_stream.write("\n".join(pending_results) + "\n")
+                pending_results = []
+
+    if pending_results:
+        output_stream.write("\n".join(pending_results) + "\n")
+    output_stream.flush()
+
+    return succeeded_count, failed_count, time.perf_counter() - started_at
+
+
+def run_batch_file(filename, output_stream=None, parallel_workers=None):
+    app_context = AppContext(parallel_workers=parallel_workers)
+    output_stream = output_stream if output_stream is not None else sys.stdout
+
+    try:
+        if filename == "-":
+            counts = run_batch(app_context, sys.stdin, output_stream)
+        else:
+            with open(filename, encoding="utf-8") as command_file:
+                counts = run_batch(app_context, command_file, output_stream)
+    finally:
+        handlers.close_journal(app_context)
+        app_context.reservation_book.close()
+
+    succeeded_count, failed_count, elapsed_seconds = counts
+    total_count = succeeded_count + failed_count
+    print(
+        "Processed {} commands ({} ok, {} failed) in {:.3f}s ({:.0f} commands/s).".format(
+            total_count,
+            succeeded_count,
+            failed_count,
+            elapsed_seconds,
+            total_count / elapsed_seconds if elapsed_seconds > 0 else 0,
+        ),
+        file=sys.stderr,
+    )
+    return 0 if failed_count == 0 else 1
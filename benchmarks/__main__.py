@@ -0,0 +1,106 @@
+import argparse
+import sys
+from benchmarks.data_generator import write_book_file
+from benchmarks.runner import (
+    DEFAULT_SIZES,
+    DEFAULT_REGRESSION_THRESHOLD,
+    run_benchmarks,
+    compare_results,
+    load_results,
+    write_results,
+)
+
+
+def parse_sizes(raw_value):
+    return [int(size_text.lower().replace("k", "000").replace("m", "000000")) for size_text in raw_value.split(",")]
+
+
+def print_comparison(comparisons, threshold):
+    regressions = [comparison for comparison in comparisons if comparison["regression"]]
+    for comparison in comparisons:
+        print("{:<7} {:<50} {:>12.3f} -> {:>12.3f} us  {:+.1%}".format(
+            "REGRESS" if comparison["regression"] else "ok",
+            comparison["benchmark"],
+            comparison["baseline_us"],
+            comparison["current_us"],
+            comparison["change"],
+        ))
+    print("{} benchmark(s) compared, {} slower than the baseline by more than {:.0%}.".format(
+        len(comparisons),
+        len(regressions),
+        threshold,
+    ))
+    return 1 if regressions else 0
+
+
+def parse_arguments(argument_list):
+    argument_parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmarks for ReservationBook and Storage",
+    )
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write JSON results")
+    run_parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=list(DEFAULT_SIZES),
+        help="comma-separated reservation counts, e.g. 1k,10k,100k,1m (default: 1k,10k,100k)",
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="benchmark_results.json", help="results file to write")
+    run_parser.add_argument("--no-binary", action="store_true", help="skip the binary snapshot round-trip")
+    run_parser.add_argument("--baseline", help="compare against this results file after the run")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_REGRESSION_THRESHOLD,
+        help="relative slowdown reported as a regression (default: 0.25 = 25%%)",
+    )
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic reservation book")
+    generate_parser.add_argument("filename")
+    generate_parser.add_argument("--reservations", type=parse_sizes, default=[10000])
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    return argument_parser.parse_args(argument_list)
+
+
+def main(argument_list):
+    arguments = parse_arguments(argument_list)
+
+    if arguments.command == "generate":
+        write_book_file(arguments.filename, arguments.reservations[0], seed=arguments.seed)
+        print("Wrote {} reservations to {}".format(arguments.reservations[0], arguments.filename))
+        return 0
+
+    if arguments.command == "compare":
+        return print_comparison(
+            compare_results(load_results(arguments.baseline), load_results(arguments.current), arguments.threshold),
+            arguments.threshold,
+        )
+
+    results = run_benchmarks(
+        sizes=arguments.sizes,
+        seed=arguments.seed,
+        include_binary=not arguments.no_binary,
+        progress_callback=lambda size: print("Running {} reservations...".format(size), file=sys.stderr),
+    )
+    write_results(results, arguments.output)
+    print("Results written to {}".format(arguments.output))
+
+    if arguments.baseline is not None:
+        return print_comparison(
+            compare_results(load_results(arguments.baseline), results, arguments.threshold),
+            arguments.threshold,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
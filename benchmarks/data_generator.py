@@ -0,0 +1,99 @@
+import json
+import math
+import random
+from datetime import date, timedelta
+
+
+FIRST_TEACHING_DAY = date(2026, 2, 16)
+TEACHING_SLOTS = (
+    ("08:00", "09:30"),
+    ("09:45", "11:15"),
+    ("11:30", "13:00"),
+    ("13:15", "14:45"),
+    ("15:00", "16:30"),
+    ("16:45", "18:15"),
+)
+SLOT_OCCUPANCY = 0.7
+ROOMS_PER_BUILDING = 25
+EQUIPMENT_ITEMS = ("projector", "whiteboard", "computers", "microphone", "smartboard", "camera")
+PURPOSES = ("lecture", "seminar", "lab", "exam", "consultation", "tutorial")
+TITLES = ("Dr.", "Ing.", "Mgr.", "Prof.", "Bc.")
+SURNAMES = (
+    "Novak", "Svoboda", "Novotny", "Dvorak", "Cerny", "Prochazka", "Kucera", "Vesely",
+    "Horak", "Nemec", "Marek", "Pospisil", "Hajek", "Jelinek", "Kral", "Ruzicka",
+)
+
+
+def room_count_for(reservation_count):
+    return min(2000, max(10, reservation_count // 500))
+
+
+def teaching_days(day_count):
+    # Weekdays only, starting on a Monday.
+    current_date = FIRST_TEACHING_DAY
+    while day_count > 0:
+        if current_date.weekday() < 5:
+            yield current_date
+            day_count -= 1
+        current_date += timedelta(days=1)
+
+
+def generate_classrooms(room_count, random_generator):
+    classrooms_data = []
+    for room_number in range(room_count):
+        building_letter = chr(ord("A") + room_number // ROOMS_PER_BUILDING % 26)
+        building_number = room_number // (ROOMS_PER_BUILDING * 26)
+        building_name = "Building {}{}".format(building_letter, building_number or "")
+        classrooms_data.append({
+            "room_id": "{}{}{:02d}".format(building_name.split()[-1], 1 + room_number % ROOMS_PER_BUILDING // 10, room_number % 10),
+            "building": building_name,
+            "capacity": random_generator.choice((12, 20, 24, 30, 40, 60, 80, 120, 200)),
+            "equipment": sorted(random_generator.sample(EQUIPMENT_ITEMS, random_generator.randrange(0, 4))),
+        })
+    return classrooms_data
+
+
+def generate_people(person_count):
+    return [
+        "{} {} {}".format(TITLES[person_number % len(TITLES)], SURNAMES[person_number % len(SURNAMES)], person_number)
+        for person_number in range(person_count)
+    ]
+
+
+def generate_book_data(reservation_count, seed=0):
+    # Dense weekday timetable: every teaching slot of every day fills about 70% of
+    # the rooms, and a person teaches at most one room per slot, so the book is
+    # conflict-free and loads without errors.
+    random_generator = random.Random(seed)
+    room_count = room_count_for(reservation_count)
+    rooms_per_slot = max(1, int(room_count * SLOT_OCCUPANCY))
+    day_count = max(1, math.ceil(reservation_count / (rooms_per_slot * len(TEACHING_SLOTS))))
+
+    classrooms_data = generate_classrooms(room_count, random_generator)
+    room_ids = [classroom_data["room_id"] for classroom_data in classrooms_data]
+    people = generate_people(max(rooms_per_slot * 2, 10))
+
+    reservations_data = []
+    for teaching_day in teaching_days(day_count):
+        date_text = teaching_day.isoformat()
+        for start_time, end_time in TEACHING_SLOTS:
+            booked_rooms = random_generator.sample(room_ids, rooms_per_slot)
+            teachers = random_generator.sample(people, rooms_per_slot)
+            for room_id, person_name in zip(booked_rooms, teachers):
+                reservations_data.append({
+                    "room_id": room_id,
+                    "person": person_name,
+                    "purpose": random_generator.choice(PURPOSES),
+                    "date": date_text,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                })
+                if len(reservations_data) == reservation_count:
+                    return {"classrooms": classrooms_data, "reservations": reservations_data}
+
+    return {"classrooms": classrooms_data, "reservations": reservations_data}
+
+
+def write_book_file(filename, reservation_count, seed=0):
+    with open(filename, "w", encoding="utf-8") as book_file:
+        json.dump(generate_book_data(reservation_count, seed=seed), book_file, ensure_ascii=False)
@@ -0,0 +1,261 @@
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timezone
+from reservation import reservation_from_dict
+from reservation_book import reservation_book_from_dict
+from storage import Storage
+from validator import Validator
+from benchmarks.data_generator import generate_book_data
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+SAMPLED_OPERATIONS = 200
+FILE_ROUND_REPEATS = 3
+
+
+def _timing_result(durations):
+    # Per-operation figures in microseconds; "best" is the fastest repeat and is
+    # what the comparison mode uses, being the least sensitive to machine noise.
+    per_operation = [duration * 1e6 for duration in durations]
+    return {
+        "repeats": len(durations),
+        "best_us": round(min(per_operation), 3),
+        "median_us": round(statistics.median(per_operation), 3),
+        "total_seconds": round(sum(durations), 6),
+    }
+
+
+def _time_each(callables):
+    durations = []
+    for function in callables:
+        started_at = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started_at)
+    return durations
+
+
+def benchmark_add_reservation(book_data, random_generator):
+    # The book is loaded without a sample of its reservations, which are then added
+    # back one by one through the public add_reservation path.
+    reservations_data = book_data["reservations"]
+    held_back_positions = set(random_generator.sample(
+        range(len(reservations_data)),
+        min(SAMPLED_OPERATIONS, len(reservations_data)),
+    ))
+    reservation_book = reservation_book_from_dict({
+        "classrooms": book_data["classrooms"],
+        "reservations": [
+            reservation_data
+            for position, reservation_data in enumerate(reservations_data)
+            if position not in held_back_positions
+        ],
+    })
+    held_back = [reservation_from_dict(reservations_data[position]) for position in sorted(held_back_positions)]
+    return _timing_result(_time_each(
+        (lambda reservation=reservation: reservation_book.add_reservation(reservation))
+        for reservation in held_back
+    ))
+
+
+def benchmark_list_reservations(reservation_book, book_data, random_generator):
+    room_ids = list(reservation_book.classrooms_by_id)
+    reservation_dates = sorted({reservation_data["date"] for reservation_data in book_data["reservations"]})
+    sampled_dates = [
+        date.fromisoformat(date_text)
+        for date_text in random_generator.choices(reservation_dates, k=SAMPLED_OPERATIONS)
+    ]
+    sampled_rooms = random_generator.choices(room_ids, k=SAMPLED_OPERATIONS)
+
+    return {
+        "all": _timing_result(_time_each([reservation_book.list_reservations] * FILE_ROUND_REPEATS)),
+        "by_room": _timing_result(_time_each(
+            (lambda room_id=room_id: reservation_book.list_reservations(room_id=room_id))
+            for room_id in sampled_rooms
+        )),
+        "by_date": _timing_result(_time_each(
+            (lambda reservation_date=reservation_date: reservation_book.list_reservations(reservation_date=reservation_date))
+            for reservation_date in sampled_dates
+        )),
+        "by_room_and_date": _timing_result(_time_each(
+            (lambda room_id=room_id, reservation_date=reservation_date: reservation_book.list_reservations(
+                room_id=room_id,
+                reservation_date=reservation_date,
+            ))
+            for room_id, reservation_date in zip(sampled_rooms, sampled_dates)
+        )),
+    }
+
+
+def benchmark_remove_reservation(reservation_book, random_generator):
+    # Removal positions are drawn up front against the shrinking per-room counts,
+    # so only remove_reservation itself is timed.
+    room_counts = {
+        room_id: len(reservation_book.list_reservations(room_id=room_id))
+        for room_id in reservation_book.classrooms_by_id
+    }
+    removals = []
+    for room_id in random_generator.choices(list(room_counts), k=SAMPLED_OPERATIONS):
+        if room_counts[room_id]:
+            removals.append((room_id, random_generator.randrange(1, room_counts[room_id] + 1)))
+            room_counts[room_id] -= 1
+
+    return _timing_result(_time_each(
+        (lambda room_id=room_id, reservation_number=reservation_number: reservation_book.remove_reservation(
+            reservation_number,
+            room_id=room_id,
+        ))
+        for room_id, reservation_number in removals
+    ))
+
+
+def _per_record_result(durations, record_count):
+    timing_result = _timing_result([duration / record_count for duration in durations])
+    timing_result["total_seconds"] = round(sum(durations), 6)
+    timing_result["records_per_second"] = round(record_count / min(durations))
+    return timing_result
+
+
+def benchmark_decoding(book_data):
+    # The field decoding every load runs per record, and the interactive parsers on
+    # the same values. The rows go through a JSON round trip so that, as after a
+    # real load, equal strings are separate objects.
+    reservations_data = json.loads(json.dumps(book_data["reservations"]))
+    validator = Validator()
+
+    def decode_all():
+        for reservation_data in reservations_data:
+            reservation_from_dict(reservation_data)
+
+    def parse_all():
+        for reservation_data in reservations_data:
+            validator.parse_iso_date(reservation_data["date"])
+            validator.parse_hhmm_time(reservation_data["start_time"])
+            validator.parse_hhmm_time(reservation_data["end_time"])
+
+    return {
+        "reservation_from_dict": _per_record_result(
+            _time_each([decode_all] * FILE_ROUND_REPEATS),
+            len(reservations_data),
+        ),
+        "validator_date_and_times": _per_record_result(
+            _time_each([parse_all] * FILE_ROUND_REPEATS),
+            len(reservations_data),
+        ),
+    }
+
+
+def benchmark_storage(reservation_book, work_directory, suffix):
+    storage = Storage()
+    filename = os.path.join(work_directory, "book" + suffix)
+    save_durations = _time_each([lambda: storage.save_to_file(reservation_book, filename)] * FILE_ROUND_REPEATS)
+    file_size = os.path.getsize(filename)
+
+    loaded_books = []
+    load_durations = _time_each([lambda: loaded_books.append(storage.load_from_file(filename))] * FILE_ROUND_REPEATS)
+    if loaded_books[-1].to_dict() != reservation_book.to_dict():
+        raise ValueError("Round-trip through {} changed the book.".format(filename))
+
+    return {
+        "save": _timing_result(save_durations),
+        "load": _timing_result(load_durations),
+        "file_bytes": file_size,
+    }
+
+
+def run_size(reservation_count, seed=0, include_binary=True):
+    random_generator = random.Random(seed)
+
+    started_at = time.perf_counter()
+    book_data = generate_book_data(reservation_count, seed=seed)
+    generation_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    reservation_book = reservation_book_from_dict(book_data)
+    build_seconds = time.perf_counter() - started_at
+
+    size_results = {
+        "reservations": len(book_data["reservations"]),
+        "classrooms": len(book_data["classrooms"]),
+        "generate_seconds": round(generation_seconds, 6),
+        "build_from_dict": _timing_result([build_seconds]),
+        "add_reservation": benchmark_add_reservation(book_data, random_generator),
+        "list_reservations": benchmark_list_reservations(reservation_book, book_data, random_generator),
+        "decoding": benchmark_decoding(book_data),
+    }
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        size_results["json_round_trip"] = benchmark_storage(reservation_book, work_directory, ".json")
+        if include_binary:
+            size_results["binary_round_trip"] = benchmark_storage(reservation_book, work_directory, ".crsb")
+
+    size_results["remove_reservation"] = benchmark_remove_reservation(reservation_book, random_generator)
+    return size_results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, seed=0, include_binary=True, progress_callback=None):
+    results = {
+        "metadata": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+        },
+        "sizes": {},
+    }
+    for reservation_count in sizes:
+        if progress_callback is not None:
+            progress_callback(reservation_count)
+        results["sizes"][str(reservation_count)] = run_size(reservation_count, seed=seed, include_binary=include_binary)
+    return results
+
+
+def iter_timings(results):
+    # Yields ("<size>/<operation path>", best_us) for every timing in a result file.
+    def walk(path, node):
+        if isinstance(node, dict):
+            if "best_us" in node:
+                yield path, node["best_us"]
+                return
+            for key in sorted(node):
+                yield from walk(path + "/" + key if path else key, node[key])
+
+    for size_key, size_results in results.get("sizes", {}).items():
+        yield from walk(size_key, size_results)
+
+
+def compare_results(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    baseline_timings = dict(iter_timings(baseline))
+    comparisons = []
+    for timing_path, current_us in iter_timings(current):
+        baseline_us = baseline_timings.get(timing_path)
+        if baseline_us is None or baseline_us <= 0:
+            continue
+        change = current_us / baseline_us - 1
+        comparisons.append({
+            "benchmark": timing_path,
+            "baseline_us": baseline_us,
+            "current_us": current_us,
+            "change": round(change, 4),
+            "regression": change > threshold,
+        })
+    return comparisons
+
+
+def load_results(filename):
+    with open(filename, encoding="utf-8") as results_file:
+        return json.load(results_file)
+
+
+def write_results(results, filename):
+    with open(filename, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+        results_file.write("\n")
@@ -0,0 +1,328 @@
+import json
+import mmap
+import struct
+from bisect import bisect_left
+from datetime import date, time
+from classroom import classroom_from_dict
+from reservation import Reservation
+from recurring_series import recurring_series_from_dict
+from reservation_book import ReservationBook
+
+
+SNAPSHOT_MAGIC = b"CRSB"
+SNAPSHOT_VERSION = 3
+_READABLE_VERSIONS = (1, 2, 3)
+
+# magic, version, record size, string count, reservation count, then the offsets of the
+# string offset table, string data, book metadata JSON (offset + length), reservation
+# records and the room-ordered permutation of the records. Version 1 stored only the
+# classrooms list as metadata; version 2 stores {"classrooms": [...], "series": [...]}.
+# Version 3 adds the reservation id to each record.
+_HEADER = struct.Struct("<4sHHIIQQQQQQ")
+# reservation id, room id, person, purpose (string ids), date ordinal, start minute,
+# end minute
+_RECORD = struct.Struct("<IIIIIHH")
+_DATE_FIELD_OFFSET = 16
+# Versions 1 and 2: the same without the reservation id, which is the record's
+# position plus one.
+_UNNUMBERED_RECORD = struct.Struct("<IIIIHH")
+_UNNUMBERED_DATE_FIELD_OFFSET = 12
+_UINT32 = struct.Struct("<I")
+
+
+def write_binary_snapshot(reservation_book):
+    records = list(reservation_book.iter_reservation_records())
+
+    # String ids follow the sorted order of the strings, so comparing ids compares
+    # the strings themselves and the (date, room, start) record order is preserved.
+    string_values = sorted(
+        {record.room_id for record in records}
+        | {record.person_name for record in records}
+        | {record.reservation_purpose for record in records}
+    )
+    string_ids = {string_value: string_id for string_id, string_value in enumerate(string_values)}
+
+    string_offsets = bytearray()
+    string_data = bytearray()
+    for string_value in string_values:
+        string_offsets += _UINT32.pack(len(string_data))
+        string_data += string_value.encode("utf-8")
+    string_offsets += _UINT32.pack(len(string_data))
+
+    classrooms_data = json.dumps(
+        {
+            "classrooms": [classroom.to_dict() for classroom in reservation_book.list_classrooms()],
+            "series": [series.to_dict() for series in reservation_book.list_series()],
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    record_data = bytearray(_RECORD.size * len(records))
+    for position, record in enumerate(records):
+        _RECORD.pack_into(
+            record_data,
+            position * _RECORD.size,
+            record.reservation_id,
+            string_ids[record.room_id],
+            string_ids[record.person_name],
+            string_ids[record.reservation_purpose],
+            record.date_ordinal,
+            record.start_minute,
+            record.end_minute,
+        )
+
+    room_order = sorted(
+        range(len(records)),
+        key=lambda position: (records[position].room_id, records[position].date_ordinal),
+    )
+    room_order_data = struct.pack("<{}I".format(len(room_order)), *room_order)
+
+    string_offsets_offset = _HEADER.size
+    string_data_offset = string_offsets_offset + len(string_offsets)
+    classrooms_offset = string_data_offset + len(string_data)
+    records_offset = classrooms_offset + len(classrooms_data)
+    room_order_offset = records_offset + len(record_data)
+
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        _RECORD.size,
+        len(string_values),
+        len(records),
+        string_offsets_offset,
+        string_data_offset,
+        classrooms_offset,
+        len(classrooms_data),
+        records_offset,
+        room_order_offset,
+    )
+    return b"".join((header, string_offsets, string_data, classrooms_data, record_data, room_order_data))
+
+
+def is_binary_snapshot(filename):
+    with open(filename, "rb") as snapshot_file:
+        return snapshot_file.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+class BinarySnapshot:
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Invalid binary snapshot: file is empty.")
+
+        if len(self._buffer) < _HEADER.size:
+            self.close()
+            raise ValueError("Invalid binary snapshot: header is truncated.")
+
+        (
+            magic,
+            version,
+            record_size,
+            self._string_count,
+            self._reservation_count,
+            self._string_offsets_offset,
+            self._string_data_offset,
+            classrooms_offset,
+            classrooms_length,
+            self._records_offset,
+            self._room_order_offset,
+        ) = _HEADER.unpack_from(self._buffer, 0)
+
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError("Invalid binary snapshot: wrong magic bytes.")
+        self._record = _RECORD if version >= 3 else _UNNUMBERED_RECORD
+        self._date_field_offset = _DATE_FIELD_OFFSET if version >= 3 else _UNNUMBERED_DATE_FIELD_OFFSET
+        if version not in _READABLE_VERSIONS or record_size != self._record.size:
+            self.close()
+            raise ValueError("Unsupported binary snapshot version {}.".format(version))
+
+        # A cut-off file would otherwise fail in struct calls or silently lose its
+        # last records.
+        for section_name, section_offset, section_length in (
+            ("string table", self._string_offsets_offset, 4 * (self._string_count + 1)),
+            ("metadata", classrooms_offset, classrooms_length),
+            ("reservation table", self._records_offset, self._reservation_count * record_size),
+            ("room order", self._room_order_offset, 4 * self._reservation_count),
+        ):
+            if section_offset + section_length > len(self._buffer):
+                self.close()
+                raise ValueError("Invalid binary snapshot: {} is truncated.".format(section_name))
+        string_data_length = _UINT32.unpack_from(self._buffer, self._string_offsets_offset + 4 * self._string_count)[0]
+        if self._string_data_offset + string_data_length > len(self._buffer):
+            self.close()
+            raise ValueError("Invalid binary snapshot: string data is truncated.")
+
+        self._string_cache = {}
+        self.classrooms_by_id = {}
+        try:
+            metadata = json.loads(self._buffer[classrooms_offset:classrooms_offset + classrooms_length].decode("utf-8"))
+            if version == 1:
+                metadata = {"classrooms": metadata}
+            self._series_data = metadata.get("series", [])
+            for classroom_data in metadata["classrooms"]:
+                classroom = classroom_from_dict(classroom_data)
+                self.classrooms_by_id[classroom.room_id] = classroom
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            self.close()
+            raise ValueError("Invalid binary snapshot metadata: {}".format(error))
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._reservation_count
+
+    def list_classrooms(self):
+        return sorted(
+            self.classrooms_by_id.values(),
+            key=lambda classroom: (classroom.building_name, classroom.room_id),
+        )
+
+    def list_series(self):
+        return [recurring_series_from_dict(series_data) for series_data in self._series_data]
+
+    def _string(self, string_id):
+        string_value = self._string_cache.get(string_id)
+        if string_value is None:
+            start, end = struct.unpack_from("<II", self._buffer, self._string_offsets_offset + 4 * string_id)
+            string_value = self._buffer[self._string_data_offset + start:self._string_data_offset + end].decode("utf-8")
+            self._string_cache[string_id] = string_value
+        return string_value
+
+    def _string_id(self, string_value):
+        string_id = bisect_left(range(self._string_count), string_value, key=self._string)
+        if string_id < self._string_count and self._string(string_id) == string_value:
+            return string_id
+        return None
+
+    def _date_ordinal_at(self, position):
+        return _UINT32.unpack_from(
+            self._buffer,
+            self._records_offset + position * self._record.size + self._date_field_offset,
+        )[0]
+
+    def _record_fields(self, position):
+        # (reservation id, room, person, purpose string ids, date ordinal, start
+        # minute, end minute) in every version.
+        record_fields = self._record.unpack_from(self._buffer, self._records_offset + position * self._record.size)
+        if self._record is _UNNUMBERED_RECORD:
+            return (position + 1,) + record_fields
+        return record_fields
+
+    def _room_ordered_position(self, room_position):
+        return _UINT32.unpack_from(self._buffer, self._room_order_offset + 4 * room_position)[0]
+
+    def _room_key_at(self, room_position):
+        _, room_string_id, _, _, date_ordinal, _, _ = self._record_fields(self._room_ordered_position(room_position))
+        return room_string_id, date_ordinal
+
+    def _reservation_at(self, position):
+        (
+            reservation_id,
+            room_string_id,
+            person_string_id,
+            purpose_string_id,
+            date_ordinal,
+            start_minute,
+            end_minute,
+        ) = self._record_fields(position)
+        return Reservation(
+            room_id=self._string(room_string_id),
+            person_name=self._string(person_string_id),
+            reservation_purpose=self._string(purpose_string_id),
+            reservation_date=date.fromordinal(date_ordinal),
+            start_time=time(*divmod(start_minute, 60)),
+            end_time=time(*divmod(end_minute, 60)),
+            reservation_id=reservation_id,
+        )
+
+    def iter_reservations(self, room_id=None, reservation_date=None):
+        if room_id is not None:
+            room_string_id = self._string_id(room_id)
+            if room_string_id is None:
+                return
+
+            first_key = (room_string_id, 0)
+            end_key = (room_string_id + 1, 0)
+            if reservation_date is not None:
+                first_key = (room_string_id, reservation_date.toordinal())
+                end_key = (room_string_id, reservation_date.toordinal() + 1)
+
+            room_position = bisect_left(range(self._reservation_count), first_key, key=self._room_key_at)
+            end_position = bisect_left(range(self._reservation_count), end_key, key=self._room_key_at)
+            for room_position in range(room_position, end_position):
+                yield self._reservation_at(self._room_ordered_position(room_position))
+            return
+
+        first_position = 0
+        end_position = self._reservation_count
+        if reservation_date is not None:
+            date_ordinal = reservation_date.toordinal()
+            first_position = bisect_left(range(self._reservation_count), date_ordinal, key=self._date_ordinal_at)
+            end_position = bisect_left(range(self._reservation_count), date_ordinal + 1, key=self._date_ordinal_at)
+
+        for position in range(first_position, end_position):
+            yield self._reservation_at(position)
+
+    def list_reservations(self, room_id=None, reservation_date=None):
+        return list(self.iter_reservations(room_id=room_id, reservation_date=reservation_date))
+
+    def iter_reservation_rows(self):
+        # (reservation id, room id, person, purpose, date ordinal, start minute, end
+        # minute) rows in listing order, without building Reservation objects.
+        records_end = self._records_offset + self._reservation_count * self._record.size
+        record_buffer = memoryview(self._buffer)[self._records_offset:records_end]
+        try:
+            for position, record_fields in enumerate(self._record.iter_unpack(record_buffer)):
+                if self._record is _UNNUMBERED_RECORD:
+                    record_fields = (position + 1,) + record_fields
+                (
+                    reservation_id,
+                    room_string_id,
+                    person_string_id,
+                    purpose_string_id,
+                    date_ordinal,
+                    start_minute,
+                    end_minute,
+                ) = record_fields
+                yield (
+                    reservation_id,
+                    self._string(room_string_id),
+                    self._string(person_string_id),
+                    self._string(purpose_string_id),
+                    date_ordinal,
+                    start_minute,
+                    end_minute,
+                )
+        finally:
+            record_buffer.release()
+
+    def to_reservation_book(self):
+        # Builds the whole in-memory book. The records were checked when the book
+        # they were written from was built, so they skip validation and the
+        # conflict sweep; only bookings of unknown rooms are refused.
+        reservation_book = ReservationBook()
+        for classroom in self.classrooms_by_id.values():
+            reservation_book.add_classroom(classroom)
+        for series in self.list_series():
+            reservation_book.add_series(series)
+        reservation_rows = list(self.iter_reservation_rows())
+        for reservation_row in reservation_rows:
+            if reservation_row[1] not in self.classrooms_by_id:
+                raise ValueError("Invalid binary snapshot: unknown classroom '{}'.".format(reservation_row[1]))
+        reservation_book.add_validated_reservation_rows(reservation_rows)
+        return reservation_book
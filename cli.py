@@ -1,7 +1,11 @@
+import time
 from reservation_book import ReservationBook
 from errors import ReservationConflictError, NotFoundError
 from validator import Validator
 from storage import Storage
+from metrics import metrics
+from background_loading import BackgroundBookLoad
+from sqlite_book import is_sqlite_book
 import handlers
 
 
@@ -17,15 +21,88 @@ MENU_TEXT = """
 8) Remove a reservation (optionally filtered list)
 9) Remove ALL reservations
 10) Delete reservation book completely (classrooms + reservations)
+11) Open reservation book with journaling (changes saved automatically)
+12) Find available classrooms (date, time, capacity, equipment)
+13) Insert recurring reservation series (weekly / every N days)
+14) Display recurring series
+15) Remove a recurring series
+16) Operation metrics (show / turn on or off / save to JSON)
+17) Room utilisation report (rooms, buildings, weekdays, peak hours)
+18) Open shared reservation book (several instances, one file)
+19) Export reservations (CSV / iCalendar / JSON lines)
+20) Assign rooms automatically from a request file
+21) Undo last changes
 0) Exit
 """
+# Changes the interactive menu can undo.
+UNDO_HISTORY_SIZE = 20
 
 
 class AppContext:
-    def __init__(self):
+    def __init__(self, parallel_workers=None, undo_history_size=0):
+        self.undo_history_size = undo_history_size
         self.reservation_book = ReservationBook()
         self.validator = Validator()
-        self.storage = Storage()
+        self.storage = Storage(parallel_workers=parallel_workers)
+        self.journal = None
+        self.pending_load = None
+
+    @property
+    def reservation_book(self):
+        # Anything that touches the book waits for a background load to finish;
+        # commands that do not need it stay responsive.
+        if self.pending_load is not None:
+            self.finish_pending_load()
+        return self._reservation_book
+
+    @reservation_book.setter
+    def reservation_book(self, reservation_book):
+        if self.undo_history_size and reservation_book.supports_snapshots:
+            reservation_book.keep_undo_history(self.undo_history_size)
+        self._reservation_book = reservation_book
+
+    def start_background_load(self, filename):
+        # A SQLite book opens at once, leaving its reservations in the file, and its
+        # connection only works on the thread that opened it.
+        try:
+            opens_at_once = is_sqlite_book(filename)
+        except OSError:
+            opens_at_once = False
+        if not opens_at_once:
+            self.pending_load = BackgroundBookLoad(self.storage, filename)
+            return
+
+        reservation_book = self.storage.load_from_file(filename)
+        self._reservation_book.close()
+        self.reservation_book = reservation_book
+        print("Loaded from {}".format(filename))
+
+    def finish_pending_load(self):
+        pending_load = self.pending_load
+        if not pending_load.done():
+            print("Waiting for {} to finish loading...".format(pending_load.filename))
+        self.pending_load = None
+        reservation_book = pending_load.wait()
+        self._reservation_book.close()
+        self.reservation_book = reservation_book
+        print("Loaded from {} in {:.2f}s".format(pending_load.filename, pending_load.elapsed_seconds()))
+
+    def loading_snapshot(self):
+        # The binary snapshot still being loaded, if its listings are complete
+        # without the book: recurring series are only expanded by the book.
+        pending_load = self.pending_load
+        if pending_load is None or pending_load.done() or pending_load.snapshot is None:
+            return None
+        if pending_load.snapshot.list_series():
+            return None
+        return pending_load.snapshot
+
+    def list_classrooms(self):
+        if self.pending_load is not None:
+            classrooms = self.pending_load.wait_for_classrooms()
+            if classrooms is not None:
+                return list(classrooms)
+        return self.reservation_book.list_classrooms()
 
 
 def read_user_input(prompt_text):
@@ -36,37 +113,76 @@ def read_user_input(prompt_text):
         raise SystemExit
 
 
-def run_cli():
-    app_context = AppContext()
+def run_cli(parallel_workers=None, enable_metrics=False, open_filename=None, started_at=None):
+    app_context = AppContext(parallel_workers=parallel_workers, undo_history_size=UNDO_HISTORY_SIZE)
+    if enable_metrics:
+        metrics.enable()
+    if open_filename is not None:
+        try:
+            app_context.start_background_load(open_filename)
+        except (ReservationConflictError, ValueError, NotFoundError, OSError) as error:
+            print("[ERROR] {}".format(error))
 
     command_handlers = {
-        "1": lambda: handlers.create_new_book(app_context),
-        "2": lambda: handlers.save_book_to_file(app_context, read_user_input),
-        "3": lambda: handlers.load_book_from_file(app_context, read_user_input),
-        "4": lambda: handlers.add_classroom(app_context, read_user_input),
-        "5": lambda: handlers.add_reservation(app_context, read_user_input),
-        "6": lambda: handlers.show_classrooms(app_context),
-        "7": lambda: handlers.show_reservations(app_context, read_user_input),
-        "8": lambda: handlers.remove_reservation(app_context, read_user_input),
-        "9": lambda: handlers.remove_all_reservations(app_context),
-        "10": lambda: handlers.delete_reservation_book(app_context),
+        "1": ("create_new_book", lambda: handlers.create_new_book(app_context)),
+        "2": ("save_book_to_file", lambda: handlers.save_book_to_file(app_context, read_user_input)),
+        "3": ("load_book_from_file", lambda: handlers.load_book_from_file(app_context, read_user_input)),
+        "4": ("add_classroom", lambda: handlers.add_classroom(app_context, read_user_input)),
+        "5": ("add_reservation", lambda: handlers.add_reservation(app_context, read_user_input)),
+        "6": ("show_classrooms", lambda: handlers.show_classrooms(app_context)),
+        "7": ("show_reservations", lambda: handlers.show_reservations(app_context, read_user_input)),
+        "8": ("remove_reservation", lambda: handlers.remove_reservation(app_context, read_user_input)),
+        "9": ("remove_all_reservations", lambda: handlers.remove_all_reservations(app_context)),
+        "10": ("delete_reservation_book", lambda: handlers.delete_reservation_book(app_context)),
+        "11": ("open_journaled_book", lambda: handlers.open_journaled_book(app_context, read_user_input)),
+        "12": ("find_available_classrooms", lambda: handlers.find_available_classrooms(app_context, read_user_input)),
+        "13": ("add_series", lambda: handlers.add_series(app_context, read_user_input)),
+        "14": ("show_series", lambda: handlers.show_series(app_context)),
+        "15": ("remove_series", lambda: handlers.remove_series(app_context, read_user_input)),
+        "16": ("manage_metrics", lambda: handlers.manage_metrics(app_context, read_user_input)),
+        "17": ("show_utilisation_report", lambda: handlers.show_utilisation_report(app_context, read_user_input)),
+        "18": ("open_shared_book", lambda: handlers.open_shared_book(app_context, read_user_input)),
+        "19": ("export_reservations", lambda: handlers.export_reservations(app_context, read_user_input)),
+        "20": ("assign_rooms", lambda: handlers.assign_rooms_from_file(app_context, read_user_input)),
+        "21": ("undo_changes", lambda: handlers.undo_changes(app_context, read_user_input)),
     }
 
     while True:
+        if app_context.pending_load is not None and app_context.pending_load.done():
+            try:
+                app_context.finish_pending_load()
+            except (ReservationConflictError, ValueError, NotFoundError, OSError) as error:
+                print("[ERROR] {}".format(error))
+
         print(MENU_TEXT)
+        if started_at is not None:
+            ready_seconds = time.perf_counter() - started_at
+            started_at = None
+            if metrics.enabled:
+                metrics.record_latency("cli.time_to_first_prompt", ready_seconds)
+            if app_context.pending_load is not None:
+                print("Menu ready after {:.0f} ms; loading {} in the background.".format(
+                    ready_seconds * 1000,
+                    app_context.pending_load.filename,
+                ))
         user_choice = read_user_input("Choose an option: ")
 
         if user_choice == "0":
+            handlers.close_journal(app_context)
+            if app_context.pending_load is None:
+                app_context.reservation_book.close()
             print("Bye!")
             return
 
-        selected_handler = command_handlers.get(user_choice)
-        if selected_handler is None:
+        if user_choice not in command_handlers:
             print("Unknown option.")
             continue
 
+        # Command timings include the time spent waiting for the user's answers.
+        command_name, selected_handler = command_handlers[user_choice]
         try:
-            selected_handler()
+            with metrics.measure("command." + command_name):
+                selected_handler()
         except ReservationConflictError as error:
             print("[CONFLICT] {}".format(error))
         except (ValueError, NotFoundError, OSError, FileNotFoundError) as error:
@@ -0,0 +1,74 @@
+import sys
+from datetime import date, time
+
+
+# Distinct strings remembered per cache. A semester has a few hundred dates and a
+# few dozen slot times, so real books never fill it; a full cache is emptied and
+# refilled rather than tracking recency.
+DECODE_CACHE_SIZE = 4096
+
+_dates_by_text = {}
+_times_by_text = {}
+
+
+def _date_from_parts(raw_value):
+    year, month, day = [int(part) for part in str(raw_value).split("-")]
+    return date(year, month, day)
+
+
+def _time_from_parts(raw_value):
+    hour, minute = [int(part) for part in str(raw_value).split(":")]
+    return time(hour, minute)
+
+
+def _remember(cache, text, value):
+    if len(cache) >= DECODE_CACHE_SIZE:
+        cache.clear()
+    cache[text] = value
+    return value
+
+
+def decode_date(raw_value):
+    # Accepts exactly what splitting on "-" and int() accept and raises the same
+    # errors for the rest. Canonical "YYYY-MM-DD" text takes the C fromisoformat
+    # path, and equal strings share one date instance.
+    if type(raw_value) is not str:
+        return _date_from_parts(raw_value)
+
+    decoded_date = _dates_by_text.get(raw_value)
+    if decoded_date is not None:
+        return decoded_date
+
+    if len(raw_value) == 10 and raw_value[4] == "-" and raw_value[7] == "-":
+        try:
+            decoded_date = date.fromisoformat(raw_value)
+        except ValueError:
+            decoded_date = _date_from_parts(raw_value)
+    else:
+        decoded_date = _date_from_parts(raw_value)
+    return _remember(_dates_by_text, raw_value, decoded_date)
+
+
+def decode_time(raw_value):
+    # "HH:MM" counterpart of decode_date.
+    if type(raw_value) is not str:
+        return _time_from_parts(raw_value)
+
+    decoded_time = _times_by_text.get(raw_value)
+    if decoded_time is not None:
+        return decoded_time
+
+    if len(raw_value) == 5 and raw_value[2] == ":":
+        try:
+            decoded_time = time.fromisoformat(raw_value)
+        except ValueError:
+            decoded_time = _time_from_parts(raw_value)
+    else:
+        decoded_time = _time_from_parts(raw_value)
+    return _remember(_times_by_text, raw_value, decoded_time)
+
+
+def decode_text(raw_value):
+    # Rooms, people and purposes repeat across thousands of records; interned, each
+    # distinct value is stored once.
+    return sys.intern(str(raw_value))
@@ -0,0 +1,204 @@
+import csv
+import json
+import os
+from datetime import date, datetime, timezone
+from pathlib import Path
+from reservation import format_minutes
+from reservation_query import ReservationQuery
+from metrics import metrics
+
+
+EXPORT_FORMATS = ("csv", "ics", "jsonl")
+# Size of the write buffer; the generators below produce one record at a time and
+# the file object writes them out in chunks of this size.
+EXPORT_BUFFER_BYTES = 1024 * 1024
+CSV_COLUMNS = ("reservation_id", "series_id", "date", "start_time", "end_time", "room_id", "building", "person", "purpose")
+ICALENDAR_PRODUCT_ID = "-//Classroom Reservation System//EN"
+ICALENDAR_UID_DOMAIN = "classroom-reservation-system"
+
+_CLOCK_TEXTS = tuple(format_minutes(minute_of_day) for minute_of_day in range(24 * 60))
+_ICALENDAR_CLOCK_TEXTS = tuple(
+    "T{:02d}{:02d}00".format(*divmod(minute_of_day, 60)) for minute_of_day in range(24 * 60)
+)
+# json.dumps with options builds a new encoder on every call.
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+# Longest content line allowed by RFC 5545, in octets, before it must be folded.
+_ICALENDAR_LINE_OCTETS = 75
+
+
+class _DateTexts(dict):
+    # Bookings share few distinct dates, so each one is formatted only once.
+    def __init__(self, date_format):
+        super().__init__()
+        self.date_format = date_format
+
+    def __missing__(self, date_ordinal):
+        date_text = date.fromordinal(date_ordinal).strftime(self.date_format)
+        self[date_ordinal] = date_text
+        return date_text
+
+
+def csv_rows(reservation_book, query=None):
+    yield CSV_COLUMNS
+    classrooms_by_id = reservation_book.classrooms_by_id
+    date_texts = _DateTexts("%Y-%m-%d")
+    for record in reservation_book.query_records(query):
+        classroom = classrooms_by_id.get(record.room_id)
+        yield (
+            record.reservation_id if record.reservation_id is not None else "",
+            record.series_id if record.reservation_id is None else "",
+            date_texts[record.date_ordinal],
+            _CLOCK_TEXTS[record.start_minute],
+            _CLOCK_TEXTS[record.end_minute],
+            record.room_id,
+            classroom.building_name if classroom is not None else "",
+            record.person_name,
+            record.reservation_purpose,
+        )
+
+
+def json_lines(reservation_book, query=None):
+    date_texts = _DateTexts("%Y-%m-%d")
+    for record in reservation_book.query_records(query):
+        record_data = {
+            "room_id": record.room_id,
+            "person": record.person_name,
+            "purpose": record.reservation_purpose,
+            "date": date_texts[record.date_ordinal],
+            "start_time": _CLOCK_TEXTS[record.start_minute],
+            "end_time": _CLOCK_TEXTS[record.end_minute],
+            "reservation_id": record.reservation_id,
+        }
+        if record.reservation_id is None:
+            record_data["series_id"] = record.series_id
+        yield _json_encoder.encode(record_data) + "\n"
+
+
+def _icalendar_text(text):
+    # Any line break becomes one escaped \n; a raw CR would end the content line.
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _icalendar_line(name, value):
+    content_line = "{}:{}".format(name, value)
+    if len(content_line) <= _ICALENDAR_LINE_OCTETS and content_line.isascii():
+        return content_line + "\r\n"
+
+    # Longer lines are folded into continuation lines starting with a space,
+    # never splitting a multi-byte character.
+    folded_lines = []
+    current_line = ""
+    current_octets = 0
+    for character in content_line:
+        character_octets = len(character.encode("utf-8"))
+        if current_octets + character_octets > _ICALENDAR_LINE_OCTETS:
+            folded_lines.append(current_line)
+            current_line = " "
+            current_octets = 1
+        current_line += character
+        current_octets += character_octets
+    folded_lines.append(current_line)
+    return "\r\n".join(folded_lines) + "\r\n"
+
+
+def _icalendar_event(uid, timestamp, date_text, record, classroom, recurrence_lines=()):
+    location = record.room_id if classroom is None else "{} ({})".format(record.room_id, classroom.building_name)
+    return "".join((
+        "BEGIN:VEVENT\r\n",
+        _icalendar_line("UID", uid),
+        _icalendar_line("DTSTAMP", timestamp),
+        _icalendar_line("DTSTART", date_text + _ICALENDAR_CLOCK_TEXTS[record.start_minute]),
+        _icalendar_line("DTEND", date_text + _ICALENDAR_CLOCK_TEXTS[record.end_minute]),
+        *recurrence_lines,
+        _icalendar_line("SUMMARY", _icalendar_text(record.reservation_purpose)),
+        _icalendar_line("LOCATION", _icalendar_text(location)),
+        _icalendar_line("DESCRIPTION", _icalendar_text("Reserved by {}".format(record.person_name))),
+        "END:VEVENT\r\n",
+    ))
+
+
+def icalendar_lines(reservation_book, room_id=None, person_name=None, calendar_name="Reservations"):
+    # Single bookings become one event each; a series becomes one recurring event
+    # (RRULE with its excluded dates as EXDATE), so calendar clients keep it as a
+    # series. Times are floating local times, as entered in the book.
+    query = ReservationQuery(room_id=room_id, person_name=person_name)
+    classrooms_by_id = reservation_book.classrooms_by_id
+    date_texts = _DateTexts("%Y%m%d")
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    yield "BEGIN:VCALENDAR\r\n"
+    yield _icalendar_line("VERSION", "2.0")
+    yield _icalendar_line("PRODID", ICALENDAR_PRODUCT_ID)
+    yield _icalendar_line("CALSCALE", "GREGORIAN")
+    yield _icalendar_line("X-WR-CALNAME", _icalendar_text(calendar_name))
+
+    for record in reservation_book.query_records(query):
+        if record.reservation_id is None:
+            continue
+        yield _icalendar_event(
+            "reservation-{}@{}".format(record.reservation_id, ICALENDAR_UID_DOMAIN),
+            timestamp,
+            date_texts[record.date_ordinal],
+            record,
+            classrooms_by_id.get(record.room_id),
+        )
+
+    for series in reservation_book.list_series():
+        if not query.matches_pattern(series) or not series.occurrence_count():
+            continue
+        recurrence_lines = [_icalendar_line("RRULE", "FREQ=DAILY;INTERVAL={};UNTIL={}".format(
+            series.interval_days,
+            date_texts[series.last_date_ordinal] + _ICALENDAR_CLOCK_TEXTS[series.start_minute],
+        ))]
+        if series.excluded_date_ordinals:
+            recurrence_lines.append(_icalendar_line("EXDATE", ",".join(
+                date_texts[date_ordinal] + _ICALENDAR_CLOCK_TEXTS[series.start_minute]
+                for date_ordinal in sorted(series.excluded_date_ordinals)
+            )))
+        yield _icalendar_event(
+            "series-{}@{}".format(series.series_id, ICALENDAR_UID_DOMAIN),
+            timestamp,
+            date_texts[series.first_date_ordinal],
+            series,
+            classrooms_by_id.get(series.room_id),
+            recurrence_lines,
+        )
+
+    yield "END:VCALENDAR\r\n"
+
+
+def _write_export(filename, write_contents):
+    file_path = Path(filename)
+    temporary_path = file_path.with_name(file_path.name + ".tmp")
+
+    try:
+        with open(temporary_path, "w", encoding="utf-8", newline="", buffering=EXPORT_BUFFER_BYTES) as export_file:
+            write_contents(export_file)
+            export_file.flush()
+            os.fsync(export_file.fileno())
+        os.replace(temporary_path, file_path)
+    except OSError as error:
+        raise OSError("Failed to save file: {}".format(error))
+
+    if metrics.enabled:
+        metrics.increment("storage.bytes_written", os.path.getsize(file_path))
+
+
+def export_csv(reservation_book, filename, query=None):
+    with metrics.measure("export.csv"):
+        _write_export(filename, lambda export_file: csv.writer(export_file).writerows(
+            csv_rows(reservation_book, query)
+        ))
+
+
+def export_json_lines(reservation_book, filename, query=None):
+    with metrics.measure("export.jsonl"):
+        _write_export(filename, lambda export_file: export_file.writelines(json_lines(reservation_book, query)))
+
+
+def export_icalendar(reservation_book, filename, room_id=None, person_name=None, calendar_name="Reservations"):
+    with metrics.measure("export.ics"):
+        _write_export(filename, lambda export_file: export_file.writelines(
+            icalendar_lines(reservation_book, room_id=room_id, person_name=person_name, calendar_name=calendar_name)
+        ))
@@ -1,5 +1,20 @@
+import json
+from itertools import islice
+from pathlib import Path
 from classroom import Classroom
 from reservation import Reservation
+from recurring_series import RecurringSeries
+from reservation_query import ReservationQuery
+from errors import NotFoundError, ReservationConflictError
+from journal import Journal
+from shared_book import SharedJournal
+from metrics import metrics
+from analytics import utilisation_report
+from exporters import export_csv, export_icalendar, export_json_lines
+from room_assignment import assign_rooms, read_assignment_requests
+
+
+RESERVATION_PAGE_SIZE = 20
 
 
 def create_new_book(app_context):
@@ -12,7 +27,11 @@ def save_book_to_file(app_context, read_user_input):
         read_user_input("Filename to save (e.g. data.json): "),
         "Filename",
     )
-    app_context.storage.save_to_file(app_context.reservation_book, filename)
+    journal = app_context.journal
+    if journal is not None and Path(filename).resolve() == journal.snapshot_path.resolve():
+        journal.compact()
+    else:
+        app_context.storage.save_to_file(app_context.reservation_book, filename)
     print("Saved to {}".format(filename))
 
 
@@ -21,10 +40,47 @@ def load_book_from_file(app_context, read_user_input):
         read_user_input("Filename to load: "),
         "Filename",
     )
-    app_context.reservation_book = app_context.storage.load_from_file(filename)
+    reservation_book = app_context.storage.load_from_file(filename)
+    close_journal(app_context)
+    app_context.reservation_book.close()
+    app_context.reservation_book = reservation_book
     print("Loaded from {}".format(filename))
 
 
+def open_journaled_book(app_context, read_user_input):
+    filename = app_context.validator.require_non_empty_text(
+        read_user_input("Filename to open with journaling: "),
+        "Filename",
+    )
+    journal = Journal(filename, storage=app_context.storage)
+    reservation_book = journal.open()
+    close_journal(app_context)
+    app_context.reservation_book.close()
+    app_context.journal = journal
+    app_context.reservation_book = reservation_book
+    print("Opened {} (changes are saved automatically to {})".format(filename, journal.log_path))
+
+
+def open_shared_book(app_context, read_user_input):
+    filename = app_context.validator.require_non_empty_text(
+        read_user_input("Shared book filename: "),
+        "Filename",
+    )
+    journal = SharedJournal(filename, storage=app_context.storage)
+    reservation_book = journal.open()
+    close_journal(app_context)
+    app_context.reservation_book.close()
+    app_context.journal = journal
+    app_context.reservation_book = reservation_book
+    print("Opened {} in shared mode (changes by other instances are merged before every operation)".format(filename))
+
+
+def close_journal(app_context):
+    if app_context.journal is not None:
+        app_context.journal.close()
+        app_context.journal = None
+
+
 def add_classroom(app_context, read_user_input):
     room_id = app_context.validator.require_non_empty_text(
         read_user_input("Room identifier (e.g. B101): "),
@@ -52,7 +108,7 @@ def add_classroom(app_context, read_user_input):
     print("Classroom added.")
 
 
-def add_reservation(app_context, read_user_input):
+def add_reservation(app_context, read_user_input, offer_alternatives=True):
     room_id = app_context.validator.require_non_empty_text(read_user_input("Room identifier: "), "Room ID")
     person_name = app_context.validator.require_non_empty_text(read_user_input("Person name: "), "Person")
     reservation_purpose = app_context.validator.require_non_empty_text(read_user_input("Purpose: "), "Purpose")
@@ -68,12 +124,139 @@ def add_reservation(app_context, read_user_input):
         start_time=start_time,
         end_time=end_time,
     )
-    app_context.reservation_book.add_reservation(reservation)
+    try:
+        reservation_id = app_context.reservation_book.add_reservation(reservation)
+    except ReservationConflictError as error:
+        if not offer_alternatives:
+            raise
+        print("[CONFLICT] {}".format(error))
+        reservation = _choose_alternative(app_context, reservation, read_user_input)
+        if reservation is None:
+            return None
+        reservation_id = app_context.reservation_book.add_reservation(reservation)
     print("Reservation added.")
+    return reservation_id
+
+
+def _choose_alternative(app_context, reservation, read_user_input):
+    suggestions = app_context.reservation_book.suggest_alternatives(reservation)
+    alternatives = list(suggestions["slots"])
+    for classroom in suggestions["rooms"]:
+        alternatives.append(Reservation(
+            room_id=classroom.room_id,
+            person_name=reservation.person_name,
+            reservation_purpose=reservation.reservation_purpose,
+            reservation_date=reservation.reservation_date,
+            start_time=reservation.start_time,
+            end_time=reservation.end_time,
+        ))
+    if not alternatives:
+        print("No free alternatives found.")
+        return None
+
+    print("Free alternatives:")
+    for number, alternative in enumerate(alternatives, start=1):
+        classroom = app_context.reservation_book.classrooms_by_id[alternative.room_id]
+        print("{} ) {} {}-{} | room={} | {} | cap={}".format(
+            number,
+            alternative.reservation_date.isoformat(),
+            alternative.start_time.strftime("%H:%M"),
+            alternative.end_time.strftime("%H:%M"),
+            alternative.room_id,
+            classroom.building_name,
+            classroom.capacity,
+        ))
+    alternative_number = _read_optional(
+        read_user_input,
+        "Book one of them instead (number, empty = no): ",
+        lambda raw_value: app_context.validator.require_positive_integer(raw_value, "Alternative number"),
+    )
+    if alternative_number is None:
+        return None
+    if alternative_number > len(alternatives):
+        raise ValueError("Alternative number out of range.")
+    return alternatives[alternative_number - 1]
+
+
+def add_series(app_context, read_user_input):
+    room_id = app_context.validator.require_non_empty_text(read_user_input("Room identifier: "), "Room ID")
+    person_name = app_context.validator.require_non_empty_text(read_user_input("Person name: "), "Person")
+    reservation_purpose = app_context.validator.require_non_empty_text(read_user_input("Purpose: "), "Purpose")
+    first_date = app_context.validator.parse_iso_date(read_user_input("First date (YYYY-MM-DD): "))
+    last_date = app_context.validator.parse_iso_date(read_user_input("Last date (YYYY-MM-DD): "))
+    interval_days = app_context.validator.require_positive_integer(
+        read_user_input("Repeat every N days (7 = weekly): "),
+        "Repeat interval",
+    )
+    start_time = app_context.validator.parse_hhmm_time(read_user_input("Start time (HH:MM): "))
+    end_time = app_context.validator.parse_hhmm_time(read_user_input("End time (HH:MM): "))
+    excluded_dates = [
+        app_context.validator.parse_iso_date(date_text)
+        for date_text in read_user_input("Skipped dates (comma-separated YYYY-MM-DD, can be empty): ").split(",")
+        if date_text.strip()
+    ]
+
+    series = RecurringSeries(
+        room_id=room_id,
+        person_name=person_name,
+        reservation_purpose=reservation_purpose,
+        first_date=first_date,
+        last_date=last_date,
+        interval_days=interval_days,
+        start_time=start_time,
+        end_time=end_time,
+        excluded_dates=excluded_dates,
+    )
+    series_id = app_context.reservation_book.add_series(series)
+    print("Recurring series #{} added ({} occurrences).".format(series_id, series.occurrence_count()))
+    return series_id
+
+
+def _print_series(series):
+    excluded_text = ", ".join(excluded_date.isoformat() for excluded_date in series.excluded_dates) or "-"
+    print("#{} ) {}..{} every {} day(s) {}-{} | room={} | {} | {} | skipped={}".format(
+        series.series_id,
+        series.first_date.isoformat(),
+        series.last_date.isoformat(),
+        series.interval_days,
+        series.start_time.strftime("%H:%M"),
+        series.end_time.strftime("%H:%M"),
+        series.room_id,
+        series.person_name,
+        series.reservation_purpose,
+        excluded_text,
+    ))
+
+
+def show_series(app_context):
+    series_list = app_context.reservation_book.list_series()
+    if not series_list:
+        print("No recurring series.")
+        return
+
+    for series in series_list:
+        _print_series(series)
+
+
+def remove_series(app_context, read_user_input):
+    series_list = app_context.reservation_book.list_series()
+    if not series_list:
+        print("No recurring series.")
+        return
+
+    for series in series_list:
+        _print_series(series)
+
+    series_id = app_context.validator.require_positive_integer(
+        read_user_input("Enter series number to remove: "),
+        "Series ID",
+    )
+    removed = app_context.reservation_book.remove_series(series_id)
+    print("Removed recurring series #{} ({} occurrences).".format(series_id, removed.occurrence_count()))
 
 
 def show_classrooms(app_context):
-    classroom_list = app_context.reservation_book.list_classrooms()
+    classroom_list = app_context.list_classrooms()
     if not classroom_list:
         print("No classrooms.")
         return
@@ -88,36 +271,149 @@ def show_classrooms(app_context):
         ))
 
 
+def find_available_classrooms(app_context, read_user_input):
+    reservation_date = app_context.validator.parse_iso_date(read_user_input("Date (YYYY-MM-DD): "))
+    start_time = app_context.validator.parse_hhmm_time(read_user_input("Start time (HH:MM): "))
+    end_time = app_context.validator.parse_hhmm_time(read_user_input("End time (HH:MM): "))
+
+    minimum_capacity = None
+    capacity_text = read_user_input("Minimum capacity (empty = any): ")
+    if capacity_text:
+        minimum_capacity = app_context.validator.require_positive_integer(capacity_text, "Capacity")
+
+    required_equipment = app_context.validator.parse_equipment_list(
+        read_user_input("Required equipment (comma-separated, can be empty): ")
+    )
+    building_name = read_user_input("Building (empty = any): ") or None
+
+    classroom_list = app_context.reservation_book.find_available_rooms(
+        reservation_date,
+        start_time,
+        end_time,
+        minimum_capacity=minimum_capacity,
+        required_equipment=required_equipment,
+        building_name=building_name,
+    )
+    if not classroom_list:
+        print("No available classrooms.")
+        return
+
+    for classroom in classroom_list:
+        equipment_text = ", ".join(classroom.equipment_list) if classroom.equipment_list else "-"
+        print("- {} | {} | cap={} | eq={}".format(
+            classroom.room_id,
+            classroom.building_name,
+            classroom.capacity,
+            equipment_text,
+        ))
+
+
+def format_reservation_line(number, reservation):
+    reservation_line = "{} ) {} {}-{} | room={} | {} | {}".format(
+        number,
+        reservation.reservation_date.isoformat(),
+        reservation.start_time.strftime("%H:%M"),
+        reservation.end_time.strftime("%H:%M"),
+        reservation.room_id,
+        reservation.person_name,
+        reservation.reservation_purpose,
+    )
+    if reservation.series_id is not None:
+        reservation_line += " | series #{}".format(reservation.series_id)
+    return reservation_line
+
+
+def _read_optional(read_user_input, prompt_text, parse_value):
+    raw_value = read_user_input(prompt_text)
+    return parse_value(raw_value) if raw_value else None
+
+
+def _read_reservation_query(app_context, read_user_input):
+    validator = app_context.validator
+    return ReservationQuery(
+        first_date=_read_optional(read_user_input, "From date (YYYY-MM-DD, empty = any): ", validator.parse_iso_date),
+        last_date=_read_optional(read_user_input, "To date (YYYY-MM-DD, empty = any): ", validator.parse_iso_date),
+        start_time=_read_optional(read_user_input, "From time (HH:MM, empty = any): ", validator.parse_hhmm_time),
+        end_time=_read_optional(read_user_input, "To time (HH:MM, empty = any): ", validator.parse_hhmm_time),
+        room_id=read_user_input("Room identifier (empty = any): ") or None,
+        person_name=read_user_input("Person (empty = any): ") or None,
+        building_name=read_user_input("Building (empty = any): ") or None,
+        purpose_text=read_user_input("Purpose contains (empty = any): ") or None,
+    )
+
+
 def show_reservations(app_context, read_user_input):
-    print("Filter: 1) none  2) by room  3) by date")
+    print("Filter: 1) none  2) by room  3) by date  4) search (dates, times, person, building, purpose)")
     filter_choice = read_user_input("Choose filter: ")
 
+    # (room, date) filters a binary snapshot can answer on its own.
+    snapshot_filters = None
     if filter_choice == "1":
-        reservation_list = app_context.reservation_book.list_reservations()
+        query = ReservationQuery()
+        snapshot_filters = (None, None)
     elif filter_choice == "2":
         room_id = app_context.validator.require_non_empty_text(read_user_input("Room identifier: "), "Room ID")
-        reservation_list = app_context.reservation_book.list_reservations(room_id=room_id)
+        query = ReservationQuery(room_id=room_id)
+        snapshot_filters = (room_id, None)
     elif filter_choice == "3":
         reservation_date = app_context.validator.parse_iso_date(read_user_input("Date (YYYY-MM-DD): "))
-        reservation_list = app_context.reservation_book.list_reservations(reservation_date=reservation_date)
+        query = ReservationQuery(first_date=reservation_date, last_date=reservation_date)
+        snapshot_filters = (None, reservation_date)
+    elif filter_choice == "4":
+        query = _read_reservation_query(app_context, read_user_input)
     else:
         print("Unknown filter; showing all.")
-        reservation_list = app_context.reservation_book.list_reservations()
+        query = ReservationQuery()
+        snapshot_filters = (None, None)
 
-    if not reservation_list:
-        print("No reservations.")
-        return
+    snapshot = app_context.loading_snapshot() if snapshot_filters is not None else None
+    if snapshot is not None:
+        reservation_pages = _snapshot_pages(snapshot, *snapshot_filters)
+    else:
+        reservation_pages = _book_pages(app_context.reservation_book, query)
+
+    # Numbering continues across pages.
+    shown_count = 0
+    for reservation_page, more_pages in reservation_pages:
+        if not reservation_page and shown_count == 0:
+            print("No reservations.")
+            return
+
+        for reservation in reservation_page:
+            shown_count += 1
+            print(format_reservation_line(shown_count, reservation))
+
+        if not more_pages:
+            return
+        if read_user_input("-- Enter for more, q to stop: ").lower() == "q":
+            return
+
+
+def _book_pages(reservation_book, query):
+    # Only one page is fetched at a time.
+    cursor = None
+    while True:
+        reservation_page, cursor = reservation_book.page_reservations(
+            query,
+            page_size=RESERVATION_PAGE_SIZE,
+            cursor=cursor,
+        )
+        yield reservation_page, cursor is not None
+        if cursor is None:
+            return
 
-    for number, reservation in enumerate(reservation_list, start=1):
-        print("{} ) {} {}-{} | room={} | {} | {}".format(
-            number,
-            reservation.reservation_date.isoformat(),
-            reservation.start_time.strftime("%H:%M"),
-            reservation.end_time.strftime("%H:%M"),
-            reservation.room_id,
-            reservation.person_name,
-            reservation.reservation_purpose,
-        ))
+
+def _snapshot_pages(snapshot, room_id, reservation_date):
+    # While a binary snapshot loads in the background, its records are decoded
+    # straight from the memory-mapped file, one page at a time.
+    reservations = snapshot.iter_reservations(room_id=room_id, reservation_date=reservation_date)
+    reservation_page = list(islice(reservations, RESERVATION_PAGE_SIZE + 1))
+    while True:
+        next_page = reservation_page[RESERVATION_PAGE_SIZE:]
+        yield reservation_page[:RESERVATION_PAGE_SIZE], bool(next_page)
+        if not next_page:
+            return
+        reservation_page = next_page + list(islice(reservations, RESERVATION_PAGE_SIZE))
 
 
 def remove_reservation(app_context, read_user_input):
@@ -146,26 +442,18 @@ def remove_reservation(app_context, read_user_input):
         return
 
     for number, reservation in enumerate(visible_reservations, start=1):
-        print("{} ) {} {}-{} | room={} | {} | {}".format(
-            number,
-            reservation.reservation_date.isoformat(),
-            reservation.start_time.strftime("%H:%M"),
-            reservation.end_time.strftime("%H:%M"),
-            reservation.room_id,
-            reservation.person_name,
-            reservation.reservation_purpose,
-        ))
+        print(format_reservation_line(number, reservation))
 
     reservation_number = app_context.validator.require_positive_integer(
         read_user_input("Enter reservation number to remove: "),
         "Index",
     )
+    if reservation_number > len(visible_reservations):
+        raise NotFoundError("Reservation index out of range.")
 
-    removed = app_context.reservation_book.remove_reservation(
-        reservation_number,
-        room_id=selected_room_id,
-        reservation_date=selected_date,
-    )
+    # The entry shown to the user is removed even if the book changed meanwhile
+    # (e.g. another instance of a shared book added an earlier reservation).
+    removed = app_context.reservation_book.remove_listed_reservation(visible_reservations[reservation_number - 1])
 
     print("Removed: {} {}-{} room={}".format(
         removed.reservation_date.isoformat(),
@@ -175,6 +463,165 @@ def remove_reservation(app_context, read_user_input):
     ))
 
 
+def show_utilisation_report(app_context, read_user_input):
+    first_date_text = read_user_input("First date (YYYY-MM-DD, empty = first booking): ")
+    last_date_text = read_user_input("Last date (YYYY-MM-DD, empty = last booking): ")
+    first_date = app_context.validator.parse_iso_date(first_date_text) if first_date_text else None
+    last_date = app_context.validator.parse_iso_date(last_date_text) if last_date_text else None
+
+    try:
+        report = utilisation_report(app_context.reservation_book, first_date=first_date, last_date=last_date)
+    except ImportError as error:
+        print("[ERROR] {}".format(error))
+        return
+
+    if report["days"] == 0:
+        print("No reservations in the selected period.")
+        return
+
+    print("Utilisation {}..{} ({} days, opening hours {}-{}):".format(
+        report["first_date"],
+        report["last_date"],
+        report["days"],
+        report["opening_time"],
+        report["closing_time"],
+    ))
+    print("Busiest rooms:")
+    for room_data in report["rooms"][:10]:
+        print("- {} | {} | cap={} | {:.1%} | {} h".format(
+            room_data["room_id"],
+            room_data["building"],
+            room_data["capacity"],
+            room_data["utilisation"],
+            room_data["booked_hours"],
+        ))
+    print("Buildings:")
+    for building_data in report["buildings"]:
+        print("- {} | rooms={} | {:.1%} | seats {:.1%}".format(
+            building_data["building"],
+            building_data["rooms"],
+            building_data["utilisation"],
+            building_data["seat_utilisation"],
+        ))
+    print("Weekdays:")
+    for weekday_data in report["weekdays"]:
+        print("- {} | {:.1%} | seats {:.1%}".format(
+            weekday_data["weekday"],
+            weekday_data["utilisation"],
+            weekday_data["seat_utilisation"],
+        ))
+    print("Peak hours: {}".format(", ".join(
+        "{} ({:.1%} of seats)".format(hour_data["hour"], hour_data["seat_utilisation"])
+        for hour_data in report["peak_hours"]
+    )))
+    print("Never used: {}".format(", ".join(report["unused_rooms"]) or "-"))
+    _offer_report_file(report, read_user_input)
+
+
+def _offer_report_file(report, read_user_input):
+    filename = read_user_input("Save full report to JSON file (empty = no): ")
+    if filename:
+        try:
+            Path(filename).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        except OSError as error:
+            raise OSError("Failed to save file: {}".format(error))
+        print("Report saved to {}".format(filename))
+
+
+def export_reservations(app_context, read_user_input):
+    print("Format: 1) CSV  2) iCalendar (.ics)  3) JSON lines")
+    format_choice = read_user_input("Choose format: ")
+    if format_choice not in ("1", "2", "3"):
+        raise ValueError("Unknown export format.")
+
+    filename = app_context.validator.require_non_empty_text(read_user_input("Export filename: "), "Filename")
+    if format_choice == "2":
+        print("Calendar of: 1) all reservations  2) one room  3) one person")
+        calendar_choice = read_user_input("Choose calendar: ")
+        room_id = None
+        person_name = None
+        if calendar_choice == "2":
+            room_id = app_context.validator.require_non_empty_text(read_user_input("Room identifier: "), "Room ID")
+        elif calendar_choice == "3":
+            person_name = app_context.validator.require_non_empty_text(read_user_input("Person: "), "Person")
+        export_icalendar(
+            app_context.reservation_book,
+            filename,
+            room_id=room_id,
+            person_name=person_name,
+            calendar_name=room_id or person_name or "Reservations",
+        )
+    else:
+        print("Filter: 1) none  2) search (dates, times, room, person, building, purpose)")
+        query = _read_reservation_query(app_context, read_user_input) if read_user_input("Choose filter: ") == "2" else None
+        if format_choice == "1":
+            export_csv(app_context.reservation_book, filename, query=query)
+        else:
+            export_json_lines(app_context.reservation_book, filename, query=query)
+
+    print("Exported to {}".format(filename))
+
+
+def assign_rooms_from_file(app_context, read_user_input):
+    filename = app_context.validator.require_non_empty_text(
+        read_user_input("Request file (JSON list or .jsonl): "),
+        "Filename",
+    )
+    preview_only = read_user_input("Preview only, do not book anything (y/N): ").lower() == "y"
+    report = assign_rooms(
+        app_context.reservation_book,
+        read_assignment_requests(filename),
+        app_context.validator,
+        commit=not preview_only,
+    )
+
+    print("Placed {} of {} requests in {:.2f}s{}.".format(
+        len(report["placed"]),
+        report["requests"],
+        report["seconds"],
+        "" if report["committed"] or not report["placed"] else " (preview, nothing booked)",
+    ))
+    for unplaced_data in report["unplaced"][:RESERVATION_PAGE_SIZE]:
+        print("- {} | {}".format(unplaced_data["request"], unplaced_data["reason"]))
+    if len(report["unplaced"]) > RESERVATION_PAGE_SIZE:
+        print("... and {} more unplaced requests".format(len(report["unplaced"]) - RESERVATION_PAGE_SIZE))
+    _offer_report_file(report, read_user_input)
+
+
+def manage_metrics(app_context, read_user_input):
+    print(metrics.format_report())
+    # Metrics stay available while a book is loading in the background.
+    if app_context.pending_load is None:
+        cache_stats = app_context.reservation_book.listing_cache_stats()
+        print("Listing cache: {} hits, {} misses, {} evictions, {}/{} entries (generation {}).".format(
+            cache_stats["hits"],
+            cache_stats["misses"],
+            cache_stats["evictions"],
+            cache_stats["entries"],
+            cache_stats["capacity"],
+            cache_stats["generation"],
+        ))
+    print("Metrics: 1) back  2) turn on  3) turn off  4) reset  5) save to JSON file")
+    metrics_choice = read_user_input("Choose action: ")
+
+    if metrics_choice == "2":
+        metrics.enable()
+        print("Instrumentation turned on.")
+    elif metrics_choice == "3":
+        metrics.disable()
+        print("Instrumentation turned off.")
+    elif metrics_choice == "4":
+        metrics.reset()
+        print("Metrics reset.")
+    elif metrics_choice == "5":
+        filename = app_context.validator.require_non_empty_text(
+            read_user_input("Filename to save (e.g. metrics.json): "),
+            "Filename",
+        )
+        metrics.write_json(filename)
+        print("Metrics saved to {}".format(filename))
+
+
 def remove_all_reservations(app_context):
     app_context.reservation_book.remove_all_reservations()
     print("All reservations removed.")
@@ -183,3 +630,21 @@ def remove_all_reservations(app_context):
 def delete_reservation_book(app_context):
     app_context.reservation_book.clear_all()
     print("Reservation book deleted (classrooms + reservations).")
+
+
+def undo_changes(app_context, read_user_input):
+    reservation_book = app_context.reservation_book
+    if not reservation_book.supports_snapshots:
+        raise ValueError("Undo is not available for SQLite books.")
+    available_count = reservation_book.undo_step_count()
+    if not available_count:
+        print("Nothing to undo.")
+        return
+
+    step_count = _read_optional(
+        read_user_input,
+        "Changes to undo (1-{}, empty = 1): ".format(available_count),
+        lambda raw_value: app_context.validator.require_positive_integer(raw_value, "Number of changes"),
+    ) or 1
+    reservation_book.undo(step_count)
+    print("Undid {} change(s).".format(step_count))
@@ -0,0 +1,138 @@
+import json
+from datetime import date
+from pathlib import Path
+from storage import Storage
+from classroom import classroom_from_dict
+from reservation import reservation_from_dict
+from recurring_series import recurring_series_from_dict
+from reservation_book import reservation_book_from_dict
+
+
+DEFAULT_COMPACTION_THRESHOLD_BYTES = 1024 * 1024
+
+
+class Journal:
+    def __init__(self, filename, compaction_threshold_bytes=DEFAULT_COMPACTION_THRESHOLD_BYTES, storage=None):
+        self.snapshot_path = Path(filename)
+        self.log_path = self.snapshot_path.with_name(self.snapshot_path.name + ".log")
+        self.compaction_threshold_bytes = compaction_threshold_bytes
+        self.storage = storage if storage is not None else Storage()
+        self.reservation_book = None
+        self._log_file = None
+        self._sequence = 0
+
+    def open(self):
+        book_data = self.storage.read_book_data(self.snapshot_path) if self.snapshot_path.exists() else {}
+        reservation_book = reservation_book_from_dict(book_data)
+        self._sequence = int(book_data.get("journal_sequence", 0))
+        torn_tail = self._replay_log(reservation_book)
+
+        try:
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        except OSError as error:
+            raise OSError("Failed to open journal: {}".format(error))
+
+        self.reservation_book = reservation_book
+        reservation_book.add_change_listener(self._record_change)
+
+        # A half-written last record means the previous session died mid-append;
+        # compacting now drops it before new records are appended after it.
+        if torn_tail:
+            self.compact()
+
+        return reservation_book
+
+    def close(self):
+        if self.reservation_book is not None:
+            self.reservation_book.remove_change_listener(self._record_change)
+            self.reservation_book = None
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def compact(self):
+        book_data = self.reservation_book.to_dict()
+        book_data["journal_sequence"] = self._sequence
+        self.storage.write_book_data(book_data, self.snapshot_path)
+
+        try:
+            self._log_file.seek(0)
+            self._log_file.truncate()
+        except OSError as error:
+            raise OSError("Failed to truncate journal: {}".format(error))
+
+    def _replay_log(self, reservation_book):
+        if not self.log_path.exists():
+            return False
+
+        try:
+            log_lines = self.log_path.read_text(encoding="utf-8").splitlines()
+        except OSError as error:
+            raise OSError("Failed to read journal: {}".format(error))
+
+        for line_number, line in enumerate(log_lines, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if line_number == len(log_lines):
+                    return True
+                raise ValueError("Invalid journal record on line {}.".format(line_number))
+
+            if record["seq"] <= self._sequence:
+                continue
+
+            self._apply_record(reservation_book, record)
+            self._sequence = record["seq"]
+
+        return False
+
+    def _apply_record(self, reservation_book, record):
+        operation = record["op"]
+        payload = record.get("data")
+
+        if operation == "add_classroom":
+            reservation_book.add_classroom(classroom_from_dict(payload))
+        elif operation == "add_reservation":
+            reservation_book.add_reservation(reservation_from_dict(payload))
+        elif operation == "remove_reservation":
+            reservation_book.remove_matching_reservation(reservation_from_dict(payload))
+        elif operation == "add_series":
+            reservation_book.add_series(recurring_series_from_dict(payload))
+        elif operation == "remove_series":
+            reservation_book.remove_matching_series(recurring_series_from_dict(payload))
+        elif operation == "exclude_series_occurrence":
+            reservation_book.exclude_matching_series_occurrence(
+                recurring_series_from_dict(payload["series"]),
+                date.fromisoformat(payload["date"]),
+            )
+        elif operation == "remove_all_reservations":
+            reservation_book.remove_all_reservations()
+        elif operation == "clear_all":
+            reservation_book.clear_all()
+        else:
+            raise ValueError("Unknown journal operation '{}'.".format(operation))
+
+    def _record_change(self, operation, payload):
+        if operation == "undo":
+            # No logged operation leads back to an earlier state, so the undone
+            # book is written as a new snapshot under a new sequence number.
+            self._sequence += 1
+            self.compact()
+            return
+
+        self._sequence += 1
+        record = {"seq": self._sequence, "op": operation}
+        if payload is not None:
+            record["data"] = payload
+
+        try:
+            self._log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log_file.flush()
+        except OSError as error:
+            raise OSError("Failed to write journal: {}".format(error))
+
+        if self._log_file.tell() >= self.compaction_threshold_bytes:
+            self.compact()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import date, timedelta
+
+
+class HttpClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+    async def request(self, method, path, body_data=None):
+        body = b"" if body_data is None else json.dumps(body_data).encode("utf-8")
+        self._writer.write(
+            "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+                method,
+                path,
+                self.host,
+                len(body),
+            ).encode("latin-1") + body
+        )
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        status = int(status_line.split()[1])
+        content_length = 0
+        while True:
+            header_line = await self._reader.readline()
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header_line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value.strip())
+        response_body = await self._reader.readexactly(content_length)
+        return status, response_body
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def set_up_classrooms(host, port, room_count):
+    client = HttpClient(host, port)
+    await client.connect()
+    try:
+        for room_number in range(room_count):
+            await client.request("POST", "/classrooms", {
+                "room_id": "LOAD{:04d}".format(room_number),
+                "building": "Load Building {}".format(room_number % 10),
+                "capacity": 20 + room_number % 80,
+                "equipment": ["projector"] if room_number % 2 else ["computers"],
+            })
+    finally:
+        await client.close()
+
+
+async def run_worker(worker_number, arguments, deadline, latencies, status_counts):
+    random_generator = random.Random(arguments.seed + worker_number)
+    first_date = date(2026, 3, 2)
+    client = HttpClient(arguments.host, arguments.port)
+    await client.connect()
+
+    try:
+        while time.perf_counter() < deadline:
+            room_id = "LOAD{:04d}".format(random_generator.randrange(arguments.rooms))
+            reservation_date = (first_date + timedelta(days=random_generator.randrange(arguments.days))).isoformat()
+
+            if random_generator.random() < arguments.write_ratio:
+                start_hour = random_generator.randrange(8, 19)
+                method, path, body_data = "POST", "/reservations", {
+                    "room_id": room_id,
+                    "person": "Load Person {}".format(random_generator.randrange(arguments.people)),
+                    "purpose": "load test",
+                    "date": reservation_date,
+                    "start_time": "{:02d}:00".format(start_hour),
+                    "end_time": "{:02d}:45".format(start_hour),
+                }
+            elif random_generator.random() < 0.5:
+                method, path, body_data = "GET", "/reservations?room_id={}&date={}".format(room_id, reservation_date), None
+            else:
+                start_hour = random_generator.randrange(8, 19)
+                method, path, body_data = "GET", "/available-classrooms?date={}&start_time={:02d}:00&end_time={:02d}:45&capacity=30".format(
+                    reservation_date,
+                    start_hour,
+                    start_hour,
+                ), None
+
+            started_at = time.perf_counter()
+            status, _ = await client.request(method, path, body_data)
+            latencies.append(time.perf_counter() - started_at)
+            status_counts[status] = status_counts.get(status, 0) + 1
+    finally:
+        await client.close()
+
+
+async def run_load(arguments):
+    await set_up_classrooms(arguments.host, arguments.port, arguments.rooms)
+
+    latencies = []
+    status_counts = {}
+    started_at = time.perf_counter()
+    deadline = started_at + arguments.duration
+    await asyncio.gather(*(
+        run_worker(worker_number, arguments, deadline, latencies, status_counts)
+        for worker_number in range(arguments.connections)
+    ))
+    elapsed_seconds = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed_seconds, 3),
+        "requests_per_second": round(len(latencies) / elapsed_seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "status_counts": {str(status): count for status, count in sorted(status_counts.items())},
+    }
+
+
+def parse_arguments():
+    argument_parser = argparse.ArgumentParser(description="Load generator for the reservation HTTP service")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8080)
+    argument_parser.add_argument("--connections", type=int, default=50, help="concurrent keep-alive connections")
+    argument_parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    argument_parser.add_argument("--write-ratio", type=float, default=0.1, help="share of POST /reservations requests")
+    argument_parser.add_argument("--rooms", type=int, default=200)
+    argument_parser.add_argument("--days", type=int, default=60)
+    argument_parser.add_argument("--people", type=int, default=2000)
+    argument_parser.add_argument("--seed", type=int, default=1)
+    return argument_parser.parse_args()
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run_load(parse_arguments())), indent=2))
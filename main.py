@@ -1,4 +1,59 @@
+import time
+
+# Taken before the application modules are imported, so the reported time to the
+# first prompt includes their import cost.
+STARTED_AT = time.perf_counter()
+
+import argparse
+import sys
 from cli import run_cli
+from batch import run_batch_file
+from server import run_server
+
+
+def parse_arguments(argument_list):
+    argument_parser = argparse.ArgumentParser(description="Classroom Reservation System")
+    argument_parser.add_argument(
+        "--batch",
+        metavar="COMMANDS_FILE",
+        help="run JSON-lines commands from a file ('-' for stdin) instead of the interactive menu",
+    )
+    argument_parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="serve the reservation book over HTTP/JSON instead of the interactive menu",
+    )
+    argument_parser.add_argument("--host", default="127.0.0.1", help="address to listen on with --serve")
+    argument_parser.add_argument("--port", type=int, default=8080, help="port to listen on with --serve")
+    argument_parser.add_argument("--file", help="book file loaded and periodically saved by --serve")
+    argument_parser.add_argument(
+        "--workers",
+        type=int,
+        help="validate large books in this many worker processes when loading",
+    )
+    argument_parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="start the interactive menu with operation timing and counters turned on",
+    )
+    argument_parser.add_argument(
+        "--open",
+        metavar="BOOK_FILE",
+        help="load this book in the background while the interactive menu is already usable",
+    )
+    return argument_parser.parse_args(argument_list)
+
 
 if __name__ == "__main__":
-    run_cli()
+    arguments = parse_arguments(sys.argv[1:])
+    if arguments.batch is not None:
+        sys.exit(run_batch_file(arguments.batch, parallel_workers=arguments.workers))
+    if arguments.serve:
+        run_server(arguments.host, arguments.port, filename=arguments.file, parallel_workers=arguments.workers)
+        sys.exit(0)
+    run_cli(
+        parallel_workers=arguments.workers,
+        enable_metrics=arguments.metrics,
+        open_filename=arguments.open,
+        started_at=STARTED_AT,
+    )
@@ -0,0 +1,159 @@
+import json
+import time
+from contextlib import nullcontext
+
+
+HISTOGRAM_BUCKET_COUNT = 40
+_DISABLED_TIMER = nullcontext()
+
+
+class LatencyHistogram:
+    # Bucket i holds latencies below 2**i microseconds (bucket 0: under 1 us), so
+    # recording is O(1) and percentiles are reported as bucket upper bounds.
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.min_seconds = None
+        self.max_seconds = 0.0
+        self.bucket_counts = [0] * HISTOGRAM_BUCKET_COUNT
+
+    def record(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        if self.min_seconds is None or seconds < self.min_seconds:
+            self.min_seconds = seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        bucket_index = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKET_COUNT - 1)
+        self.bucket_counts[bucket_index] += 1
+
+    def percentile_ms(self, fraction):
+        if self.count == 0:
+            return 0.0
+        wanted_count = max(1, fraction * self.count)
+        seen_count = 0
+        for bucket_index, bucket_count in enumerate(self.bucket_counts):
+            seen_count += bucket_count
+            if seen_count >= wanted_count:
+                return min((2 ** bucket_index) / 1000, self.max_seconds * 1000)
+        return self.max_seconds * 1000
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "mean_ms": round(self.total_seconds * 1000 / self.count, 3) if self.count else 0.0,
+            "min_ms": round((self.min_seconds or 0.0) * 1000, 3),
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "p50_ms": round(self.percentile_ms(0.50), 3),
+            "p90_ms": round(self.percentile_ms(0.90), 3),
+            "p99_ms": round(self.percentile_ms(0.99), 3),
+            "buckets_us": {
+                "<{}".format(2 ** bucket_index): bucket_count
+                for bucket_index, bucket_count in enumerate(self.bucket_counts)
+                if bucket_count
+            },
+        }
+
+
+class _OperationTimer:
+    __slots__ = ("metrics", "operation_name", "started_at")
+
+    def __init__(self, metrics, operation_name):
+        self.metrics = metrics
+        self.operation_name = operation_name
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record_latency(self.operation_name, time.perf_counter() - self.started_at)
+        if exc_type is not None:
+            self.metrics.increment(self.operation_name + ".errors")
+        return False
+
+
+class Metrics:
+    # Off by default. Hot paths test `metrics.enabled` before reading the clock, and
+    # measure() hands out a shared no-op context manager while disabled, so the
+    # cost of switched-off instrumentation is one attribute lookup per call site.
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.counters = {}
+        self.enabled_at = None
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self.enabled_at = time.time()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        if self.enabled:
+            self.enabled_at = time.time()
+
+    def measure(self, operation_name):
+        if not self.enabled:
+            return _DISABLED_TIMER
+        return _OperationTimer(self, operation_name)
+
+    def record_latency(self, operation_name, seconds):
+        histogram = self.histograms.get(operation_name)
+        if histogram is None:
+            histogram = self.histograms[operation_name] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def increment(self, counter_name, amount=1):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+    def to_dict(self):
+        return {
+            "enabled": self.enabled,
+            "enabled_at": self.enabled_at,
+            "latencies": {
+                operation_name: self.histograms[operation_name].to_dict()
+                for operation_name in sorted(self.histograms)
+            },
+            "counters": {counter_name: self.counters[counter_name] for counter_name in sorted(self.counters)},
+        }
+
+    def format_report(self):
+        if not self.histograms and not self.counters:
+            return "No metrics recorded{}.".format("" if self.enabled else " (instrumentation is off)")
+
+        report_lines = ["Instrumentation is {}.".format("on" if self.enabled else "off")]
+        if self.histograms:
+            report_lines.append("{:<36} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+                "operation", "count", "mean ms", "p50 ms", "p99 ms", "max ms",
+            ))
+            for operation_name in sorted(self.histograms):
+                histogram_data = self.histograms[operation_name].to_dict()
+                report_lines.append("{:<36} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                    operation_name,
+                    histogram_data["count"],
+                    histogram_data["mean_ms"],
+                    histogram_data["p50_ms"],
+                    histogram_data["p99_ms"],
+                    histogram_data["max_ms"],
+                ))
+        for counter_name in sorted(self.counters):
+            report_lines.append("{:<36} {:>8}".format(counter_name, self.counters[counter_name]))
+        return "\n".join(report_lines)
+
+    def write_json(self, filename):
+        try:
+            with open(filename, "w", encoding="utf-8") as metrics_file:
+                json.dump(self.to_dict(), metrics_file, indent=2)
+                metrics_file.write("\n")
+        except OSError as error:
+            raise OSError("Failed to save file: {}".format(error))
+
+
+metrics = Metrics()
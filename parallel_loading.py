@@ -0,0 +1,188 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from decoding import decode_date
+from errors import ReservationConflictError
+from reservation import reservation_from_dict, reservation_record_from_reservation
+from reservation_book import (
+    reservation_book_from_dict,
+    validate_new_reservation,
+    group_reservation_records,
+    find_conflicting_record_pairs,
+    find_series_conflicts,
+    index_series,
+    describe_conflict,
+    format_conflict_report,
+)
+
+
+MINIMUM_PARALLEL_ROWS = 50000
+SHARDS_PER_WORKER = 4
+_RESERVATION_FIELDS = ("room_id", "person", "purpose", "date", "start_time", "end_time")
+# Optional: older books were saved without it.
+_RESERVATION_ID_FIELD = "reservation_id"
+
+
+def _shard_date_key(raw_date, date_keys):
+    date_key = date_keys.get(raw_date)
+    if date_key is None and raw_date not in date_keys:
+        try:
+            date_key = decode_date(raw_date).toordinal()
+        except (TypeError, ValueError):
+            date_key = None
+        date_keys[raw_date] = date_key
+    return date_key
+
+
+def _compact_reservation_data(reservation_data):
+    # Plain tuples pickle several times faster than dicts; anything unusual is sent
+    # as-is so the worker raises the same error reservation_from_dict would.
+    try:
+        return tuple(reservation_data[field_name] for field_name in _RESERVATION_FIELDS) + (
+            reservation_data.get(_RESERVATION_ID_FIELD),
+        )
+    except (KeyError, TypeError):
+        return reservation_data
+
+
+def _expand_reservation_data(compact_data):
+    if isinstance(compact_data, tuple):
+        return dict(zip(_RESERVATION_FIELDS + (_RESERVATION_ID_FIELD,), compact_data))
+    return compact_data
+
+
+def shard_reservations_by_date(reservations_data, shard_count):
+    # Conflicts only exist within one date, so whole dates are kept together and
+    # contiguous date ranges are packed into shards of roughly equal size.
+    # Records with an unreadable date go to the first shard, where parsing reports them.
+    date_keys = {}
+    positions_by_date = {}
+    for position, reservation_data in enumerate(reservations_data):
+        raw_date = reservation_data.get("date") if isinstance(reservation_data, dict) else None
+        positions_by_date.setdefault(_shard_date_key(raw_date, date_keys), []).append(position)
+
+    target_shard_size = max(1, len(reservations_data) // max(1, shard_count))
+    shards = [[]]
+    for date_key in sorted(positions_by_date, key=lambda key: (key is not None, key or 0)):
+        if len(shards[-1]) >= target_shard_size:
+            shards.append([])
+        shards[-1].extend(
+            (position, _compact_reservation_data(reservations_data[position]))
+            for position in positions_by_date[date_key]
+        )
+    return [shard for shard in shards if shard]
+
+
+def validate_reservation_shard(shard_rows, known_room_ids, series_list=(), collect_rows=True):
+    # Runs in a worker process. Reservation ids are the positions in the input, so
+    # the parent can merge errors and conflicts from all shards by position; the
+    # saved ids travel alongside.
+    failures = []
+    records = []
+    saved_ids = {}
+    for position, reservation_data in shard_rows:
+        try:
+            reservation = reservation_from_dict(_expand_reservation_data(reservation_data))
+            validate_new_reservation(reservation, known_room_ids)
+        except Exception as error:
+            failures.append((position, error))
+            continue
+        records.append(reservation_record_from_reservation(reservation, position))
+        saved_ids[position] = reservation.reservation_id
+
+    if failures:
+        return failures, [], []
+
+    room_groups, person_groups = group_reservation_records(records)
+    # Conflict keys match ReservationBook._add_records_bulk: (position, 0, earlier
+    # position) between bookings, (position, 1, series id) against a series.
+    conflicts = [
+        ((later_position, 0, earlier_position), describe_conflict(earlier_record, later_record))
+        for (later_position, earlier_position), (earlier_record, later_record)
+        in find_conflicting_record_pairs(room_groups, person_groups).items()
+    ]
+    if series_list:
+        room_series, person_series = index_series(series_list)
+        for record in records:
+            conflicts.extend(
+                ((record.reservation_id, 1, series_id), conflict_message)
+                for series_id, conflict_message in find_series_conflicts(record, room_series, person_series)
+            )
+
+    if not collect_rows:
+        return [], conflicts, []
+
+    reservation_rows = [
+        (
+            record.reservation_id,
+            saved_ids[record.reservation_id],
+            record.room_id,
+            record.person_name,
+            record.reservation_purpose,
+            record.date_ordinal,
+            record.start_minute,
+            record.end_minute,
+        )
+        for record in records
+    ]
+    return [], conflicts, reservation_rows
+
+
+def validate_reservations_parallel(
+    reservations_data,
+    known_room_ids,
+    series_list=(),
+    max_workers=None,
+    collect_rows=True,
+):
+    worker_count = max_workers or os.cpu_count() or 1
+    shards = shard_reservations_by_date(reservations_data, worker_count * SHARDS_PER_WORKER)
+    known_room_ids = frozenset(known_room_ids)
+
+    failures = []
+    conflicts = []
+    reservation_rows = []
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        for shard_failures, shard_conflicts, shard_rows in executor.map(
+            validate_reservation_shard,
+            shards,
+            repeat(known_room_ids),
+            repeat(list(series_list)),
+            repeat(collect_rows),
+        ):
+            failures.extend(shard_failures)
+            conflicts.extend(shard_conflicts)
+            reservation_rows.extend(shard_rows)
+
+    # The same record fails first, and conflicts are listed in the same order, as in
+    # the sequential ReservationBook.add_reservations_bulk.
+    if failures:
+        raise min(failures, key=lambda failure: failure[0])[1]
+
+    if conflicts:
+        conflicts.sort(key=lambda conflict: conflict[0])
+        raise ReservationConflictError(format_conflict_report([
+            "Reservation #{}: {}".format(conflict_key[0] + 1, conflict_message)
+            for conflict_key, conflict_message in conflicts
+        ]))
+
+    reservation_rows.sort()
+    return [reservation_row[1:] for reservation_row in reservation_rows]
+
+
+def reservation_book_from_dict_parallel(book_data, max_workers=None, minimum_parallel_rows=MINIMUM_PARALLEL_ROWS):
+    reservations_data = book_data.get("reservations", [])
+    if len(reservations_data) < minimum_parallel_rows:
+        return reservation_book_from_dict(book_data)
+
+    reservation_book = reservation_book_from_dict({
+        "classrooms": book_data.get("classrooms", []),
+        "series": book_data.get("series", []),
+    })
+    reservation_book.add_validated_reservation_rows(validate_reservations_parallel(
+        reservations_data,
+        reservation_book.classrooms_by_id,
+        series_list=reservation_book.list_series(),
+        max_workers=max_workers,
+    ))
+    return reservation_book
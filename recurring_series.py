@@ -0,0 +1,192 @@
+from datetime import date, time
+from math import gcd
+from reservation import ReservationRecord, format_minutes, minutes_from_time
+from decoding import decode_date, decode_time, decode_text
+
+
+class RecurringSeries:
+    def __init__(
+        self,
+        room_id,
+        person_name,
+        reservation_purpose,
+        first_date,
+        last_date,
+        interval_days,
+        start_time,
+        end_time,
+        excluded_dates=None,
+        series_id=None,
+    ):
+        self.series_id = series_id
+        self.room_id = room_id
+        self.person_name = person_name
+        self.reservation_purpose = reservation_purpose
+        self.first_date_ordinal = first_date.toordinal()
+        self.last_date_ordinal = last_date.toordinal()
+        self.interval_days = interval_days
+        self.start_minute = minutes_from_time(start_time)
+        self.end_minute = minutes_from_time(end_time)
+        self.excluded_date_ordinals = {excluded_date.toordinal() for excluded_date in excluded_dates or []}
+
+    @property
+    def first_date(self):
+        return date.fromordinal(self.first_date_ordinal)
+
+    @property
+    def last_date(self):
+        return date.fromordinal(self.last_date_ordinal)
+
+    @property
+    def start_time(self):
+        return time(*divmod(self.start_minute, 60))
+
+    @property
+    def end_time(self):
+        return time(*divmod(self.end_minute, 60))
+
+    @property
+    def excluded_dates(self):
+        return [date.fromordinal(date_ordinal) for date_ordinal in sorted(self.excluded_date_ordinals)]
+
+    def occurs_on(self, date_ordinal):
+        return (
+            self.first_date_ordinal <= date_ordinal <= self.last_date_ordinal
+            and (date_ordinal - self.first_date_ordinal) % self.interval_days == 0
+            and date_ordinal not in self.excluded_date_ordinals
+        )
+
+    def occurrence_ordinals(self, first_date_ordinal=None, last_date_ordinal=None):
+        # Yields the occurrence dates inside the requested range only; nothing is
+        # stored per occurrence.
+        range_first = self.first_date_ordinal if first_date_ordinal is None else max(first_date_ordinal, self.first_date_ordinal)
+        range_last = self.last_date_ordinal if last_date_ordinal is None else min(last_date_ordinal, self.last_date_ordinal)
+        if range_first > range_last:
+            return
+
+        skipped_steps = -(-(range_first - self.first_date_ordinal) // self.interval_days)
+        for date_ordinal in range(
+            self.first_date_ordinal + skipped_steps * self.interval_days,
+            range_last + 1,
+            self.interval_days,
+        ):
+            if date_ordinal not in self.excluded_date_ordinals:
+                yield date_ordinal
+
+    def occurrence_count(self):
+        total_count = (self.last_date_ordinal - self.first_date_ordinal) // self.interval_days + 1
+        return total_count - sum(
+            1 for date_ordinal in self.excluded_date_ordinals
+            if self.first_date_ordinal <= date_ordinal <= self.last_date_ordinal
+            and (date_ordinal - self.first_date_ordinal) % self.interval_days == 0
+        )
+
+    def occurrence_record(self, date_ordinal):
+        return SeriesOccurrenceRecord(self, date_ordinal)
+
+    def same_pattern(self, other):
+        return (
+            self.room_id == other.room_id
+            and self.person_name == other.person_name
+            and self.reservation_purpose == other.reservation_purpose
+            and self.first_date_ordinal == other.first_date_ordinal
+            and self.last_date_ordinal == other.last_date_ordinal
+            and self.interval_days == other.interval_days
+            and self.start_minute == other.start_minute
+            and self.end_minute == other.end_minute
+        )
+
+    def to_dict(self):
+        series_data = {
+            "room_id": self.room_id,
+            "person": self.person_name,
+            "purpose": self.reservation_purpose,
+            "first_date": self.first_date.isoformat(),
+            "last_date": self.last_date.isoformat(),
+            "interval_days": self.interval_days,
+            "start_time": format_minutes(self.start_minute),
+            "end_time": format_minutes(self.end_minute),
+            "excluded_dates": [excluded_date.isoformat() for excluded_date in self.excluded_dates],
+        }
+        if self.series_id is not None:
+            series_data["series_id"] = self.series_id
+        return series_data
+
+
+class SeriesOccurrenceRecord(ReservationRecord):
+    __slots__ = ("series_id",)
+
+    def __init__(self, series, date_ordinal):
+        super().__init__(
+            reservation_id=None,
+            room_id=series.room_id,
+            person_name=series.person_name,
+            reservation_purpose=series.reservation_purpose,
+            date_ordinal=date_ordinal,
+            start_minute=series.start_minute,
+            end_minute=series.end_minute,
+        )
+        self.series_id = series.series_id
+
+    def to_reservation(self):
+        reservation = super().to_reservation()
+        reservation.series_id = self.series_id
+        return reservation
+
+
+def recurring_series_from_dict(series_data):
+    return RecurringSeries(
+        room_id=decode_text(series_data["room_id"]),
+        person_name=decode_text(series_data["person"]),
+        reservation_purpose=decode_text(series_data["purpose"]),
+        first_date=decode_date(series_data["first_date"]),
+        last_date=decode_date(series_data["last_date"]),
+        interval_days=int(series_data["interval_days"]),
+        start_time=decode_time(series_data["start_time"]),
+        end_time=decode_time(series_data["end_time"]),
+        excluded_dates=[decode_date(raw_date) for raw_date in series_data.get("excluded_dates", [])],
+        series_id=_decode_series_id(series_data.get("series_id")),
+    )
+
+
+def _decode_series_id(raw_value):
+    # Saved books keep each series' id; older files have none and the book
+    # numbers those series itself.
+    if raw_value is None:
+        return None
+    if isinstance(raw_value, bool) or not isinstance(raw_value, int) or raw_value <= 0:
+        raise ValueError("Series ID must be a positive integer.")
+    return raw_value
+
+
+def first_common_occurrence(first_series, second_series):
+    # Both patterns are arithmetic progressions of date ordinals, so their common
+    # dates form one progression with step lcm(interval_a, interval_b); it is found
+    # with the Chinese remainder theorem instead of expanding either series.
+    range_first = max(first_series.first_date_ordinal, second_series.first_date_ordinal)
+    range_last = min(first_series.last_date_ordinal, second_series.last_date_ordinal)
+    if range_first > range_last:
+        return None
+
+    common_divisor = gcd(first_series.interval_days, second_series.interval_days)
+    offset = second_series.first_date_ordinal - first_series.first_date_ordinal
+    if offset % common_divisor:
+        return None
+
+    reduced_interval = second_series.interval_days // common_divisor
+    step_count = 0
+    if reduced_interval > 1:
+        step_inverse = pow(first_series.interval_days // common_divisor, -1, reduced_interval)
+        step_count = (offset // common_divisor) * step_inverse % reduced_interval
+    common_interval = first_series.interval_days * reduced_interval
+
+    date_ordinal = first_series.first_date_ordinal + step_count * first_series.interval_days
+    date_ordinal += -(-(range_first - date_ordinal) // common_interval) * common_interval
+    while date_ordinal <= range_last:
+        if (
+            date_ordinal not in first_series.excluded_date_ordinals
+            and date_ordinal not in second_series.excluded_date_ordinals
+        ):
+            return date_ordinal
+        date_ordinal += common_interval
+    return None
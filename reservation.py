@@ -1,8 +1,22 @@
+import sys
 from datetime import date, time
+from decoding import decode_date, decode_time, decode_text
 
 
 class Reservation:
-    def __init__(self, room_id, person_name, reservation_purpose, reservation_date, start_time, end_time):
+    def __init__(
+        self,
+        room_id,
+        person_name,
+        reservation_purpose,
+        reservation_date,
+        start_time,
+        end_time,
+        reservation_id=None,
+        series_id=None,
+    ):
+        self.reservation_id = reservation_id
+        self.series_id = series_id
         self.room_id = room_id
         self.person_name = person_name
         self.reservation_purpose = reservation_purpose
@@ -11,7 +25,7 @@ class Reservation:
         self.end_time = end_time
 
     def to_dict(self):
-        return {
+        reservation_data = {
             "room_id": self.room_id,
             "person": self.person_name,
             "purpose": self.reservation_purpose,
@@ -19,6 +33,9 @@ class Reservation:
             "start_time": self.start_time.strftime("%H:%M"),
             "end_time": self.end_time.strftime("%H:%M"),
         }
+        if self.reservation_id is not None:
+            reservation_data["reservation_id"] = self.reservation_id
+        return reservation_data
 
     def __eq__(self, other):
         return (
@@ -33,6 +50,23 @@ class Reservation:
 
 
 def reservation_from_dict(reservation_data):
+    try:
+        return Reservation(
+            room_id=decode_text(reservation_data["room_id"]),
+            person_name=decode_text(reservation_data["person"]),
+            reservation_purpose=decode_text(reservation_data["purpose"]),
+            reservation_date=decode_date(reservation_data["date"]),
+            start_time=decode_time(reservation_data["start_time"]),
+            end_time=decode_time(reservation_data["end_time"]),
+            reservation_id=_decode_reservation_id(reservation_data.get("reservation_id")),
+        )
+    except Exception:
+        # Invalid records are decoded again field by field, so a record with
+        # several problems reports the same one as always.
+        return _reservation_from_dict_fields(reservation_data)
+
+
+def _reservation_from_dict_fields(reservation_data):
     year, month, day = [int(part) for part in str(reservation_data["date"]).split("-")]
     start_hour, start_minute = [int(part) for part in str(reservation_data["start_time"]).split(":")]
     end_hour, end_minute = [int(part) for part in str(reservation_data["end_time"]).split(":")]
@@ -44,4 +78,114 @@ def reservation_from_dict(reservation_data):
         reservation_date=date(year, month, day),
         start_time=time(start_hour, start_minute),
         end_time=time(end_hour, end_minute),
+        reservation_id=_decode_reservation_id(reservation_data.get("reservation_id")),
+    )
+
+
+def _decode_reservation_id(raw_value):
+    # Saved books keep each reservation's id; older files have none and the book
+    # numbers those reservations itself.
+    if raw_value is None:
+        return None
+    if isinstance(raw_value, bool) or not isinstance(raw_value, int) or raw_value <= 0:
+        raise ValueError("Reservation ID must be a positive integer.")
+    return raw_value
+
+
+_SHARED_MINUTES = tuple(range(24 * 60))
+_shared_ordinals = {}
+
+
+class ReservationRecord:
+    __slots__ = (
+        "reservation_id",
+        "room_id",
+        "person_name",
+        "reservation_purpose",
+        "date_ordinal",
+        "start_minute",
+        "end_minute",
+    )
+
+    def __init__(self, reservation_id, room_id, person_name, reservation_purpose, date_ordinal, start_minute, end_minute):
+        self.reservation_id = reservation_id
+        self.room_id = room_id
+        self.person_name = person_name
+        self.reservation_purpose = reservation_purpose
+        self.date_ordinal = date_ordinal
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+
+    def same_booking(self, other):
+        return (
+            self.room_id == other.room_id
+            and self.person_name == other.person_name
+            and self.reservation_purpose == other.reservation_purpose
+            and self.date_ordinal == other.date_ordinal
+            and self.start_minute == other.start_minute
+            and self.end_minute == other.end_minute
+        )
+
+    def to_reservation(self):
+        return Reservation(
+            room_id=self.room_id,
+            person_name=self.person_name,
+            reservation_purpose=self.reservation_purpose,
+            reservation_date=date.fromordinal(self.date_ordinal),
+            start_time=time(*divmod(self.start_minute, 60)),
+            end_time=time(*divmod(self.end_minute, 60)),
+            reservation_id=self.reservation_id,
+        )
+
+    def to_dict(self):
+        reservation_data = {
+            "room_id": self.room_id,
+            "person": self.person_name,
+            "purpose": self.reservation_purpose,
+            "date": date.fromordinal(self.date_ordinal).isoformat(),
+            "start_time": format_minutes(self.start_minute),
+            "end_time": format_minutes(self.end_minute),
+        }
+        if self.reservation_id is not None:
+            reservation_data["reservation_id"] = self.reservation_id
+        return reservation_data
+
+
+def format_minutes(minute_of_day):
+    return "{:02d}:{:02d}".format(*divmod(minute_of_day, 60))
+
+
+def minutes_from_time(time_value):
+    return _SHARED_MINUTES[time_value.hour * 60 + time_value.minute]
+
+
+def reservation_record_from_fields(
+    reservation_id,
+    room_id,
+    person_name,
+    reservation_purpose,
+    date_ordinal,
+    start_minute,
+    end_minute,
+):
+    return ReservationRecord(
+        reservation_id=reservation_id,
+        room_id=sys.intern(room_id),
+        person_name=sys.intern(person_name),
+        reservation_purpose=sys.intern(reservation_purpose),
+        date_ordinal=_shared_ordinals.setdefault(date_ordinal, date_ordinal),
+        start_minute=_SHARED_MINUTES[start_minute],
+        end_minute=_SHARED_MINUTES[end_minute],
+    )
+
+
+def reservation_record_from_reservation(reservation, reservation_id):
+    return reservation_record_from_fields(
+        reservation_id,
+        reservation.room_id,
+        reservation.person_name,
+        reservation.reservation_purpose,
+        reservation.reservation_date.toordinal(),
+        minutes_from_time(reservation.start_time),
+        minutes_from_time(reservation.end_time),
     )
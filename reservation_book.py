@@ -1,159 +1,1452 @@
+import heapq
+import time
+import weakref
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from copy import copy
+from datetime import date
+from functools import wraps
+from itertools import islice
+from operator import attrgetter, itemgetter
 from errors import ReservationConflictError, NotFoundError
 from classroom import classroom_from_dict
-from reservation import reservation_from_dict
+from sorted_list import SortedList
+from recurring_series import recurring_series_from_dict, first_common_occurrence
+from metrics import metrics
+from reservation_query import ReservationQuery, DEFAULT_PAGE_SIZE, cursor_from_record, listing_key_from_cursor
+from reservation import (
+    reservation_from_dict,
+    reservation_record_from_reservation,
+    reservation_record_from_fields,
+    format_minutes,
+    minutes_from_time,
+    ReservationRecord,
+)
+
+
+LISTING_CACHE_SIZE = 64
+# Larger listings are rebuilt on every call rather than pinned in the cache.
+LISTING_CACHE_MAX_ROWS = 10000
+_CLASSROOMS_CACHE_KEY = "classrooms"
+# Reservations are stored by id in chunks of 2**RECORD_CHUNK_BITS consecutive ids,
+# so a copy-on-write change copies one chunk rather than a map of every booking.
+RECORD_CHUNK_BITS = 10
+# suggest_alternatives looks for free times within these hours (unless the wanted
+# booking lies outside them) on the wanted day and this many following days.
+SUGGESTION_FIRST_MINUTE = 7 * 60
+SUGGESTION_LAST_MINUTE = 21 * 60
+SUGGESTION_SEARCH_DAYS = 7
+SUGGESTED_SLOT_COUNT = 3
+SUGGESTED_ROOM_COUNT = 5
+
+# Everything a transaction, snapshot or undo step has to keep. The containers are
+# shared, never copied up front; see ReservationBook._private.
+_STATE_FIELDS = (
+    "classrooms_by_id",
+    "_rooms_by_equipment",
+    "_rooms_by_capacity",
+    "_rooms_by_building",
+    "_record_chunks",
+    "_ordered_records",
+    "_room_schedule",
+    "_person_schedule",
+    "_next_reservation_id",
+    "_series_by_id",
+    "_room_series",
+    "_person_series",
+    "_next_series_id",
+)
+
+_interval_key = attrgetter("start_minute", "end_minute", "reservation_id")
+_listing_key = attrgetter("date_ordinal", "room_id", "start_minute")
+
+
+def time_intervals_overlap(first_start, first_end, second_start, second_end):
+    return first_start < second_end and second_start < first_end
+
+
+def describe_conflict(existing_record, new_record):
+    if existing_record.same_booking(new_record):
+        return "Duplicate reservation: identical reservation already exists."
+
+    same_room = existing_record.room_id == new_record.room_id
+    same_date = existing_record.date_ordinal == new_record.date_ordinal
+
+    if same_room and same_date:
+        exactly_same_interval = (
+            existing_record.start_minute == new_record.start_minute
+            and existing_record.end_minute == new_record.end_minute
+        )
+        if exactly_same_interval:
+            return "Conflict: room '{}' is already reserved on {} for exactly {}-{}.".format(
+                new_record.room_id,
+                date.fromordinal(new_record.date_ordinal).isoformat(),
+                format_minutes(new_record.start_minute),
+                format_minutes(new_record.end_minute),
+            )
+
+        overlapping_time = time_intervals_overlap(
+            existing_record.start_minute,
+            existing_record.end_minute,
+            new_record.start_minute,
+            new_record.end_minute,
+        )
+        if overlapping_time:
+            return "Conflict: room '{}' is already reserved on {} {}-{} by {} ({}).".format(
+                new_record.room_id,
+                date.fromordinal(new_record.date_ordinal).isoformat(),
+                format_minutes(existing_record.start_minute),
+                format_minutes(existing_record.end_minute),
+                existing_record.person_name,
+                existing_record.reservation_purpose,
+            )
+
+    same_person = existing_record.person_name == new_record.person_name
+    if same_person and same_date:
+        overlapping_time = time_intervals_overlap(
+            existing_record.start_minute,
+            existing_record.end_minute,
+            new_record.start_minute,
+            new_record.end_minute,
+        )
+        if overlapping_time:
+            return "Conflict: '{}' already has a reservation on {} {}-{} in room '{}' ({}).".format(
+                new_record.person_name,
+                date.fromordinal(new_record.date_ordinal).isoformat(),
+                format_minutes(existing_record.start_minute),
+                format_minutes(existing_record.end_minute),
+                existing_record.room_id,
+                existing_record.reservation_purpose,
+            )
+
+    return None
+
+
+def validate_new_reservation(reservation, known_room_ids):
+    reservation.room_id = reservation.room_id.strip()
+    reservation.person_name = reservation.person_name.strip()
+    reservation.reservation_purpose = reservation.reservation_purpose.strip()
+
+    if reservation.room_id not in known_room_ids:
+        raise NotFoundError("Classroom '{}' does not exist.".format(reservation.room_id))
+
+    if reservation.start_time >= reservation.end_time:
+        raise ValueError("Start time must be earlier than end time.")
+
+
+def validate_new_series(series, known_room_ids):
+    series.room_id = series.room_id.strip()
+    series.person_name = series.person_name.strip()
+    series.reservation_purpose = series.reservation_purpose.strip()
+
+    if series.room_id not in known_room_ids:
+        raise NotFoundError("Classroom '{}' does not exist.".format(series.room_id))
+
+    if series.start_minute >= series.end_minute:
+        raise ValueError("Start time must be earlier than end time.")
+
+    if series.interval_days <= 0:
+        raise ValueError("Repeat interval must be > 0.")
+
+    if series.first_date_ordinal > series.last_date_ordinal:
+        raise ValueError("First date must not be after last date.")
+
+
+def index_series(series_list):
+    room_series = {}
+    person_series = {}
+    for series in series_list:
+        room_series.setdefault(series.room_id, []).append(series)
+        person_series.setdefault(series.person_name, []).append(series)
+    return room_series, person_series
+
+
+def find_series_conflicts(record, room_series, person_series):
+    # A single booking can only meet the one occurrence of a series on its own date,
+    # so each series is checked arithmetically instead of being expanded.
+    conflict_messages = {}
+    for series in room_series.get(record.room_id, []) + person_series.get(record.person_name, []):
+        if series.series_id in conflict_messages or not series.occurs_on(record.date_ordinal):
+            continue
+        conflict_message = describe_conflict(series.occurrence_record(record.date_ordinal), record)
+        if conflict_message is not None:
+            conflict_messages[series.series_id] = conflict_message
+    return sorted(conflict_messages.items())
+
+
+def format_conflict_report(conflict_messages):
+    return "{} conflict(s) found:\n{}".format(len(conflict_messages), "\n".join(conflict_messages))
+
+
+def group_reservation_records(records):
+    room_groups = {}
+    person_groups = {}
+    for record in records:
+        room_groups.setdefault((record.room_id, record.date_ordinal), []).append(record)
+        person_groups.setdefault((record.person_name, record.date_ordinal), []).append(record)
+
+    for groups in (room_groups, person_groups):
+        for grouped_records in groups.values():
+            grouped_records.sort(key=_interval_key)
+
+    return room_groups, person_groups
+
+
+def find_conflicting_record_pairs(room_groups, person_groups):
+    # One sweep per sorted group: a record conflicts if it starts before the latest
+    # end seen so far in its group. Pairs are keyed (later id, earlier id).
+    conflicting_pairs = {}
+    for groups in (room_groups, person_groups):
+        for grouped_records in groups.values():
+            latest_record = grouped_records[0]
+            for record in grouped_records[1:]:
+                if record.start_minute < latest_record.end_minute:
+                    earlier_record, later_record = sorted((latest_record, record), key=attrgetter("reservation_id"))
+                    conflicting_pairs[(later_record.reservation_id, earlier_record.reservation_id)] = (
+                        earlier_record,
+                        later_record,
+                    )
+                if record.end_minute > latest_record.end_minute:
+                    latest_record = record
+    return conflicting_pairs
+
+
+def _book_operation(method):
+    # With undo history on, each outermost change runs as a transaction, whose
+    # commit records the state to go back to.
+    @wraps(method)
+    def book_operation(self, *args, **kwargs):
+        if self._transaction_states or not self._undo_states.maxlen:
+            if self._owned_containers is not None and not self._transaction_states:
+                self._release_shared_containers()
+            return method(self, *args, **kwargs)
+        with self.transaction():
+            return method(self, *args, **kwargs)
+    return book_operation
 
 
 class ReservationBook:
+    # Snapshots and undo keep the book's earlier states in memory, which a book
+    # stored elsewhere (SqliteReservationBook) does not have.
+    supports_snapshots = True
+
     def __init__(self):
         self.classrooms_by_id = {}
-        self.reservation_list = []
+        self._rooms_by_equipment = {}
+        self._rooms_by_capacity = []
+        # Building name -> sorted (capacity, room_id) pairs of its rooms.
+        self._rooms_by_building = {}
+        self._record_chunks = {}
+        self._ordered_records = SortedList(key=_listing_key)
+        self._room_schedule = {}
+        self._person_schedule = {}
+        self._next_reservation_id = 1
+        self._series_by_id = {}
+        self._room_series = {}
+        self._person_series = {}
+        self._next_series_id = 1
+        self._change_listeners = []
+        # Every mutation bumps the generation; cached listings from an older
+        # generation are dropped on the next lookup.
+        self._generation = 0
+        self._listing_cache = OrderedDict()
+        self._listing_cache_generation = 0
+        self._listing_cache_hits = 0
+        self._listing_cache_misses = 0
+        self._listing_cache_evictions = 0
+        # Ids of the containers this book may change in place, or None while no
+        # transaction, snapshot or undo step shares them.
+        self._owned_containers = None
+        self._transaction_states = []
+        self._pending_changes = []
+        self._undo_states = deque(maxlen=0)
+        self._snapshots = weakref.WeakSet()
+
+    def add_change_listener(self, listener):
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener):
+        self._change_listeners.remove(listener)
+
+    def _notify_change(self, operation, payload=None):
+        # Inside a transaction listeners (the journal) hear about changes only
+        # once it commits.
+        if self._transaction_states:
+            self._pending_changes.append((operation, payload))
+            return
+        for listener in list(self._change_listeners):
+            listener(operation, payload)
 
+    def _private(self, container):
+        # Returns a container the book may change in place. While an older state
+        # shares the book's containers, each one is copied before its first
+        # change, so keeping a state costs nothing until the book changes.
+        owned_containers = self._owned_containers
+        if owned_containers is None or id(container) in owned_containers:
+            return container
+        container = container.copy()
+        owned_containers.add(id(container))
+        return container
+
+    def _private_entry(self, mapping, key, container_type):
+        # _private for a container stored in an already private mapping; a
+        # missing one is created.
+        container = mapping.get(key)
+        if container is None:
+            container = mapping[key] = container_type()
+        elif self._owned_containers is not None and id(container) not in self._owned_containers:
+            container = mapping[key] = container.copy()
+            self._owned_containers.add(id(container))
+        return container
+
+    def _capture_state(self):
+        self._owned_containers = set()
+        return tuple(getattr(self, field_name) for field_name in _STATE_FIELDS)
+
+    def _restore_state(self, state):
+        for field_name, value in zip(_STATE_FIELDS, state):
+            setattr(self, field_name, value)
+        self._owned_containers = set()
+        self._generation += 1
+
+    def _release_shared_containers(self):
+        # Once nothing holds an older state, changes go back to working in place.
+        if not self._transaction_states and not self._undo_states and not self._snapshots:
+            self._owned_containers = None
+
+    @contextmanager
+    def transaction(self):
+        # All changes made in the block are kept, or none are if it raises.
+        # Transactions may nest; an inner one that fails rolls back only its own
+        # changes. Opening one is O(1): it keeps the current state and the
+        # containers are copied as they change.
+        self._transaction_states.append((self._capture_state(), len(self._pending_changes)))
+        try:
+            yield self
+        except BaseException:
+            state, pending_count = self._transaction_states.pop()
+            self._restore_state(state)
+            del self._pending_changes[pending_count:]
+            self._release_shared_containers()
+            raise
+
+        state, _ = self._transaction_states.pop()
+        if self._transaction_states:
+            return
+        if self._undo_states.maxlen:
+            self._undo_states.append(state)
+        pending_changes = self._pending_changes
+        self._pending_changes = []
+        self._release_shared_containers()
+        for operation, payload in pending_changes:
+            self._notify_change(operation, payload)
+
+    def snapshot(self):
+        # A read-only view of the book as it is now, e.g. for an export running
+        # while the book keeps changing. Taking one is O(1).
+        book_snapshot = ReservationBookSnapshot(self._capture_state())
+        self._snapshots.add(book_snapshot)
+        return book_snapshot
+
+    def keep_undo_history(self, step_limit):
+        # Each outermost change (or transaction) becomes one undo step; the oldest
+        # steps are dropped past step_limit, and 0 turns the history off.
+        if step_limit < 0:
+            raise ValueError("Undo history size must be >= 0.")
+        self._undo_states = deque(self._undo_states, maxlen=step_limit)
+        self._release_shared_containers()
+
+    def clear_undo_history(self):
+        self._undo_states.clear()
+        self._release_shared_containers()
+
+    def undo_step_count(self):
+        return len(self._undo_states)
+
+    def undo(self, step_count=1):
+        if self._transaction_states:
+            raise ValueError("Cannot undo inside a transaction.")
+        if step_count < 1:
+            raise ValueError("Number of changes to undo must be > 0.")
+        if step_count > len(self._undo_states):
+            raise ValueError("Only {} change(s) can be undone.".format(len(self._undo_states)))
+
+        for _ in range(step_count - 1):
+            self._undo_states.pop()
+        self._restore_state(self._undo_states.pop())
+        self._release_shared_containers()
+        if self._change_listeners:
+            self._notify_change("undo")
+
+    def _cached_listing(self, cache_key):
+        if self._listing_cache_generation != self._generation:
+            self._listing_cache.clear()
+            self._listing_cache_generation = self._generation
+
+        cached_list = self._listing_cache.get(cache_key)
+        if cached_list is not None:
+            self._listing_cache.move_to_end(cache_key)
+        return cached_list
+
+    def _lookup_listing(self, cache_key):
+        cached_list = self._cached_listing(cache_key)
+        if cached_list is None:
+            self._listing_cache_misses += 1
+        else:
+            self._listing_cache_hits += 1
+        if metrics.enabled:
+            metrics.increment("book.listing_cache_misses" if cached_list is None else "book.listing_cache_hits")
+        return cached_list
+
+    def _remember_listing(self, cache_key, listed_items):
+        if len(listed_items) > LISTING_CACHE_MAX_ROWS:
+            return
+        self._listing_cache[cache_key] = listed_items
+        if len(self._listing_cache) > LISTING_CACHE_SIZE:
+            self._listing_cache.popitem(last=False)
+            self._listing_cache_evictions += 1
+
+    def listing_cache_stats(self):
+        return {
+            "hits": self._listing_cache_hits,
+            "misses": self._listing_cache_misses,
+            "evictions": self._listing_cache_evictions,
+            "entries": len(self._listing_cache) if self._listing_cache_generation == self._generation else 0,
+            "capacity": LISTING_CACHE_SIZE,
+            "generation": self._generation,
+        }
+
+    @_book_operation
     def add_classroom(self, classroom):
         if classroom.room_id in self.classrooms_by_id:
             raise ValueError("Classroom '{}' already exists.".format(classroom.room_id))
+        self._store_classroom(classroom)
+        if self._change_listeners:
+            self._notify_change("add_classroom", classroom.to_dict())
+
+    def _store_classroom(self, classroom):
+        previous_classroom = self.classrooms_by_id.get(classroom.room_id)
+        if previous_classroom is not None:
+            self._unindex_classroom(previous_classroom)
+
+        self._generation += 1
+        self.classrooms_by_id = self._private(self.classrooms_by_id)
         self.classrooms_by_id[classroom.room_id] = classroom
+        self._rooms_by_capacity = self._private(self._rooms_by_capacity)
+        insort(self._rooms_by_capacity, (classroom.capacity, classroom.room_id))
+        self._rooms_by_building = self._private(self._rooms_by_building)
+        insort(
+            self._private_entry(self._rooms_by_building, classroom.building_name, list),
+            (classroom.capacity, classroom.room_id),
+        )
+        self._rooms_by_equipment = self._private(self._rooms_by_equipment)
+        for equipment_key in self._equipment_keys(classroom.equipment_list):
+            self._private_entry(self._rooms_by_equipment, equipment_key, set).add(classroom.room_id)
+
+    def _unindex_classroom(self, classroom):
+        self._rooms_by_capacity = self._private(self._rooms_by_capacity)
+        position = bisect_left(self._rooms_by_capacity, (classroom.capacity, classroom.room_id))
+        del self._rooms_by_capacity[position]
+        self._rooms_by_building = self._private(self._rooms_by_building)
+        building_rooms = self._private_entry(self._rooms_by_building, classroom.building_name, list)
+        del building_rooms[bisect_left(building_rooms, (classroom.capacity, classroom.room_id))]
+        if not building_rooms:
+            del self._rooms_by_building[classroom.building_name]
+        self._rooms_by_equipment = self._private(self._rooms_by_equipment)
+        for equipment_key in self._equipment_keys(classroom.equipment_list):
+            room_ids = self._private_entry(self._rooms_by_equipment, equipment_key, set)
+            room_ids.discard(classroom.room_id)
+            if not room_ids:
+                del self._rooms_by_equipment[equipment_key]
+
+    def _equipment_keys(self, equipment_list):
+        return {item.strip().lower() for item in equipment_list if item.strip()}
 
     def list_classrooms(self):
+        classroom_list = self._lookup_listing(_CLASSROOMS_CACHE_KEY)
+        if classroom_list is None:
+            classroom_list = sorted(
+                self.classrooms_by_id.values(),
+                key=lambda classroom: (classroom.building_name, classroom.room_id),
+            )
+            self._remember_listing(_CLASSROOMS_CACHE_KEY, classroom_list)
+        return list(classroom_list)
+
+    def _suitable_room_ids(self, minimum_capacity=None, required_equipment=None, building_name=None):
+        equipment_room_sets = sorted(
+            (self._rooms_by_equipment.get(equipment_key, set())
+             for equipment_key in self._equipment_keys(required_equipment or [])),
+            key=len,
+        )
+
+        if equipment_room_sets:
+            # Start from the rarest equipment item; the capacity bound is then a cheap filter.
+            candidate_room_ids = set(equipment_room_sets[0]).intersection(*equipment_room_sets[1:])
+            if minimum_capacity is not None:
+                candidate_room_ids = {
+                    room_id for room_id in candidate_room_ids
+                    if self.classrooms_by_id[room_id].capacity >= minimum_capacity
+                }
+            if building_name is not None:
+                candidate_room_ids = {
+                    room_id for room_id in candidate_room_ids
+                    if self.classrooms_by_id[room_id].building_name == building_name
+                }
+        else:
+            rooms_by_capacity = self._rooms_by_capacity
+            if building_name is not None:
+                rooms_by_capacity = self._rooms_by_building.get(building_name, [])
+            first_position = 0
+            if minimum_capacity is not None:
+                first_position = bisect_left(rooms_by_capacity, (minimum_capacity,))
+            candidate_room_ids = [room_id for _, room_id in rooms_by_capacity[first_position:]]
+        return candidate_room_ids
+
+    def list_suitable_rooms(self, minimum_capacity=None, required_equipment=None, building_name=None):
+        # Best fit first: the smallest rooms that are large enough lead the list.
         return sorted(
-            self.classrooms_by_id.values(),
-            key=lambda classroom: (classroom.building_name, classroom.room_id),
+            (
+                self.classrooms_by_id[room_id]
+                for room_id in self._suitable_room_ids(minimum_capacity, required_equipment, building_name)
+            ),
+            key=lambda classroom: (classroom.capacity, classroom.room_id),
         )
 
-    def _time_intervals_overlap(self, first_start, first_end, second_start, second_end):
-        return first_start < second_end and second_start < first_end
+    def find_available_rooms(
+        self,
+        reservation_date,
+        start_time,
+        end_time,
+        minimum_capacity=None,
+        required_equipment=None,
+        building_name=None,
+    ):
+        if start_time >= end_time:
+            raise ValueError("Start time must be earlier than end time.")
 
-    def _check_reservation_conflicts(self, new_reservation):
-        for existing_reservation in self.reservation_list:
-            if existing_reservation == new_reservation:
-                raise ReservationConflictError("Duplicate reservation: identical reservation already exists.")
+        candidate_room_ids = self._suitable_room_ids(minimum_capacity, required_equipment, building_name)
+        date_ordinal = reservation_date.toordinal()
+        start_minute = minutes_from_time(start_time)
+        end_minute = minutes_from_time(end_time)
+        available_rooms = [
+            self.classrooms_by_id[room_id]
+            for room_id in candidate_room_ids
+            if not self._room_is_booked(room_id, date_ordinal, start_minute, end_minute)
+        ]
 
-            same_room = existing_reservation.room_id == new_reservation.room_id
-            same_date = existing_reservation.reservation_date == new_reservation.reservation_date
+        return sorted(available_rooms, key=lambda classroom: (classroom.building_name, classroom.room_id))
 
-            if same_room and same_date:
-                exactly_same_interval = (
-                    existing_reservation.start_time == new_reservation.start_time
-                    and existing_reservation.end_time == new_reservation.end_time
-                )
-                if exactly_same_interval:
-                    raise ReservationConflictError(
-                        "Conflict: room '{}' is already reserved on {} for exactly {}-{}.".format(
-                            new_reservation.room_id,
-                            new_reservation.reservation_date.isoformat(),
-                            new_reservation.start_time.strftime("%H:%M"),
-                            new_reservation.end_time.strftime("%H:%M"),
-                        )
-                    )
+    def _room_is_booked(self, room_id, date_ordinal, start_minute, end_minute):
+        return bool(
+            self._overlapping_records(self._room_schedule, room_id, date_ordinal, start_minute, end_minute)
+        ) or self._room_series_occupied(room_id, date_ordinal, start_minute, end_minute)
 
-                overlapping_time = self._time_intervals_overlap(
-                    existing_reservation.start_time,
-                    existing_reservation.end_time,
-                    new_reservation.start_time,
-                    new_reservation.end_time,
-                )
-                if overlapping_time:
-                    raise ReservationConflictError(
-                        "Conflict: room '{}' is already reserved on {} {}-{} by {} ({}).".format(
-                            new_reservation.room_id,
-                            new_reservation.reservation_date.isoformat(),
-                            existing_reservation.start_time.strftime("%H:%M"),
-                            existing_reservation.end_time.strftime("%H:%M"),
-                            existing_reservation.person_name,
-                            existing_reservation.reservation_purpose,
-                        )
-                    )
+    def _room_series_occupied(self, room_id, date_ordinal, start_minute, end_minute):
+        return any(
+            series.occurs_on(date_ordinal)
+            and time_intervals_overlap(series.start_minute, series.end_minute, start_minute, end_minute)
+            for series in self._room_series.get(room_id, [])
+        )
+
+    def _booked_intervals(self, room_id, person_name, date_ordinal):
+        # (start, end) of the single bookings of the room and of the person on one
+        # day; either key may be None.
+        return [
+            (record.start_minute, record.end_minute)
+            for schedule, key in ((self._room_schedule, room_id), (self._person_schedule, person_name))
+            if key is not None
+            for record in schedule.get(key, {}).get(date_ordinal, [])
+        ]
+
+    def _busy_intervals(self, room_id, person_name, date_ordinal):
+        busy_intervals = self._booked_intervals(room_id, person_name, date_ordinal)
+        for series in self._room_series.get(room_id, []) + self._person_series.get(person_name, []):
+            if series.occurs_on(date_ordinal):
+                busy_intervals.append((series.start_minute, series.end_minute))
+        busy_intervals.sort()
+        return busy_intervals
+
+    def _free_starts(self, room_id, person_name, date_ordinal, duration, day_start, day_end, wanted_start):
+        # One start per gap between the busy intervals that is long enough: the
+        # one nearest the wanted start.
+        free_starts = []
+        gap_start = day_start
+        for busy_start, busy_end in self._busy_intervals(room_id, person_name, date_ordinal) + [(day_end, day_end)]:
+            gap_end = min(busy_start, day_end)
+            if gap_end - gap_start >= duration:
+                free_starts.append(min(max(wanted_start, gap_start), gap_end - duration))
+            gap_start = max(gap_start, busy_end)
+        return free_starts
+
+    def suggest_alternatives(
+        self,
+        reservation,
+        slot_count=SUGGESTED_SLOT_COUNT,
+        room_count=SUGGESTED_ROOM_COUNT,
+        search_days=SUGGESTION_SEARCH_DAYS,
+    ):
+        # Free alternatives to a booking, typically one that conflicts: "slots"
+        # are reservations of the same room and person at the nearest free times
+        # (that day first, then the following days), "rooms" the free rooms of
+        # the same building with at least the same capacity at the wanted time,
+        # smallest first. Rooms are only offered while the person is free then.
+        validate_new_reservation(reservation, self.classrooms_by_id)
+        wanted_record = reservation_record_from_reservation(reservation, None)
+        start_minute = wanted_record.start_minute
+        end_minute = wanted_record.end_minute
+        duration = end_minute - start_minute
+        day_start = min(SUGGESTION_FIRST_MINUTE, start_minute)
+        day_end = max(SUGGESTION_LAST_MINUTE, end_minute)
+
+        slots = []
+        for date_ordinal in range(wanted_record.date_ordinal, wanted_record.date_ordinal + search_days + 1):
+            if len(slots) >= slot_count:
+                break
+            free_starts = self._free_starts(
+                wanted_record.room_id,
+                wanted_record.person_name,
+                date_ordinal,
+                duration,
+                day_start,
+                day_end,
+                start_minute,
+            )
+            for free_start in sorted(free_starts, key=lambda free_start: (abs(free_start - start_minute), free_start)):
+                slots.append(ReservationRecord(
+                    None,
+                    wanted_record.room_id,
+                    wanted_record.person_name,
+                    wanted_record.reservation_purpose,
+                    date_ordinal,
+                    free_start,
+                    free_start + duration,
+                ).to_reservation())
+        del slots[slot_count:]
+
+        rooms = []
+        person_busy = any(
+            busy_start < end_minute and start_minute < busy_end
+            for busy_start, busy_end in self._busy_intervals(None, wanted_record.person_name, wanted_record.date_ordinal)
+        )
+        if not person_busy:
+            wanted_classroom = self.classrooms_by_id[wanted_record.room_id]
+            for room_id in self._suitable_room_ids(
+                minimum_capacity=wanted_classroom.capacity,
+                building_name=wanted_classroom.building_name,
+            ):
+                if len(rooms) >= room_count:
+                    break
+                if room_id != wanted_record.room_id and not self._room_is_booked(
+                    room_id,
+                    wanted_record.date_ordinal,
+                    start_minute,
+                    end_minute,
+                ):
+                    rooms.append(self.classrooms_by_id[room_id])
+
+        return {"slots": slots, "rooms": rooms}
+
+    def _overlapping_records(self, schedule, key, date_ordinal, start_minute, end_minute):
+        records = schedule.get(key, {}).get(date_ordinal)
+        if not records:
+            return []
+
+        position = bisect_left(records, start_minute, key=attrgetter("start_minute"))
+        if position > 0 and records[position - 1].end_minute > start_minute:
+            position -= 1
 
-            same_person = existing_reservation.person_name == new_reservation.person_name
-            if same_person and same_date:
-                overlapping_time = self._time_intervals_overlap(
-                    existing_reservation.start_time,
-                    existing_reservation.end_time,
-                    new_reservation.start_time,
-                    new_reservation.end_time,
+        overlapping_records = []
+        while position < len(records) and records[position].start_minute < end_minute:
+            overlapping_records.append(records[position])
+            position += 1
+        return overlapping_records
+
+    def _conflict_candidates(self, new_record):
+        # Both schedules hold non-overlapping intervals sorted by start time, so only
+        # the neighbours of the new interval can conflict.
+        return self._overlapping_records(
+            self._room_schedule,
+            new_record.room_id,
+            new_record.date_ordinal,
+            new_record.start_minute,
+            new_record.end_minute,
+        ) + self._overlapping_records(
+            self._person_schedule,
+            new_record.person_name,
+            new_record.date_ordinal,
+            new_record.start_minute,
+            new_record.end_minute,
+        )
+
+    def _check_reservation_conflicts(self, new_record, check_series=True):
+        # Candidates are checked in insertion order to report the same reservation
+        # a full scan would.
+        candidate_records = self._conflict_candidates(new_record)
+        if metrics.enabled:
+            metrics.increment("book.conflict_candidates_scanned", len(candidate_records))
+
+        for existing_record in sorted(candidate_records, key=attrgetter("reservation_id")):
+            conflict_message = describe_conflict(existing_record, new_record)
+            if conflict_message is not None:
+                raise ReservationConflictError(conflict_message)
+
+        if check_series and self._series_by_id:
+            series_conflicts = find_series_conflicts(new_record, self._room_series, self._person_series)
+            if series_conflicts:
+                raise ReservationConflictError(series_conflicts[0][1])
+
+    def _check_series_conflicts(self, new_series):
+        self._check_series_against_bookings(new_series)
+        self._check_series_against_series(new_series)
+
+    def _check_series_against_bookings(self, new_series):
+        # Single bookings: only dates that are both booked and in the series are
+        # visited, walking whichever of the two date sets is smaller.
+        candidate_date_ordinals = set()
+        occurrence_count = new_series.occurrence_count()
+        for records_by_date in (
+            self._room_schedule.get(new_series.room_id, {}),
+            self._person_schedule.get(new_series.person_name, {}),
+        ):
+            if len(records_by_date) < occurrence_count:
+                candidate_date_ordinals.update(
+                    date_ordinal for date_ordinal in records_by_date if new_series.occurs_on(date_ordinal)
                 )
-                if overlapping_time:
-                    raise ReservationConflictError(
-                        "Conflict: '{}' already has a reservation on {} {}-{} in room '{}' ({}).".format(
-                            new_reservation.person_name,
-                            new_reservation.reservation_date.isoformat(),
-                            existing_reservation.start_time.strftime("%H:%M"),
-                            existing_reservation.end_time.strftime("%H:%M"),
-                            existing_reservation.room_id,
-                            existing_reservation.reservation_purpose,
-                        )
-                    )
+            else:
+                candidate_date_ordinals.update(
+                    date_ordinal for date_ordinal in new_series.occurrence_ordinals() if date_ordinal in records_by_date
+                )
+
+        for date_ordinal in sorted(candidate_date_ordinals):
+            self._check_reservation_conflicts(new_series.occurrence_record(date_ordinal), check_series=False)
+
+    def _check_series_against_series(self, new_series):
+        # Other series: the first shared date of two recurrence patterns is computed
+        # directly from their start dates and intervals.
+        existing_series_by_id = {
+            series.series_id: series
+            for series in self._room_series.get(new_series.room_id, []) + self._person_series.get(new_series.person_name, [])
+        }
+        for series_id in sorted(existing_series_by_id):
+            existing_series = existing_series_by_id[series_id]
+            if not time_intervals_overlap(
+                existing_series.start_minute,
+                existing_series.end_minute,
+                new_series.start_minute,
+                new_series.end_minute,
+            ):
+                continue
+
+            date_ordinal = first_common_occurrence(existing_series, new_series)
+            if date_ordinal is not None:
+                raise ReservationConflictError(describe_conflict(
+                    existing_series.occurrence_record(date_ordinal),
+                    new_series.occurrence_record(date_ordinal),
+                ))
+
+    def _make_record_path_private(self, record):
+        # The containers that storing or removing this record changes.
+        self._record_chunks = self._private(self._record_chunks)
+        chunk_key = record.reservation_id >> RECORD_CHUNK_BITS
+        if chunk_key in self._record_chunks:
+            self._private_entry(self._record_chunks, chunk_key, dict)
+        self._ordered_records = self._private(self._ordered_records)
+        self._room_schedule = self._private(self._room_schedule)
+        self._person_schedule = self._private(self._person_schedule)
+        for schedule, key in (
+            (self._room_schedule, record.room_id),
+            (self._person_schedule, record.person_name),
+        ):
+            if key in schedule:
+                records_by_date = self._private_entry(schedule, key, dict)
+                if record.date_ordinal in records_by_date:
+                    self._private_entry(records_by_date, record.date_ordinal, list)
+
+    def _store_record(self, record):
+        if self._owned_containers is not None:
+            self._make_record_path_private(record)
+        self._record_chunks.setdefault(record.reservation_id >> RECORD_CHUNK_BITS, {})[record.reservation_id] = record
+        self._ordered_records.add(record)
+        self._index_record(record)
+
+    def _stored_record(self, reservation_id):
+        record = self._record_chunks.get(reservation_id >> RECORD_CHUNK_BITS, {}).get(reservation_id)
+        if record is None:
+            raise NotFoundError("Reservation not found.")
+        return record
+
+    def _reservation_id_in_use(self, reservation_id):
+        return reservation_id in self._record_chunks.get(reservation_id >> RECORD_CHUNK_BITS, {})
+
+    def _new_reservation_ids(self, requested_ids):
+        # Reservations read back from a file or a journal keep the ids they were
+        # saved with; the others are numbered after every id in use.
+        next_free_id = max(
+            [self._next_reservation_id]
+            + [reservation_id + 1 for reservation_id in requested_ids if reservation_id is not None]
+        )
+        claimed_ids = set()
+        new_ids = []
+        for reservation_id in requested_ids:
+            if reservation_id is None:
+                reservation_id = next_free_id
+                next_free_id += 1
+            elif reservation_id in claimed_ids or self._reservation_id_in_use(reservation_id):
+                raise ValueError("Reservation ID {} is already in use.".format(reservation_id))
+            claimed_ids.add(reservation_id)
+            new_ids.append(reservation_id)
+        return new_ids
+
+    def _iter_stored_records(self):
+        for records_by_id in self._record_chunks.values():
+            yield from records_by_id.values()
+
+    def _index_record(self, record):
+        for schedule, key in (
+            (self._room_schedule, record.room_id),
+            (self._person_schedule, record.person_name),
+        ):
+            records = schedule.setdefault(key, {}).setdefault(record.date_ordinal, [])
+            insort(records, record, key=_interval_key)
+
+    def _unindex_record(self, record):
+        for schedule, key in (
+            (self._room_schedule, record.room_id),
+            (self._person_schedule, record.person_name),
+        ):
+            records_by_date = schedule[key]
+            records = records_by_date[record.date_ordinal]
+            position = bisect_left(records, record.start_minute, key=attrgetter("start_minute"))
+            while records[position] is not record:
+                position += 1
+            del records[position]
+
+            if not records:
+                del records_by_date[record.date_ordinal]
+                if not records_by_date:
+                    del schedule[key]
 
+    @_book_operation
     def add_reservation(self, reservation):
-        reservation.room_id = reservation.room_id.strip()
-        reservation.person_name = reservation.person_name.strip()
-        reservation.reservation_purpose = reservation.reservation_purpose.strip()
+        validate_new_reservation(reservation, self.classrooms_by_id)
+        record = reservation_record_from_reservation(
+            reservation,
+            self._new_reservation_ids([reservation.reservation_id])[0],
+        )
 
-        if reservation.room_id not in self.classrooms_by_id:
-            raise NotFoundError("Classroom '{}' does not exist.".format(reservation.room_id))
+        if metrics.enabled:
+            started_at = time.perf_counter()
+        self._check_reservation_conflicts(record)
+        if metrics.enabled:
+            metrics.record_latency("book.check_conflicts", time.perf_counter() - started_at)
+        self._generation += 1
+        self._next_reservation_id = max(self._next_reservation_id, record.reservation_id + 1)
+        self._store_record(record)
+        if self._change_listeners:
+            self._notify_change("add_reservation", record.to_dict())
+        return record.reservation_id
 
-        if reservation.start_time >= reservation.end_time:
-            raise ValueError("Start time must be earlier than end time.")
+    @_book_operation
+    def add_reservations_bulk(self, reservations):
+        reservation_list = []
+        for reservation in reservations:
+            validate_new_reservation(reservation, self.classrooms_by_id)
+            reservation_list.append(reservation)
+        new_ids = self._new_reservation_ids([reservation.reservation_id for reservation in reservation_list])
+        new_records = [
+            reservation_record_from_reservation(reservation, reservation_id)
+            for reservation, reservation_id in zip(reservation_list, new_ids)
+        ]
+        self._add_records_bulk(new_records, check_conflicts=True)
 
-        self._check_reservation_conflicts(reservation)
-        self.reservation_list.append(reservation)
+    @_book_operation
+    def add_validated_reservation_rows(self, reservation_rows):
+        # Rows are (reservation_id or None, room_id, person_name, purpose,
+        # date_ordinal, start_minute, end_minute) tuples already checked for
+        # rooms, intervals and conflicts (including the book's series), e.g. by
+        # parallel_loading.
+        reservation_rows = list(reservation_rows)
+        new_ids = self._new_reservation_ids([reservation_row[0] for reservation_row in reservation_rows])
+        new_records = [
+            reservation_record_from_fields(reservation_id, *reservation_row[1:])
+            for reservation_id, reservation_row in zip(new_ids, reservation_rows)
+        ]
+        self._add_records_bulk(new_records, check_conflicts=False)
 
-    def list_reservations(self, room_id=None, reservation_date=None):
-        filtered_reservations = self.reservation_list
+    def _add_records_bulk(self, new_records, check_conflicts):
+        if metrics.enabled:
+            started_at = time.perf_counter()
+
+        # Loading into an empty book, or adding more records than it holds,
+        # rebuilds the indexes; a smaller commit only touches the (room, date)
+        # and (person, date) groups it adds to.
+        rebuild_indexes = len(new_records) >= len(self._ordered_records)
+        if rebuild_indexes:
+            scanned_records = list(self._iter_stored_records()) + new_records
+        else:
+            affected_records = {}
+            for record in new_records:
+                for schedule, key in (
+                    (self._room_schedule, record.room_id),
+                    (self._person_schedule, record.person_name),
+                ):
+                    for stored_record in schedule.get(key, {}).get(record.date_ordinal, ()):
+                        affected_records[stored_record.reservation_id] = stored_record
+            scanned_records = list(affected_records.values()) + new_records
+        if rebuild_indexes or check_conflicts:
+            room_groups, person_groups = group_reservation_records(scanned_records)
+        if check_conflicts:
+            self._check_bulk_conflicts(new_records, room_groups, person_groups)
+
+        self._generation += 1
+        if rebuild_indexes:
+            self._record_chunks = self._private(self._record_chunks)
+            chunk_key = None
+            for record in new_records:
+                if record.reservation_id >> RECORD_CHUNK_BITS != chunk_key:
+                    chunk_key = record.reservation_id >> RECORD_CHUNK_BITS
+                    records_by_id = self._private_entry(self._record_chunks, chunk_key, dict)
+                records_by_id[record.reservation_id] = record
+            # The indexes are rebuilt as new containers, which older states never share.
+            self._ordered_records = SortedList(key=_listing_key, items=sorted(scanned_records, key=_listing_key))
+            self._room_schedule = {}
+            self._person_schedule = {}
+            for schedule, groups in ((self._room_schedule, room_groups), (self._person_schedule, person_groups)):
+                for (key, date_ordinal), records in groups.items():
+                    schedule.setdefault(key, {})[date_ordinal] = records
+        else:
+            for record in new_records:
+                self._store_record(record)
+        if new_records:
+            self._next_reservation_id = max(
+                self._next_reservation_id,
+                max(record.reservation_id for record in new_records) + 1,
+            )
+
+        if self._change_listeners:
+            for record in new_records:
+                self._notify_change("add_reservation", record.to_dict())
+
+        if metrics.enabled:
+            metrics.record_latency("book.add_bulk", time.perf_counter() - started_at)
+            metrics.increment("book.records_bulk_added", len(new_records))
+            metrics.increment("book.records_bulk_scanned", len(scanned_records))
+
+    def _check_bulk_conflicts(self, new_records, room_groups, person_groups):
+        # Conflicts are reported by the position of the new record among the ones
+        # being added, since loaded records keep their saved ids.
+        new_positions = {record.reservation_id: position for position, record in enumerate(new_records, start=1)}
+        # Entries are keyed (new record position, 0, earlier record id) for
+        # conflicts between bookings and (new record position, 1, series id) for
+        # series conflicts.
+        conflicts = []
+        for earlier_record, later_record in find_conflicting_record_pairs(room_groups, person_groups).values():
+            # Pairs come ordered by id; the record reported is the new one, or the
+            # one added later when both are new.
+            if new_positions.get(earlier_record.reservation_id, 0) > new_positions.get(later_record.reservation_id, 0):
+                earlier_record, later_record = later_record, earlier_record
+            conflicts.append((
+                (new_positions[later_record.reservation_id], 0, earlier_record.reservation_id),
+                describe_conflict(earlier_record, later_record),
+            ))
+        if self._series_by_id:
+            for record in new_records:
+                conflicts.extend(
+                    ((new_positions[record.reservation_id], 1, series_id), conflict_message)
+                    for series_id, conflict_message
+                    in find_series_conflicts(record, self._room_series, self._person_series)
+                )
+
+        if conflicts:
+            conflicts.sort(key=itemgetter(0))
+            raise ReservationConflictError(format_conflict_report([
+                "Reservation #{}: {}".format(conflict_key[0], conflict_message)
+                for conflict_key, conflict_message in conflicts
+            ]))
+
+    @_book_operation
+    def add_series(self, series):
+        validate_new_series(series, self.classrooms_by_id)
+        self._check_series_conflicts(series)
+
+        # Series read back from a file or a journal keep the ids they were saved with.
+        if series.series_id is None:
+            series.series_id = self._next_series_id
+        elif series.series_id in self._series_by_id:
+            raise ValueError("Series ID {} is already in use.".format(series.series_id))
+        self._next_series_id = max(self._next_series_id, series.series_id + 1)
+        self._store_series(series)
+        if self._change_listeners:
+            self._notify_change("add_series", series.to_dict())
+        return series.series_id
+
+    @_book_operation
+    def add_bookings(self, reservations, series_list):
+        # All or nothing: the reservations go in as one bulk step, then the series
+        # one by one, in a single transaction.
+        with self.transaction():
+            self.add_reservations_bulk(reservations)
+            for series in series_list:
+                self.add_series(series)
+
+    def _store_series(self, series):
+        self._generation += 1
+        self._series_by_id = self._private(self._series_by_id)
+        self._series_by_id[series.series_id] = series
+        self._room_series = self._private(self._room_series)
+        self._private_entry(self._room_series, series.room_id, list).append(series)
+        self._person_series = self._private(self._person_series)
+        self._private_entry(self._person_series, series.person_name, list).append(series)
+
+    def _unstore_series(self, series):
+        self._generation += 1
+        self._series_by_id = self._private(self._series_by_id)
+        del self._series_by_id[series.series_id]
+        self._room_series = self._private(self._room_series)
+        self._person_series = self._private(self._person_series)
+        for series_index, key in ((self._room_series, series.room_id), (self._person_series, series.person_name)):
+            series_list = self._private_entry(series_index, key, list)
+            series_list.remove(series)
+            if not series_list:
+                del series_index[key]
+
+    def _replace_series(self, series, new_series):
+        self._generation += 1
+        self._series_by_id = self._private(self._series_by_id)
+        self._series_by_id[series.series_id] = new_series
+        self._room_series = self._private(self._room_series)
+        self._person_series = self._private(self._person_series)
+        for series_index, key in ((self._room_series, series.room_id), (self._person_series, series.person_name)):
+            series_list = self._private_entry(series_index, key, list)
+            series_list[series_list.index(series)] = new_series
+
+    def list_series(self):
+        return [self._series_by_id[series_id] for series_id in sorted(self._series_by_id)]
+
+    def get_series(self, series_id):
+        series = self._series_by_id.get(series_id)
+        if series is None:
+            raise NotFoundError("Series not found.")
+        return series
+
+    @_book_operation
+    def remove_series(self, series_id):
+        series = self.get_series(series_id)
+        self._unstore_series(series)
+        if self._change_listeners:
+            self._notify_change("remove_series", series.to_dict())
+        return series
+
+    def _matching_series(self, series):
+        # A series whose dates are all excluded frees its slots for a new series
+        # with the same pattern; the excluded dates tell the two apart.
+        matching_series = [
+            stored_series
+            for stored_series in self._room_series.get(series.room_id, [])
+            if stored_series.same_pattern(series)
+        ]
+        for stored_series in matching_series:
+            if stored_series.excluded_date_ordinals == series.excluded_date_ordinals:
+                return stored_series
+        if matching_series:
+            return matching_series[0]
+        raise NotFoundError("Series not found.")
+
+    @_book_operation
+    def remove_matching_series(self, series):
+        return self.remove_series(self._matching_series(series).series_id)
+
+    @_book_operation
+    def exclude_series_occurrence(self, series_id, excluded_date):
+        series = self.get_series(series_id)
+        date_ordinal = excluded_date.toordinal()
+        if not series.occurs_on(date_ordinal):
+            raise NotFoundError("Series has no occurrence on {}.".format(excluded_date.isoformat()))
 
+        # The stored series is replaced rather than changed, as older states may
+        # still hold it.
+        excluded_series = copy(series)
+        excluded_series.excluded_date_ordinals = series.excluded_date_ordinals | {date_ordinal}
+        self._replace_series(series, excluded_series)
+        if self._change_listeners:
+            self._notify_change(
+                "exclude_series_occurrence",
+                {"series": series.to_dict(), "date": excluded_date.isoformat()},
+            )
+        return excluded_series
+
+    @_book_operation
+    def exclude_matching_series_occurrence(self, series, excluded_date):
+        return self.exclude_series_occurrence(self._matching_series(series).series_id, excluded_date)
+
+    def _series_occurrence_records(self, room_id=None, date_ordinal=None):
+        # Occurrences are expanded only for the requested room and date.
         if room_id is not None:
-            filtered_reservations = [
-                reservation for reservation in filtered_reservations
-                if reservation.room_id == room_id
+            series_list = self._room_series.get(room_id, [])
+        else:
+            series_list = self._series_by_id.values()
+        return [
+            series.occurrence_record(occurrence_ordinal)
+            for series in series_list
+            for occurrence_ordinal in series.occurrence_ordinals(date_ordinal, date_ordinal)
+        ]
+
+    def _date_bounds(self, date_ordinal):
+        return (
+            self._ordered_records.bisect_key_left((date_ordinal,)),
+            self._ordered_records.bisect_key_left((date_ordinal + 1,)),
+        )
+
+    def _list_reservation_records(self, room_id=None, reservation_date=None):
+        records = self._list_single_reservation_records(room_id=room_id, reservation_date=reservation_date)
+        if not self._series_by_id:
+            return records
+
+        occurrence_records = self._series_occurrence_records(
+            room_id=room_id,
+            date_ordinal=reservation_date.toordinal() if reservation_date is not None else None,
+        )
+        return sorted(records + occurrence_records, key=_listing_key)
+
+    def _list_single_reservation_records(self, room_id=None, reservation_date=None):
+        if room_id is not None:
+            records_by_date = self._room_schedule.get(room_id, {})
+            if reservation_date is not None:
+                return list(records_by_date.get(reservation_date.toordinal(), []))
+            return [
+                record
+                for date_ordinal in sorted(records_by_date)
+                for record in records_by_date[date_ordinal]
             ]
 
         if reservation_date is not None:
-            filtered_reservations = [
-                reservation for reservation in filtered_reservations
-                if reservation.reservation_date == reservation_date
+            date_ordinal = reservation_date.toordinal()
+            return list(self._ordered_records.irange_key((date_ordinal,), (date_ordinal + 1,)))
+
+        return list(self._ordered_records)
+
+    def list_reservations(self, room_id=None, reservation_date=None):
+        if metrics.enabled:
+            started_at = time.perf_counter()
+        cache_key = (room_id, reservation_date)
+        reservation_list = self._lookup_listing(cache_key)
+        if reservation_list is None:
+            reservation_list = [
+                record.to_reservation()
+                for record in self._list_reservation_records(room_id=room_id, reservation_date=reservation_date)
             ]
+            self._remember_listing(cache_key, reservation_list)
+        reservation_list = list(reservation_list)
+        if metrics.enabled:
+            metrics.record_latency("book.list_reservations", time.perf_counter() - started_at)
+            metrics.increment("book.records_listed", len(reservation_list))
+        return reservation_list
 
-        return sorted(
-            filtered_reservations,
-            key=lambda reservation: (reservation.reservation_date, reservation.room_id, reservation.start_time),
+    def iter_reservation_records(self):
+        return iter(self._ordered_records)
+
+    def iter_scheduled_records(self, first_date=None, last_date=None):
+        # Single bookings in (date, room, start) order, then the series occurrences,
+        # all limited to the inclusive date range.
+        first_date_ordinal = first_date.toordinal() if first_date is not None else None
+        last_date_ordinal = last_date.toordinal() if last_date is not None else None
+        yield from self._single_records_between(first_date_ordinal, last_date_ordinal)
+        for series in self.list_series():
+            for date_ordinal in series.occurrence_ordinals(first_date_ordinal, last_date_ordinal):
+                yield series.occurrence_record(date_ordinal)
+
+    def _single_records_between(self, first_date_ordinal, last_date_ordinal):
+        return self._ordered_records.irange_key(
+            (first_date_ordinal,) if first_date_ordinal is not None else None,
+            (last_date_ordinal + 1,) if last_date_ordinal is not None else None,
         )
 
+    def query_reservations(self, query=None, after_cursor=None):
+        # Lazily yields the matching reservations in (date, room, start) order; the
+        # book must not change while the iterator is in use (pages from
+        # page_reservations can be fetched across changes).
+        return (record.to_reservation() for record in self.query_records(query, after_cursor))
+
+    def query_records(self, query=None, after_cursor=None):
+        # The same stream as query_reservations, as compact records for exporters.
+        after_key = listing_key_from_cursor(after_cursor) if after_cursor is not None else None
+        return self._query_records(query if query is not None else ReservationQuery(), after_key)
+
+    def page_reservations(self, query=None, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        # Returns (reservations, next_cursor); next_cursor is None on the last page.
+        if page_size <= 0:
+            raise ValueError("Page size must be > 0.")
+        if metrics.enabled:
+            started_at = time.perf_counter()
+        after_key = listing_key_from_cursor(cursor) if cursor is not None else None
+        records = list(islice(
+            self._query_records(query if query is not None else ReservationQuery(), after_key),
+            page_size + 1,
+        ))
+        next_cursor = cursor_from_record(records[page_size - 1]) if len(records) > page_size else None
+        reservation_page = [record.to_reservation() for record in records[:page_size]]
+        if metrics.enabled:
+            metrics.record_latency("book.page_reservations", time.perf_counter() - started_at)
+            metrics.increment("book.records_listed", len(reservation_page))
+        return reservation_page, next_cursor
+
+    def _query_records(self, query, after_key=None):
+        first_date_ordinal = query.first_date_ordinal
+        if after_key is not None and (first_date_ordinal is None or after_key[0] > first_date_ordinal):
+            first_date_ordinal = after_key[0]
+
+        room_ids = None
+        building_room_ids = None
+        if query.building_name is not None:
+            building_room_ids = {room_id for _, room_id in self._rooms_by_building.get(query.building_name, [])}
+            room_ids = sorted(building_room_ids)
+        if query.room_id is not None:
+            room_ids = [query.room_id] if building_room_ids is None or query.room_id in building_room_ids else []
+
+        # Each source is already in listing order, so merging them never sorts the
+        # whole result; series contribute one lazy stream each.
+        record_streams = [self._query_single_records(query, room_ids, first_date_ordinal)]
+        for series in self._query_series(query, room_ids):
+            record_streams.append(map(
+                series.occurrence_record,
+                series.occurrence_ordinals(first_date_ordinal, query.last_date_ordinal),
+            ))
+        records = heapq.merge(*record_streams, key=_listing_key) if len(record_streams) > 1 else record_streams[0]
+
+        for record in records:
+            if after_key is not None and _listing_key(record) <= after_key:
+                continue
+            if building_room_ids is not None and record.room_id not in building_room_ids:
+                continue
+            if query.matches(record):
+                yield record
+
+    def _query_single_records(self, query, room_ids, first_date_ordinal):
+        # Picks the narrowest index: the room schedules, the person's schedule or
+        # the date-ordered list.
+        if query.room_id is not None or (room_ids is not None and query.person_name is None):
+            return heapq.merge(
+                *(
+                    self._scheduled_records(self._room_schedule, room_id, first_date_ordinal, query.last_date_ordinal)
+                    for room_id in room_ids
+                ),
+                key=_listing_key,
+            )
+        if query.person_name is not None:
+            return self._scheduled_records(
+                self._person_schedule,
+                query.person_name,
+                first_date_ordinal,
+                query.last_date_ordinal,
+            )
+        return self._single_records_between(first_date_ordinal, query.last_date_ordinal)
+
+    def _scheduled_records(self, schedule, key, first_date_ordinal, last_date_ordinal):
+        records_by_date = schedule.get(key, {})
+        for date_ordinal in sorted(
+            date_ordinal
+            for date_ordinal in records_by_date
+            if (first_date_ordinal is None or date_ordinal >= first_date_ordinal)
+            and (last_date_ordinal is None or date_ordinal <= last_date_ordinal)
+        ):
+            # A person's bookings of one day are ordered by start, not by room.
+            yield from sorted(records_by_date[date_ordinal], key=_listing_key)
+
+    def _query_series(self, query, room_ids):
+        if room_ids is not None:
+            series_list = [series for room_id in room_ids for series in self._room_series.get(room_id, [])]
+        elif query.person_name is not None:
+            series_list = self._person_series.get(query.person_name, [])
+        else:
+            series_list = self._series_by_id.values()
+        return [series for series in series_list if query.matches_pattern(series)]
+
+    def get_reservation(self, reservation_id):
+        return self._stored_record(reservation_id).to_reservation()
+
+    def _visible_record_at(self, reservation_number, room_id=None, reservation_date=None):
+        # Resolves a 1-based position in the (date, room, start) listing directly
+        # against the indexes, without materialising the listing. Series occurrences
+        # have no index of their own, so books with series use the merged listing.
+        if reservation_number >= 1 and self._series_by_id:
+            visible_records = self._list_reservation_records(room_id=room_id, reservation_date=reservation_date)
+            if reservation_number <= len(visible_records):
+                return visible_records[reservation_number - 1]
+
+        elif reservation_number >= 1:
+            if room_id is not None:
+                records_by_date = self._room_schedule.get(room_id, {})
+                if reservation_date is not None:
+                    date_ordinals = [reservation_date.toordinal()]
+                else:
+                    date_ordinals = sorted(records_by_date)
+
+                remaining_number = reservation_number
+                for date_ordinal in date_ordinals:
+                    records = records_by_date.get(date_ordinal, [])
+                    if remaining_number <= len(records):
+                        return records[remaining_number - 1]
+                    remaining_number -= len(records)
+
+            elif reservation_date is not None:
+                first_position, end_position = self._date_bounds(reservation_date.toordinal())
+                if reservation_number <= end_position - first_position:
+                    return self._ordered_records[first_position + reservation_number - 1]
+
+            elif reservation_number <= len(self._ordered_records):
+                return self._ordered_records[reservation_number - 1]
+
+        raise NotFoundError("Reservation index out of range.")
+
+    @_book_operation
     def remove_reservation(self, reservation_number, room_id=None, reservation_date=None):
-        visible_reservations = self.list_reservations(room_id=room_id, reservation_date=reservation_date)
+        # The usual list -> remove round-trip finds the numbered entry in the cached
+        # listing instead of resolving the position again.
+        cached_list = self._cached_listing((room_id, reservation_date))
+        if cached_list is not None and 1 <= reservation_number <= len(cached_list):
+            return self.remove_listed_reservation(cached_list[reservation_number - 1])
+
+        record = self._visible_record_at(reservation_number, room_id=room_id, reservation_date=reservation_date)
+        if record.reservation_id is None:
+            self.exclude_series_occurrence(record.series_id, date.fromordinal(record.date_ordinal))
+            return record.to_reservation()
+        return self._remove_stored_record(record).to_reservation()
 
-        if reservation_number < 1 or reservation_number > len(visible_reservations):
-            raise NotFoundError("Reservation index out of range.")
+    @_book_operation
+    def remove_listed_reservation(self, reservation):
+        # Removes an entry returned by list_reservations by its identity, so the
+        # result does not depend on the listing still having the same order.
+        if reservation.reservation_id is None:
+            self.exclude_series_occurrence(reservation.series_id, reservation.reservation_date)
+            return reservation
+        return self.remove_reservation_by_id(reservation.reservation_id)
 
-        reservation_to_remove = visible_reservations[reservation_number - 1]
+    @_book_operation
+    def remove_reservation_by_id(self, reservation_id):
+        return self._remove_stored_record(self._stored_record(reservation_id)).to_reservation()
 
-        for index_in_master, reservation in enumerate(self.reservation_list):
-            if reservation == reservation_to_remove:
-                return self.reservation_list.pop(index_in_master)
+    @_book_operation
+    def remove_matching_reservation(self, reservation):
+        wanted_record = reservation_record_from_reservation(reservation, None)
+        for record in self._overlapping_records(
+            self._room_schedule,
+            wanted_record.room_id,
+            wanted_record.date_ordinal,
+            wanted_record.start_minute,
+            wanted_record.end_minute,
+        ):
+            if record.same_booking(wanted_record):
+                return self._remove_stored_record(record).to_reservation()
 
         raise NotFoundError("Reservation not found.")
 
+    def _remove_stored_record(self, record):
+        self._generation += 1
+        if self._owned_containers is not None:
+            self._make_record_path_private(record)
+        chunk_key = record.reservation_id >> RECORD_CHUNK_BITS
+        records_by_id = self._record_chunks[chunk_key]
+        del records_by_id[record.reservation_id]
+        if not records_by_id:
+            del self._record_chunks[chunk_key]
+        self._ordered_records.remove(record)
+        self._unindex_record(record)
+        if self._change_listeners:
+            self._notify_change("remove_reservation", record.to_dict())
+        return record
+
+    def _clear_reservations(self):
+        # New empty containers instead of clearing the old ones, which an older
+        # state may share.
+        self._generation += 1
+        self._record_chunks = {}
+        self._ordered_records = SortedList(key=_listing_key)
+        self._room_schedule = {}
+        self._person_schedule = {}
+        self._series_by_id = {}
+        self._room_series = {}
+        self._person_series = {}
+
+    @_book_operation
     def remove_all_reservations(self):
-        self.reservation_list.clear()
+        self._clear_reservations()
+        if self._change_listeners:
+            self._notify_change("remove_all_reservations")
 
+    @_book_operation
     def clear_all(self):
-        self.classrooms_by_id.clear()
-        self.reservation_list.clear()
+        self.classrooms_by_id = {}
+        self._rooms_by_equipment = {}
+        self._rooms_by_capacity = []
+        self._rooms_by_building = {}
+        self._clear_reservations()
+        if self._change_listeners:
+            self._notify_change("clear_all")
+
+    def close(self):
+        pass
 
     def to_dict(self):
-        return {
+        book_data = {
             "classrooms": [classroom.to_dict() for classroom in self.list_classrooms()],
-            "reservations": [reservation.to_dict() for reservation in self.list_reservations()],
+            "reservations": [record.to_dict() for record in self.iter_reservation_records()],
         }
+        if self._series_by_id:
+            book_data["series"] = [series.to_dict() for series in self.list_series()]
+        return book_data
+
 
+class ReservationBookSnapshot(ReservationBook):
+    # Returned by ReservationBook.snapshot. It shares the containers of the book it
+    # was taken from, which copies them before changing them, so it never changes
+    # and may be read from another thread while the book is being changed.
+    def __init__(self, state):
+        super().__init__()
+        self._restore_state(state)
 
-def reservation_book_from_dict(book_data):
-    reservation_book = ReservationBook()
+    def _read_only(self, *args, **kwargs):
+        raise ValueError("A reservation book snapshot is read-only.")
+
+    add_classroom = _read_only
+    add_reservation = _read_only
+    add_reservations_bulk = _read_only
+    add_validated_reservation_rows = _read_only
+    add_series = _read_only
+    add_bookings = _read_only
+    remove_series = _read_only
+    remove_matching_series = _read_only
+    exclude_series_occurrence = _read_only
+    exclude_matching_series_occurrence = _read_only
+    remove_reservation = _read_only
+    remove_listed_reservation = _read_only
+    remove_reservation_by_id = _read_only
+    remove_matching_reservation = _read_only
+    remove_all_reservations = _read_only
+    clear_all = _read_only
+    transaction = _read_only
+    keep_undo_history = _read_only
+    undo = _read_only
+
+    def snapshot(self):
+        return self
+
+
+def reservation_book_from_dict(book_data, reservation_book=None):
+    # An empty reservation_book may be passed in to be filled instead of a new one.
+    if reservation_book is None:
+        reservation_book = ReservationBook()
 
     for classroom_data in book_data.get("classrooms", []):
         classroom = classroom_from_dict(classroom_data)
-        reservation_book.classrooms_by_id[classroom.room_id] = classroom
+        reservation_book._store_classroom(classroom)
+
+    for series_data in book_data.get("series", []):
+        reservation_book.add_series(recurring_series_from_dict(series_data))
 
-    for reservation_data in book_data.get("reservations", []):
-        reservation = reservation_from_dict(reservation_data)
-        reservation_book.add_reservation(reservation)
+    reservation_book.add_reservations_bulk(
+        reservation_from_dict(reservation_data)
+        for reservation_data in book_data.get("reservations", [])
+    )
 
     return reservation_book
@@ -0,0 +1,92 @@
+from datetime import date
+from reservation import minutes_from_time
+
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class ReservationQuery:
+    # Filters for ReservationBook.query_reservations. The date range is
+    # inclusive; the time window selects bookings that overlap it, and purpose
+    # matches any booking whose purpose contains the text (case-insensitive).
+    def __init__(
+        self,
+        first_date=None,
+        last_date=None,
+        start_time=None,
+        end_time=None,
+        room_id=None,
+        person_name=None,
+        building_name=None,
+        purpose_text=None,
+    ):
+        if first_date is not None and last_date is not None and first_date > last_date:
+            raise ValueError("First date must not be after last date.")
+        if start_time is not None and end_time is not None and start_time >= end_time:
+            raise ValueError("Start time must be before end time.")
+
+        self.first_date_ordinal = first_date.toordinal() if first_date is not None else None
+        self.last_date_ordinal = last_date.toordinal() if last_date is not None else None
+        self.start_minute = minutes_from_time(start_time) if start_time is not None else None
+        self.end_minute = minutes_from_time(end_time) if end_time is not None else None
+        self.room_id = room_id
+        self.person_name = person_name
+        self.building_name = building_name
+        self.purpose_text = purpose_text.lower() if purpose_text else None
+
+    def matches_pattern(self, record):
+        # Everything except the date, so a series is checked once for all of its
+        # occurrences.
+        return (
+            (self.room_id is None or record.room_id == self.room_id)
+            and (self.person_name is None or record.person_name == self.person_name)
+            and (self.start_minute is None or record.end_minute > self.start_minute)
+            and (self.end_minute is None or record.start_minute < self.end_minute)
+            and (self.purpose_text is None or self.purpose_text in record.reservation_purpose.lower())
+        )
+
+    def matches(self, record):
+        return (
+            (self.first_date_ordinal is None or record.date_ordinal >= self.first_date_ordinal)
+            and (self.last_date_ordinal is None or record.date_ordinal <= self.last_date_ordinal)
+            and self.matches_pattern(record)
+        )
+
+
+def cursor_from_record(record):
+    # Records are ordered by (date, room, start) and a room is never booked
+    # twice at once, so that triple identifies the position after a record.
+    return "{}:{}:{}".format(
+        date.fromordinal(record.date_ordinal).isoformat(),
+        record.start_minute,
+        record.room_id,
+    )
+
+
+def listing_key_from_cursor(cursor):
+    try:
+        date_text, start_text, room_id = cursor.split(":", 2)
+        return date.fromisoformat(date_text).toordinal(), room_id, int(start_text)
+    except ValueError:
+        raise ValueError("Invalid cursor '{}'.".format(cursor))
+
+
+def reservation_query_from_fields(query_fields, validator):
+    # Text fields as used by the HTTP service and batch mode; "date" selects a
+    # single day unless "from"/"to" are given.
+    def field_text(field_name):
+        value = query_fields.get(field_name)
+        return str(value).strip() if value is not None else ""
+
+    first_date_text = field_text("from") or field_text("date")
+    last_date_text = field_text("to") or field_text("date")
+    return ReservationQuery(
+        first_date=validator.parse_iso_date(first_date_text) if first_date_text else None,
+        last_date=validator.parse_iso_date(last_date_text) if last_date_text else None,
+        start_time=validator.parse_hhmm_time(field_text("from_time")) if field_text("from_time") else None,
+        end_time=validator.parse_hhmm_time(field_text("to_time")) if field_text("to_time") else None,
+        room_id=field_text("room_id") or None,
+        person_name=field_text("person") or None,
+        building_name=field_text("building") or None,
+        purpose_text=field_text("purpose") or None,
+    )
@@ -0,0 +1,363 @@
+import json
+from bisect import bisect_left, insort
+from datetime import date, time
+from operator import itemgetter
+from pathlib import Path
+from time import perf_counter
+from reservation import Reservation, format_minutes, minutes_from_time
+from recurring_series import RecurringSeries
+from metrics import metrics
+
+
+DEFAULT_REPEAT_INTERVAL_DAYS = 7
+
+
+class AssignmentRequest:
+    # One booking request of a term timetable: who and what for, how many seats
+    # and which equipment, and when - a single date or every interval_days from
+    # first_date to last_date. Higher priorities are placed first.
+    def __init__(
+        self,
+        request_id,
+        person_name,
+        reservation_purpose,
+        student_count,
+        first_date,
+        last_date,
+        interval_days,
+        start_time,
+        end_time,
+        required_equipment=None,
+        excluded_dates=None,
+        building_name=None,
+        priority=0,
+    ):
+        self.request_id = request_id
+        self.person_name = person_name
+        self.reservation_purpose = reservation_purpose
+        self.student_count = student_count
+        self.first_date_ordinal = first_date.toordinal()
+        self.last_date_ordinal = last_date.toordinal()
+        self.interval_days = interval_days
+        self.start_minute = minutes_from_time(start_time)
+        self.end_minute = minutes_from_time(end_time)
+        self.required_equipment = required_equipment if required_equipment is not None else []
+        self.excluded_date_ordinals = {excluded_date.toordinal() for excluded_date in excluded_dates or []}
+        self.building_name = building_name
+        self.priority = priority
+
+    def is_recurring(self):
+        return self.first_date_ordinal != self.last_date_ordinal
+
+    def occurrence_ordinals(self):
+        return [
+            date_ordinal
+            for date_ordinal in range(self.first_date_ordinal, self.last_date_ordinal + 1, self.interval_days)
+            if date_ordinal not in self.excluded_date_ordinals
+        ]
+
+    def booking_for_room(self, room_id):
+        start_time = time(*divmod(self.start_minute, 60))
+        end_time = time(*divmod(self.end_minute, 60))
+        if not self.is_recurring():
+            return Reservation(
+                room_id=room_id,
+                person_name=self.person_name,
+                reservation_purpose=self.reservation_purpose,
+                reservation_date=date.fromordinal(self.first_date_ordinal),
+                start_time=start_time,
+                end_time=end_time,
+            )
+        return RecurringSeries(
+            room_id=room_id,
+            person_name=self.person_name,
+            reservation_purpose=self.reservation_purpose,
+            first_date=date.fromordinal(self.first_date_ordinal),
+            last_date=date.fromordinal(self.last_date_ordinal),
+            interval_days=self.interval_days,
+            start_time=start_time,
+            end_time=end_time,
+            excluded_dates=[date.fromordinal(date_ordinal) for date_ordinal in sorted(self.excluded_date_ordinals)],
+        )
+
+
+def assignment_request_from_dict(request_data, request_id, validator):
+    # A request names either "date" or "first_date" and "last_date"; the repeat
+    # interval defaults to weekly.
+    if not isinstance(request_data, dict):
+        raise ValueError("Request must be a JSON object.")
+
+    def field_text(field_name):
+        value = request_data.get(field_name)
+        return str(value).strip() if value is not None else ""
+
+    def field_list(field_name):
+        value = request_data.get(field_name)
+        if isinstance(value, list):
+            return [str(item) for item in value]
+        return field_text(field_name).split(",")
+
+    person_name = validator.require_non_empty_text(field_text("person"), "Person")
+    reservation_purpose = validator.require_non_empty_text(field_text("purpose"), "Purpose")
+    student_count = validator.require_positive_integer(field_text("students"), "Students")
+    if field_text("date"):
+        first_date = last_date = validator.parse_iso_date(field_text("date"))
+    else:
+        first_date = validator.parse_iso_date(field_text("first_date"))
+        last_date = validator.parse_iso_date(field_text("last_date"))
+        if first_date > last_date:
+            raise ValueError("First date must not be after last date.")
+
+    start_time = validator.parse_hhmm_time(field_text("start_time"))
+    end_time = validator.parse_hhmm_time(field_text("end_time"))
+    if start_time >= end_time:
+        raise ValueError("Start time must be earlier than end time.")
+
+    priority_text = field_text("priority") or "0"
+    try:
+        priority = int(priority_text)
+    except ValueError:
+        raise ValueError("Priority must be an integer.")
+
+    assignment_request = AssignmentRequest(
+        request_id=request_id,
+        person_name=person_name,
+        reservation_purpose=reservation_purpose,
+        student_count=student_count,
+        first_date=first_date,
+        last_date=last_date,
+        interval_days=validator.require_positive_integer(
+            field_text("interval_days") or DEFAULT_REPEAT_INTERVAL_DAYS,
+            "Repeat interval",
+        ),
+        start_time=start_time,
+        end_time=end_time,
+        required_equipment=validator.parse_equipment_list(",".join(field_list("equipment"))),
+        excluded_dates=[
+            validator.parse_iso_date(date_text) for date_text in field_list("excluded_dates") if date_text.strip()
+        ],
+        building_name=field_text("building") or None,
+        priority=priority,
+    )
+    if not assignment_request.occurrence_ordinals():
+        raise ValueError("Request has no dates left after the skipped dates.")
+    return assignment_request
+
+
+def read_assignment_requests(filename):
+    # "*.jsonl" files hold one request per line; anything else is a JSON list of
+    # requests or an object with a "requests" list.
+    try:
+        request_text = Path(filename).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        raise FileNotFoundError("File not found: {}".format(filename))
+    except OSError as error:
+        raise OSError("Failed to read file: {}".format(error))
+
+    try:
+        if Path(filename).suffix == ".jsonl":
+            return [json.loads(line) for line in request_text.splitlines() if line.strip()]
+        request_file_data = json.loads(request_text)
+    except json.JSONDecodeError as error:
+        raise ValueError("Invalid JSON: {}".format(error))
+
+    if isinstance(request_file_data, dict):
+        request_file_data = request_file_data.get("requests")
+    if not isinstance(request_file_data, list):
+        raise ValueError("Invalid request file (expected a list of requests).")
+    return request_file_data
+
+
+def _is_free(busy_intervals, key, start_minute, end_minute):
+    # Intervals per key never overlap, so sorted by start they are also sorted by
+    # end and only the two neighbours of the new start can collide with it.
+    intervals = busy_intervals.get(key)
+    if not intervals:
+        return True
+    position = bisect_left(intervals, (start_minute,))
+    if position < len(intervals) and intervals[position][0] < end_minute:
+        return False
+    return position == 0 or intervals[position - 1][1] <= start_minute
+
+
+def _occupy(busy_intervals, key, start_minute, end_minute):
+    intervals = busy_intervals.get(key)
+    if intervals is None:
+        busy_intervals[key] = [(start_minute, end_minute)]
+    else:
+        insort(intervals, (start_minute, end_minute))
+
+
+def _minute_mask(start_minute, end_minute):
+    # Bit n stands for minute n of the day.
+    return ((1 << (end_minute - start_minute)) - 1) << start_minute
+
+
+def _request_order(assignment_request):
+    # Priority first; within a priority the sweep goes by start time, and of
+    # requests starting together the larger (harder to seat) ones go first.
+    return (
+        -assignment_request.priority,
+        assignment_request.start_minute,
+        -assignment_request.student_count,
+        -len(assignment_request.required_equipment),
+        assignment_request.first_date_ordinal,
+    )
+
+
+class _RoomAssignmentRun:
+    # Rooms are checked far more often than people, so their bookings are kept as
+    # one busy-minute bit mask per (room, date) and a check is a single AND.
+    def __init__(self, reservation_book, assignment_requests):
+        self.reservation_book = reservation_book
+        self.assignment_requests = assignment_requests
+        self.room_days = {}
+        self.person_busy = {}
+        self._suitable_rooms = {}
+        # Rooms already found taken for a (dates, start, end) slot; bookings are
+        # only ever added, so they stay taken and are not checked again. Each list
+        # of suitable rooms is also resumed at the first room not yet taken.
+        self._taken_rooms_by_slot = {}
+        self._scan_positions = {}
+
+    def load_bookings(self):
+        # Everything already booked in the requests' date range, as free/busy
+        # intervals per (room, date) and (person, date).
+        first_date_ordinal = min(request.first_date_ordinal for request in self.assignment_requests)
+        last_date_ordinal = max(request.last_date_ordinal for request in self.assignment_requests)
+        for record in self.reservation_book.iter_scheduled_records(
+            date.fromordinal(first_date_ordinal),
+            date.fromordinal(last_date_ordinal),
+        ):
+            busy_days = self.room_days.setdefault(record.room_id, {})
+            busy_days[record.date_ordinal] = busy_days.get(record.date_ordinal, 0) | _minute_mask(
+                record.start_minute,
+                record.end_minute,
+            )
+            _occupy(self.person_busy, (record.person_name, record.date_ordinal), record.start_minute, record.end_minute)
+
+    def suitable_rooms(self, rooms_key, assignment_request):
+        # Requests repeat the same few seat counts and equipment sets, so each
+        # combination is looked up once.
+        room_ids = self._suitable_rooms.get(rooms_key)
+        if room_ids is None:
+            room_ids = [
+                classroom.room_id
+                for classroom in self.reservation_book.list_suitable_rooms(
+                    minimum_capacity=assignment_request.student_count,
+                    required_equipment=assignment_request.required_equipment,
+                    building_name=assignment_request.building_name,
+                )
+            ]
+            self._suitable_rooms[rooms_key] = room_ids
+        return room_ids
+
+    def place(self, assignment_request):
+        # Returns the chosen room id, or the reason why there is none.
+        start_minute = assignment_request.start_minute
+        end_minute = assignment_request.end_minute
+        date_ordinals = assignment_request.occurrence_ordinals()
+
+        person_name = assignment_request.person_name
+        for date_ordinal in date_ordinals:
+            if not _is_free(self.person_busy, (person_name, date_ordinal), start_minute, end_minute):
+                return None, "{} already has a booking overlapping {} {}-{}.".format(
+                    person_name,
+                    date.fromordinal(date_ordinal).isoformat(),
+                    format_minutes(start_minute),
+                    format_minutes(end_minute),
+                )
+
+        rooms_key = (
+            assignment_request.student_count,
+            frozenset(item.lower() for item in assignment_request.required_equipment),
+            assignment_request.building_name,
+        )
+        room_ids = self.suitable_rooms(rooms_key, assignment_request)
+        if not room_ids:
+            return None, "No classroom has {} seats{}{}.".format(
+                assignment_request.student_count,
+                " and " + ", ".join(assignment_request.required_equipment) if assignment_request.required_equipment else "",
+                " in " + assignment_request.building_name if assignment_request.building_name else "",
+            )
+
+        minute_mask = _minute_mask(start_minute, end_minute)
+        slot_key = (tuple(date_ordinals), start_minute, end_minute)
+        taken_room_ids = self._taken_rooms_by_slot.setdefault(slot_key, set())
+        scan_key = (slot_key, rooms_key)
+        for position in range(self._scan_positions.get(scan_key, 0), len(room_ids)):
+            room_id = room_ids[position]
+            if room_id in taken_room_ids:
+                continue
+            taken_room_ids.add(room_id)
+            busy_days = self.room_days.setdefault(room_id, {})
+            if any(busy_days.get(date_ordinal, 0) & minute_mask for date_ordinal in date_ordinals):
+                continue
+
+            self._scan_positions[scan_key] = position
+            for date_ordinal in date_ordinals:
+                busy_days[date_ordinal] = busy_days.get(date_ordinal, 0) | minute_mask
+                _occupy(self.person_busy, (person_name, date_ordinal), start_minute, end_minute)
+            return room_id, None
+
+        self._scan_positions[scan_key] = len(room_ids)
+        return None, "All suitable classrooms ({}) are booked at that time.".format(len(room_ids))
+
+
+def assign_rooms(reservation_book, requests_data, validator, commit=True):
+    # Greedy interval scheduling: requests are swept in priority and start-time
+    # order and each takes the smallest suitable room that is free on all of its
+    # dates. A recurring request keeps one room for the whole term. The placed
+    # requests are added to the book together or not at all.
+    started_at = perf_counter()
+    request_positions = {}
+    unplaced = []
+    assignment_requests = []
+    for position, request_data in enumerate(requests_data, start=1):
+        request_id = request_data.get("id", position) if isinstance(request_data, dict) else position
+        try:
+            assignment_request = assignment_request_from_dict(request_data, request_id, validator)
+        except ValueError as error:
+            unplaced.append((position, {"request": request_id, "reason": str(error)}))
+            continue
+        request_positions[assignment_request] = position
+        assignment_requests.append(assignment_request)
+
+    placed = []
+    bookings = []
+    if assignment_requests:
+        with metrics.measure("assignment.solve"):
+            assignment_run = _RoomAssignmentRun(reservation_book, assignment_requests)
+            assignment_run.load_bookings()
+            for assignment_request in sorted(assignment_requests, key=_request_order):
+                position = request_positions[assignment_request]
+                room_id, reason = assignment_run.place(assignment_request)
+                if room_id is None:
+                    unplaced.append((position, {"request": assignment_request.request_id, "reason": reason}))
+                    continue
+                placed.append((position, {
+                    "request": assignment_request.request_id,
+                    "room_id": room_id,
+                    "occurrences": len(assignment_request.occurrence_ordinals()),
+                }))
+                bookings.append(assignment_request.booking_for_room(room_id))
+
+    if commit and bookings:
+        with metrics.measure("assignment.commit"):
+            reservation_book.add_bookings(
+                [booking for booking in bookings if isinstance(booking, Reservation)],
+                [booking for booking in bookings if isinstance(booking, RecurringSeries)],
+            )
+
+    if metrics.enabled:
+        metrics.increment("assignment.requests_placed", len(placed))
+        metrics.increment("assignment.requests_unplaced", len(unplaced))
+
+    # Both lists follow the order of the request file.
+    return {
+        "requests": len(placed) + len(unplaced),
+        "placed": [entry for _, entry in sorted(placed, key=itemgetter(0))],
+        "unplaced": [entry for _, entry in sorted(unplaced, key=itemgetter(0))],
+        "committed": commit and bool(bookings),
+        "seconds": round(perf_counter() - started_at, 3),
+    }
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import signal
+import sys
+from urllib.parse import urlsplit, parse_qs
+from classroom import Classroom
+from reservation import Reservation
+from recurring_series import RecurringSeries
+from reservation_book import ReservationBook
+from reservation_query import reservation_query_from_fields, DEFAULT_PAGE_SIZE
+from errors import ReservationConflictError, NotFoundError
+from validator import Validator
+from storage import Storage
+from sqlite_book import is_sqlite_filename
+
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 2.0
+MAX_BODY_BYTES = 1024 * 1024
+# Any of these turns GET /reservations into a paged query answered with a
+# "next_cursor" for the following page.
+_PAGED_LISTING_PARAMETERS = {"limit", "cursor", "from", "to", "from_time", "to_time", "person", "building", "purpose"}
+
+_STATUS_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _reservation_result(reservation):
+    reservation_data = reservation.to_dict()
+    reservation_data["reservation_id"] = reservation.reservation_id
+    if reservation.series_id is not None:
+        reservation_data["series_id"] = reservation.series_id
+    return reservation_data
+
+
+def _series_result(series):
+    series_data = series.to_dict()
+    series_data["series_id"] = series.series_id
+    return series_data
+
+
+class ReservationServer:
+    def __init__(self, reservation_book=None, filename=None, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.reservation_book = reservation_book if reservation_book is not None else ReservationBook()
+        self.filename = filename
+        self.flush_interval_seconds = flush_interval_seconds
+        self.validator = Validator()
+        self.storage = Storage()
+        self._mutation_queue = None
+        self._dirty = False
+        self._background_tasks = []
+        self._server = None
+
+    async def start(self, host, port):
+        self._mutation_queue = asyncio.Queue()
+        self._background_tasks = [asyncio.create_task(self._run_writer())]
+        if self.filename is not None:
+            self._background_tasks.append(asyncio.create_task(self._run_flusher()))
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.flush()
+
+    async def serve_until_stopped(self, host, port):
+        await self.start(host, port)
+
+        stop_requested = asyncio.Event()
+        event_loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                event_loop.add_signal_handler(signal_number, stop_requested.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        try:
+            await stop_requested.wait()
+        finally:
+            await self.stop()
+
+    # Mutations go through one writer task so they are applied strictly in arrival
+    # order. Readers run synchronously on the event loop between two writer steps,
+    # so every response is built from one consistent state of the book.
+    async def _submit_mutation(self, mutation):
+        result_future = asyncio.get_running_loop().create_future()
+        await self._mutation_queue.put((mutation, result_future))
+        return await result_future
+
+    async def _run_writer(self):
+        while True:
+            pending_mutations = [await self._mutation_queue.get()]
+            while not self._mutation_queue.empty():
+                pending_mutations.append(self._mutation_queue.get_nowait())
+
+            for mutation, result_future in pending_mutations:
+                try:
+                    result = mutation()
+                except Exception as error:
+                    if not result_future.done():
+                        result_future.set_exception(error)
+                else:
+                    self._dirty = True
+                    if not result_future.done():
+                        result_future.set_result(result)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+            except OSError as error:
+                # The book stays dirty, so the next tick tries again.
+                print("[ERROR] Background save failed: {}".format(error), file=sys.stderr)
+
+    async def flush(self):
+        if self.filename is None or not self._dirty:
+            return
+        # The snapshot fixes a single state in O(1) on the event loop; building the
+        # document from it and writing the file happen in a worker thread while
+        # the writer task keeps changing the book.
+        self._dirty = False
+        book_snapshot = self.reservation_book.snapshot()
+        try:
+            await asyncio.to_thread(self._write_snapshot, book_snapshot)
+        except OSError:
+            self._dirty = True
+            raise
+
+    def _write_snapshot(self, book_snapshot):
+        self.storage.write_book_data(book_snapshot.to_dict(), self.filename)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = await self._handle_request(reader, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+
+        keep_alive = True
+        try:
+            try:
+                method, target, http_version = request_line.decode("latin-1").split()
+            except ValueError:
+                raise HttpError(400, "Malformed request line.")
+
+            headers = {}
+            while True:
+                header_line = await reader.readline()
+                if header_line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header_line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            connection_header = headers.get("connection", "").lower()
+            keep_alive = connection_header != "close" and (http_version != "HTTP/1.0" or connection_header == "keep-alive")
+
+            body_length = int(headers.get("content-length", "0") or "0")
+            if body_length > MAX_BODY_BYTES:
+                keep_alive = False
+                raise HttpError(413, "Request body too large.")
+            body = await reader.readexactly(body_length) if body_length else b""
+
+            status, payload = await self._dispatch(method, target, body)
+        except HttpError as error:
+            status, payload = error.status, {"error": str(error)}
+        except ReservationConflictError as error:
+            status, payload = 409, {"error": str(error)}
+        except NotFoundError as error:
+            status, payload = 404, {"error": str(error)}
+        except ValueError as error:
+            status, payload = 400, {"error": str(error)}
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as error:
+            # E.g. an OSError from a SQLite read; the client still gets an answer.
+            print("[ERROR] {}: {!r}".format(request_line.decode("latin-1").strip(), error), file=sys.stderr)
+            status, payload = 500, {"error": "Internal server error."}
+
+        response_body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                status,
+                _STATUS_REASONS.get(status, ""),
+                len(response_body),
+                "keep-alive" if keep_alive else "close",
+            ).encode("latin-1") + response_body
+        )
+        await writer.drain()
+        return keep_alive
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path_parts = [part for part in url.path.split("/") if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if path_parts == ["classrooms"]:
+            if method == "GET":
+                return 200, {"classrooms": [classroom.to_dict() for classroom in self.reservation_book.list_classrooms()]}
+            if method == "POST":
+                classroom = self._classroom_from_body(self._parse_json_body(body))
+                await self._submit_mutation(lambda: self.reservation_book.add_classroom(classroom))
+                return 201, classroom.to_dict()
+            raise HttpError(405, "Method not allowed.")
+
+        if path_parts == ["reservations"]:
+            if method == "GET":
+                if query.keys() & _PAGED_LISTING_PARAMETERS:
+                    return 200, self._reservation_page(query)
+                return 200, {"reservations": [
+                    _reservation_result(reservation)
+                    for reservation in self.reservation_book.list_reservations(**self._listing_filters(query))
+                ]}
+            if method == "POST":
+                reservation = self._reservation_from_body(self._parse_json_body(body))
+                reservation_data = await self._submit_mutation(lambda: self._add_reservation(reservation))
+                return 201, reservation_data
+            raise HttpError(405, "Method not allowed.")
+
+        if len(path_parts) == 2 and path_parts[0] == "reservations":
+            reservation_id = self.validator.require_positive_integer(path_parts[1], "Reservation ID")
+            if method == "GET":
+                return 200, _reservation_result(self.reservation_book.get_reservation(reservation_id))
+            if method == "DELETE":
+                removed = await self._submit_mutation(
+                    lambda: self.reservation_book.remove_reservation_by_id(reservation_id)
+                )
+                return 200, _reservation_result(removed)
+            raise HttpError(405, "Method not allowed.")
+
+        if path_parts == ["series"]:
+            if method == "GET":
+                return 200, {"series": [_series_result(series) for series in self.reservation_book.list_series()]}
+            if method == "POST":
+                series = self._series_from_body(self._parse_json_body(body))
+                await self._submit_mutation(lambda: self.reservation_book.add_series(series))
+                return 201, _series_result(series)
+            raise HttpError(405, "Method not allowed.")
+
+        if len(path_parts) == 2 and path_parts[0] == "series":
+            series_id = self.validator.require_positive_integer(path_parts[1], "Series ID")
+            if method == "GET":
+                return 200, _series_result(self.reservation_book.get_series(series_id))
+            if method == "DELETE":
+                removed = await self._submit_mutation(lambda: self.reservation_book.remove_series(series_id))
+                return 200, _series_result(removed)
+            raise HttpError(405, "Method not allowed.")
+
+        if path_parts == ["available-classrooms"]:
+            if method != "GET":
+                raise HttpError(405, "Method not allowed.")
+            minimum_capacity = None
+            if query.get("capacity"):
+                minimum_capacity = self.validator.require_positive_integer(query["capacity"], "Capacity")
+            classroom_list = self.reservation_book.find_available_rooms(
+                self.validator.parse_iso_date(query.get("date", "")),
+                self.validator.parse_hhmm_time(query.get("start_time", "")),
+                self.validator.parse_hhmm_time(query.get("end_time", "")),
+                minimum_capacity=minimum_capacity,
+                required_equipment=self.validator.parse_equipment_list(query.get("equipment", "")),
+                building_name=query.get("building") or None,
+            )
+            return 200, {"classrooms": [classroom.to_dict() for classroom in classroom_list]}
+
+        raise HttpError(404, "Unknown path '{}'.".format(url.path))
+
+    def _parse_json_body(self, body):
+        try:
+            body_data = json.loads(body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as error:
+            raise HttpError(400, "Invalid JSON: {}".format(error))
+        if not isinstance(body_data, dict):
+            raise HttpError(400, "Request body must be a JSON object.")
+        return body_data
+
+    def _listing_filters(self, query):
+        listing_filters = {}
+        if query.get("room_id"):
+            listing_filters["room_id"] = self.validator.require_non_empty_text(query["room_id"], "Room ID")
+        if query.get("date"):
+            listing_filters["reservation_date"] = self.validator.parse_iso_date(query["date"])
+        return listing_filters
+
+    def _reservation_page(self, query):
+        reservation_query = reservation_query_from_fields(query, self.validator)
+        page_size = self.validator.require_positive_integer(query.get("limit", str(DEFAULT_PAGE_SIZE)), "Limit")
+        reservation_page, next_cursor = self.reservation_book.page_reservations(
+            reservation_query,
+            page_size=page_size,
+            cursor=query.get("cursor") or None,
+        )
+        return {
+            "reservations": [_reservation_result(reservation) for reservation in reservation_page],
+            "next_cursor": next_cursor,
+        }
+
+    def _classroom_from_body(self, body_data):
+        equipment = body_data.get("equipment", "")
+        if isinstance(equipment, list):
+            equipment = ", ".join(str(item) for item in equipment)
+        return Classroom(
+            room_id=self.validator.require_non_empty_text(body_data.get("room_id", ""), "Room ID"),
+            building_name=self.validator.require_non_empty_text(body_data.get("building", ""), "Building"),
+            capacity=self.validator.require_positive_integer(body_data.get("capacity", ""), "Capacity"),
+            equipment_list=self.validator.parse_equipment_list(equipment),
+        )
+
+    def _series_from_body(self, body_data):
+        excluded_dates = body_data.get("excluded_dates", [])
+        if not isinstance(excluded_dates, list):
+            raise HttpError(400, "excluded_dates must be a list.")
+        return RecurringSeries(
+            room_id=self.validator.require_non_empty_text(body_data.get("room_id", ""), "Room ID"),
+            person_name=self.validator.require_non_empty_text(body_data.get("person", ""), "Person"),
+            reservation_purpose=self.validator.require_non_empty_text(body_data.get("purpose", ""), "Purpose"),
+            first_date=self.validator.parse_iso_date(body_data.get("first_date", "")),
+            last_date=self.validator.parse_iso_date(body_data.get("last_date", "")),
+            interval_days=self.validator.require_positive_integer(body_data.get("interval_days", ""), "Repeat interval"),
+            start_time=self.validator.parse_hhmm_time(body_data.get("start_time", "")),
+            end_time=self.validator.parse_hhmm_time(body_data.get("end_time", "")),
+            excluded_dates=[self.validator.parse_iso_date(raw_date) for raw_date in excluded_dates],
+        )
+
+    def _add_reservation(self, reservation):
+        # Runs on the writer task, so the new booking is read back before a later
+        # queued change can remove it.
+        reservation_id = self.reservation_book.add_reservation(reservation)
+        return _reservation_result(self.reservation_book.get_reservation(reservation_id))
+
+    def _reservation_from_body(self, body_data):
+        return Reservation(
+            room_id=self.validator.require_non_empty_text(body_data.get("room_id", ""), "Room ID"),
+            person_name=self.validator.require_non_empty_text(body_data.get("person", ""), "Person"),
+            reservation_purpose=self.validator.require_non_empty_text(body_data.get("purpose", ""), "Purpose"),
+            reservation_date=self.validator.parse_iso_date(body_data.get("date", "")),
+            start_time=self.validator.parse_hhmm_time(body_data.get("start_time", "")),
+            end_time=self.validator.parse_hhmm_time(body_data.get("end_time", "")),
+        )
+
+
+def run_server(host, port, filename=None, parallel_workers=None):
+    reservation_book = None
+    if filename is not None and is_sqlite_filename(filename):
+        # A SQLite book commits every change itself, so there is nothing to flush.
+        reservation_book = Storage().open_sqlite_book(filename, create=True)
+        filename = None
+    elif filename is not None:
+        try:
+            reservation_book = Storage(parallel_workers=parallel_workers).load_from_file(filename)
+        except FileNotFoundError:
+            reservation_book = None
+
+    reservation_server = ReservationServer(reservation_book=reservation_book, filename=filename)
+    print("Serving on http://{}:{}/ (Ctrl+C to stop)".format(host, port))
+    try:
+        asyncio.run(reservation_server.serve_until_stopped(host, port))
+    except KeyboardInterrupt:
+        pass
+    reservation_server.reservation_book.close()
+    print("Stopped.")
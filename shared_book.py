@@ -0,0 +1,324 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from errors import ReservationConflictError, NotFoundError
+from journal import Journal, DEFAULT_COMPACTION_THRESHOLD_BYTES
+from reservation_book import ReservationBook, reservation_book_from_dict
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# First record of a log written by compaction: the sequence number the new
+# snapshot already contains. Plain journals skip it like any applied record.
+_BASE_OPERATION = "base"
+
+
+def _file_stamp(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+
+def _exclusive(method):
+    @wraps(method)
+    def synchronised_method(self, *args, **kwargs):
+        with self._shared_journal.locked(exclusive=True):
+            return method(self, *args, **kwargs)
+    return synchronised_method
+
+
+def _shared(method):
+    @wraps(method)
+    def synchronised_method(self, *args, **kwargs):
+        with self._shared_journal.locked(exclusive=False):
+            return method(self, *args, **kwargs)
+    return synchronised_method
+
+
+class SharedReservationBook(ReservationBook):
+    # Every public operation first takes the shared book's lock and merges what
+    # other instances logged since the last one.
+    def __init__(self, shared_journal):
+        super().__init__()
+        self._shared_journal = shared_journal
+
+    @contextmanager
+    def transaction(self):
+        # The lock is held for the whole block, so no other instance's changes
+        # are merged in between.
+        with self._shared_journal.locked(exclusive=True):
+            with super().transaction():
+                yield self
+
+    add_classroom = _exclusive(ReservationBook.add_classroom)
+    add_reservation = _exclusive(ReservationBook.add_reservation)
+    add_reservations_bulk = _exclusive(ReservationBook.add_reservations_bulk)
+    add_series = _exclusive(ReservationBook.add_series)
+    add_bookings = _exclusive(ReservationBook.add_bookings)
+    remove_series = _exclusive(ReservationBook.remove_series)
+    remove_matching_series = _exclusive(ReservationBook.remove_matching_series)
+    exclude_series_occurrence = _exclusive(ReservationBook.exclude_series_occurrence)
+    exclude_matching_series_occurrence = _exclusive(ReservationBook.exclude_matching_series_occurrence)
+    remove_reservation = _exclusive(ReservationBook.remove_reservation)
+    remove_listed_reservation = _exclusive(ReservationBook.remove_listed_reservation)
+    remove_reservation_by_id = _exclusive(ReservationBook.remove_reservation_by_id)
+    remove_matching_reservation = _exclusive(ReservationBook.remove_matching_reservation)
+    remove_all_reservations = _exclusive(ReservationBook.remove_all_reservations)
+    clear_all = _exclusive(ReservationBook.clear_all)
+    undo = _exclusive(ReservationBook.undo)
+
+    list_classrooms = _shared(ReservationBook.list_classrooms)
+    find_available_rooms = _shared(ReservationBook.find_available_rooms)
+    suggest_alternatives = _shared(ReservationBook.suggest_alternatives)
+    list_suitable_rooms = _shared(ReservationBook.list_suitable_rooms)
+    list_reservations = _shared(ReservationBook.list_reservations)
+    query_reservations = _shared(ReservationBook.query_reservations)
+    query_records = _shared(ReservationBook.query_records)
+    page_reservations = _shared(ReservationBook.page_reservations)
+    list_series = _shared(ReservationBook.list_series)
+    get_series = _shared(ReservationBook.get_series)
+    get_reservation = _shared(ReservationBook.get_reservation)
+    to_dict = _shared(ReservationBook.to_dict)
+    snapshot = _shared(ReservationBook.snapshot)
+
+
+class SharedJournal(Journal):
+    # A journal that several instances append to. Operations hold an fcntl lock
+    # on "<book>.lock"; under it an instance compares the log's and snapshot's
+    # inode, size and mtime with what it saw last time and, if they changed,
+    # applies only the log records past its own sequence number. A full reload is
+    # needed only when records it never saw were compacted into the snapshot.
+    def __init__(self, filename, compaction_threshold_bytes=DEFAULT_COMPACTION_THRESHOLD_BYTES, storage=None):
+        super().__init__(filename, compaction_threshold_bytes=compaction_threshold_bytes, storage=storage)
+        self.lock_path = self.snapshot_path.with_name(self.snapshot_path.name + ".lock")
+        self.merged_record_count = 0
+        self.full_reload_count = 0
+        self._lock_file = None
+        self._lock_depth = 0
+        self._loaded = False
+        self._replaying = False
+        self._log_offset = 0
+        self._log_stamp = None
+        self._snapshot_stamp = None
+
+    def open(self):
+        if fcntl is None:
+            raise OSError("Shared mode needs fcntl file locks, which this platform does not provide.")
+
+        try:
+            self._lock_file = open(self.lock_path, "a+")
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        except OSError as error:
+            self.close()
+            raise OSError("Failed to open shared book: {}".format(error))
+
+        self.reservation_book = SharedReservationBook(self)
+        try:
+            # The first lock loads the snapshot and the log.
+            with self.locked(exclusive=False):
+                pass
+        except Exception:
+            self.close()
+            raise
+        self.reservation_book.add_change_listener(self._record_change)
+        return self.reservation_book
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @contextmanager
+    def locked(self, exclusive):
+        # Re-entrant: operations that call other operations lock and sync once.
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+
+        try:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except OSError as error:
+            raise OSError("Failed to lock shared book: {}".format(error))
+        self._lock_depth = 1
+        try:
+            self._sync()
+            yield
+        finally:
+            self._lock_depth = 0
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        log_stamp = _file_stamp(self.log_path)
+        snapshot_stamp = _file_stamp(self.snapshot_path)
+        if self._loaded and log_stamp == self._log_stamp and snapshot_stamp == self._snapshot_stamp:
+            return
+
+        if metrics.enabled:
+            started_at = time.perf_counter()
+        if not self._loaded:
+            self._reload()
+        elif not self._merge_log(log_stamp, snapshot_stamp):
+            self._reload()
+        # Undo steps taken before other instances' changes would undo those too.
+        self.reservation_book.clear_undo_history()
+        if metrics.enabled:
+            metrics.record_latency("shared.sync", time.perf_counter() - started_at)
+
+    def _merge_log(self, log_stamp, snapshot_stamp):
+        # A log with a new inode or fewer bytes than already read was rewritten by
+        # compaction and is read again from the start.
+        log_rewritten = (
+            log_stamp is None
+            or self._log_stamp is None
+            or log_stamp[0] != self._log_stamp[0]
+            or log_stamp[1] < self._log_offset
+        )
+        records, end_offset = self._read_log_records(0 if log_rewritten else self._log_offset)
+
+        if snapshot_stamp != self._snapshot_stamp:
+            # The snapshot may only change together with a rewritten log that
+            # starts at a sequence number this instance has already applied.
+            if not (
+                log_rewritten
+                and records
+                and records[0]["op"] == _BASE_OPERATION
+                and records[0]["seq"] <= self._sequence
+            ):
+                return False
+
+        if not self._apply_log_records(records):
+            return False
+        self._log_offset = end_offset
+        self._log_stamp = log_stamp
+        self._snapshot_stamp = snapshot_stamp
+        return True
+
+    def _reload(self):
+        snapshot_stamp = _file_stamp(self.snapshot_path)
+        book_data = self.storage.read_book_data(self.snapshot_path) if snapshot_stamp is not None else {}
+        log_stamp = _file_stamp(self.log_path)
+        records, end_offset = self._read_log_records(0)
+
+        self._replaying = True
+        try:
+            self.reservation_book.clear_all()
+            reservation_book_from_dict(book_data, reservation_book=self.reservation_book)
+        finally:
+            self._replaying = False
+        self._sequence = int(book_data.get("journal_sequence", 0))
+        if not self._apply_log_records(records):
+            raise ValueError("Shared journal {} does not continue its snapshot.".format(self.log_path))
+
+        self._loaded = True
+        self._log_offset = end_offset
+        self._log_stamp = log_stamp
+        self._snapshot_stamp = snapshot_stamp
+        self.full_reload_count += 1
+        if metrics.enabled:
+            metrics.increment("shared.full_reloads")
+
+    def _read_log_records(self, start_offset):
+        # Only complete lines count; a torn last line belongs to an instance that
+        # died mid-append and is cut off before this instance appends.
+        try:
+            with open(self.log_path, "rb") as log_file:
+                log_file.seek(start_offset)
+                log_bytes = log_file.read()
+        except FileNotFoundError:
+            return [], 0
+        except OSError as error:
+            raise OSError("Failed to read journal: {}".format(error))
+
+        complete_length = log_bytes.rfind(b"\n") + 1
+        records = []
+        for line in log_bytes[:complete_length].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise ValueError("Invalid journal record in {}.".format(self.log_path))
+        return records, start_offset + complete_length
+
+    def _apply_log_records(self, records):
+        # Records must continue this instance's sequence without a gap; anything
+        # else means its state cannot be brought up to date incrementally.
+        self._replaying = True
+        try:
+            for record in records:
+                if record["seq"] <= self._sequence:
+                    continue
+                if record["seq"] != self._sequence + 1 or record["op"] == _BASE_OPERATION:
+                    return False
+                try:
+                    self._apply_record(self.reservation_book, record)
+                except (ReservationConflictError, NotFoundError, ValueError):
+                    return False
+                self._sequence = record["seq"]
+                self.merged_record_count += 1
+                if metrics.enabled:
+                    metrics.increment("shared.records_merged")
+        finally:
+            self._replaying = False
+        return True
+
+    def _remember_log_position(self):
+        self._log_stamp = _file_stamp(self.log_path)
+        self._log_offset = self._log_stamp[1]
+
+    def _record_change(self, operation, payload):
+        if self._replaying:
+            return
+
+        log_stamp = _file_stamp(self.log_path)
+        if log_stamp is None or os.fstat(self._log_file.fileno()).st_ino != log_stamp[0]:
+            # Another instance compacted the book and replaced the log file.
+            try:
+                self._log_file.close()
+                self._log_file = open(self.log_path, "a", encoding="utf-8")
+            except OSError as error:
+                raise OSError("Failed to open journal: {}".format(error))
+
+        self._log_file.flush()
+        if os.fstat(self._log_file.fileno()).st_size > self._log_offset:
+            # The sync under this lock read every complete record, so the extra
+            # bytes are a torn append from an instance that died holding the lock.
+            self._log_file.truncate(self._log_offset)
+        super()._record_change(operation, payload)
+        self._remember_log_position()
+
+    def compact(self):
+        with self.locked(exclusive=True):
+            book_data = self.reservation_book.to_dict()
+            book_data["journal_sequence"] = self._sequence
+            self.storage.write_book_data(book_data, self.snapshot_path)
+
+            # The log is replaced instead of truncated in place, so other instances
+            # see a new inode and re-read it from its first (base) record.
+            temporary_path = self.log_path.with_name(self.log_path.name + ".tmp")
+            try:
+                with open(temporary_path, "w", encoding="utf-8") as temporary_file:
+                    temporary_file.write(json.dumps({"seq": self._sequence, "op": _BASE_OPERATION}) + "\n")
+                    temporary_file.flush()
+                    os.fsync(temporary_file.fileno())
+                os.replace(temporary_path, self.log_path)
+                self._log_file.close()
+                self._log_file = open(self.log_path, "a", encoding="utf-8")
+            except OSError as error:
+                raise OSError("Failed to rewrite journal: {}".format(error))
+
+            self._snapshot_stamp = _file_stamp(self.snapshot_path)
+            self._remember_log_position()
@@ -0,0 +1,152 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+DEFAULT_BUCKET_SIZE = 1000
+
+
+class SortedList:
+    def __init__(self, key, items=(), bucket_size=DEFAULT_BUCKET_SIZE):
+        self._key = key
+        self._bucket_size = bucket_size
+        self._buckets = []
+        self._bucket_max_keys = []
+        self._bucket_offsets = None
+        self._length = 0
+        # Ids of the buckets this list may change in place; None means all of them.
+        # Buckets shared with a copy are copied before their first change.
+        self._owned_buckets = None
+        self.reset(items)
+
+    def reset(self, sorted_items=()):
+        sorted_items = list(sorted_items)
+        self._buckets = [
+            sorted_items[start:start + self._bucket_size]
+            for start in range(0, len(sorted_items), self._bucket_size)
+        ]
+        self._bucket_max_keys = [self._key(bucket[-1]) for bucket in self._buckets]
+        self._bucket_offsets = None
+        self._length = len(sorted_items)
+        self._owned_buckets = None
+
+    def clear(self):
+        self.reset()
+
+    def copy(self):
+        # Copies only the bucket index; the buckets themselves stay shared until
+        # either list changes one of them.
+        sorted_copy = SortedList(self._key, bucket_size=self._bucket_size)
+        sorted_copy._buckets = list(self._buckets)
+        sorted_copy._bucket_max_keys = list(self._bucket_max_keys)
+        sorted_copy._bucket_offsets = self._bucket_offsets
+        sorted_copy._length = self._length
+        sorted_copy._owned_buckets = set()
+        self._owned_buckets = set()
+        return sorted_copy
+
+    def _writable_bucket(self, bucket_index):
+        bucket = self._buckets[bucket_index]
+        if self._owned_buckets is not None and id(bucket) not in self._owned_buckets:
+            bucket = self._buckets[bucket_index] = list(bucket)
+            self._owned_buckets.add(id(bucket))
+        return bucket
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def add(self, item):
+        item_key = self._key(item)
+
+        if not self._buckets:
+            self._buckets.append([item])
+            self._bucket_max_keys.append(item_key)
+        else:
+            bucket_index = min(bisect_left(self._bucket_max_keys, item_key), len(self._buckets) - 1)
+            bucket = self._writable_bucket(bucket_index)
+            insort(bucket, item, key=self._key)
+            self._bucket_max_keys[bucket_index] = self._key(bucket[-1])
+
+            if len(bucket) > 2 * self._bucket_size:
+                split_buckets = [bucket[:self._bucket_size], bucket[self._bucket_size:]]
+                self._buckets[bucket_index:bucket_index + 1] = split_buckets
+                self._bucket_max_keys[bucket_index:bucket_index + 1] = [
+                    self._key(bucket[self._bucket_size - 1]),
+                    self._key(bucket[-1]),
+                ]
+                if self._owned_buckets is not None:
+                    self._owned_buckets.update(id(split_bucket) for split_bucket in split_buckets)
+
+        self._length += 1
+        self._bucket_offsets = None
+
+    def remove(self, item):
+        item_key = self._key(item)
+        bucket_index = bisect_left(self._bucket_max_keys, item_key)
+        if bucket_index == len(self._buckets):
+            raise ValueError("Item is not in the list.")
+
+        bucket = self._buckets[bucket_index]
+        position = bisect_left(bucket, item_key, key=self._key)
+        if position == len(bucket) or bucket[position] is not item:
+            raise ValueError("Item is not in the list.")
+
+        bucket = self._writable_bucket(bucket_index)
+        del bucket[position]
+        if bucket:
+            self._bucket_max_keys[bucket_index] = self._key(bucket[-1])
+        else:
+            del self._buckets[bucket_index]
+            del self._bucket_max_keys[bucket_index]
+
+        self._length -= 1
+        self._bucket_offsets = None
+
+    def _offsets(self):
+        if self._bucket_offsets is None:
+            bucket_offsets = []
+            running_total = 0
+            for bucket in self._buckets:
+                bucket_offsets.append(running_total)
+                running_total += len(bucket)
+            self._bucket_offsets = bucket_offsets
+        return self._bucket_offsets
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._length
+        if position < 0 or position >= self._length:
+            raise IndexError("SortedList index out of range.")
+
+        bucket_offsets = self._offsets()
+        bucket_index = bisect_right(bucket_offsets, position) - 1
+        return self._buckets[bucket_index][position - bucket_offsets[bucket_index]]
+
+    def bisect_key_left(self, item_key):
+        bucket_index = bisect_left(self._bucket_max_keys, item_key)
+        if bucket_index == len(self._buckets):
+            return self._length
+
+        bucket = self._buckets[bucket_index]
+        return self._offsets()[bucket_index] + bisect_left(bucket, item_key, key=self._key)
+
+    def irange_key(self, minimum_key=None, maximum_key=None):
+        bucket_index = 0
+        position = 0
+        if minimum_key is not None:
+            bucket_index = bisect_left(self._bucket_max_keys, minimum_key)
+            if bucket_index < len(self._buckets):
+                position = bisect_left(self._buckets[bucket_index], minimum_key, key=self._key)
+
+        while bucket_index < len(self._buckets):
+            bucket = self._buckets[bucket_index]
+            while position < len(bucket):
+                item = bucket[position]
+                if maximum_key is not None and self._key(item) >= maximum_key:
+                    return
+                yield item
+                position += 1
+            bucket_index += 1
+            position = 0
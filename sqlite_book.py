@@ -0,0 +1,538 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, time
+from itertools import starmap
+from pathlib import Path
+from time import perf_counter
+from errors import NotFoundError
+from classroom import Classroom
+from recurring_series import RecurringSeries
+from metrics import metrics
+from reservation import reservation_record_from_fields, reservation_record_from_reservation
+from reservation_book import (
+    ReservationBook,
+    validate_new_reservation,
+    group_reservation_records,
+)
+
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+SQLITE_MAGIC = b"SQLite format 3\x00"
+SCHEMA_VERSION = 1
+
+# Reservation and series ids are AUTOINCREMENT keys, so sqlite_sequence keeps the
+# highest id ever used and ids are never reused after a removal.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS classrooms (
+    room_id TEXT PRIMARY KEY,
+    building TEXT NOT NULL,
+    capacity INTEGER NOT NULL,
+    equipment TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id TEXT NOT NULL,
+    person TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    date_ordinal INTEGER NOT NULL,
+    start_minute INTEGER NOT NULL,
+    end_minute INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_by_room ON reservations (room_id, date_ordinal, start_minute);
+CREATE INDEX IF NOT EXISTS reservations_by_person ON reservations (person, date_ordinal, start_minute);
+CREATE INDEX IF NOT EXISTS reservations_by_date ON reservations (date_ordinal, room_id, start_minute);
+CREATE TABLE IF NOT EXISTS series (
+    series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id TEXT NOT NULL,
+    person TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    first_date_ordinal INTEGER NOT NULL,
+    last_date_ordinal INTEGER NOT NULL,
+    interval_days INTEGER NOT NULL,
+    start_minute INTEGER NOT NULL,
+    end_minute INTEGER NOT NULL,
+    excluded_dates TEXT NOT NULL
+);
+"""
+
+_RESERVATION_COLUMNS = "reservation_id, room_id, person, purpose, date_ordinal, start_minute, end_minute"
+_LISTING_ORDER = " ORDER BY date_ordinal, room_id, start_minute"
+# Rows fetched per statement when a query result is streamed; the first batch is
+# small because a paged listing usually needs only one screenful.
+_FIRST_QUERY_BATCH_SIZE = 64
+_QUERY_BATCH_SIZE = 1024
+_INSERT_CLASSROOM = "INSERT OR REPLACE INTO classrooms (room_id, building, capacity, equipment) VALUES (?, ?, ?, ?)"
+_INSERT_RESERVATION = "INSERT INTO reservations ({}) VALUES (?, ?, ?, ?, ?, ?, ?)".format(_RESERVATION_COLUMNS)
+_INSERT_SERIES = (
+    "INSERT INTO series (series_id, room_id, person, purpose, first_date_ordinal, last_date_ordinal,"
+    " interval_days, start_minute, end_minute, excluded_dates) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_OVERLAPPING_RESERVATIONS = (
+    "SELECT {0} FROM reservations"
+    " WHERE room_id = ? AND date_ordinal = ? AND start_minute < ? AND end_minute > ?"
+    " UNION SELECT {0} FROM reservations"
+    " WHERE person = ? AND date_ordinal = ? AND start_minute < ? AND end_minute > ?"
+    " ORDER BY reservation_id"
+).format(_RESERVATION_COLUMNS)
+# A None room or person matches no row.
+_BOOKED_INTERVALS = (
+    "SELECT start_minute, end_minute FROM reservations WHERE room_id = ? AND date_ordinal = ?"
+    " UNION ALL SELECT start_minute, end_minute FROM reservations WHERE person = ? AND date_ordinal = ?"
+)
+_OVERLAPPING_SERIES_DATES = (
+    "SELECT date_ordinal FROM reservations"
+    " WHERE room_id = ? AND date_ordinal BETWEEN ? AND ? AND start_minute < ? AND end_minute > ?"
+    " UNION SELECT date_ordinal FROM reservations"
+    " WHERE person = ? AND date_ordinal BETWEEN ? AND ? AND start_minute < ? AND end_minute > ?"
+)
+
+
+def is_sqlite_filename(filename):
+    return Path(filename).suffix.lower() in SQLITE_SUFFIXES
+
+
+def is_sqlite_book(filename):
+    with open(filename, "rb") as book_file:
+        return book_file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def _classroom_row(classroom):
+    return (
+        classroom.room_id,
+        classroom.building_name,
+        classroom.capacity,
+        json.dumps(list(classroom.equipment_list), ensure_ascii=False),
+    )
+
+
+def _record_row(record):
+    return (
+        record.reservation_id,
+        record.room_id,
+        record.person_name,
+        record.reservation_purpose,
+        record.date_ordinal,
+        record.start_minute,
+        record.end_minute,
+    )
+
+
+def _series_row(series):
+    return (
+        series.series_id,
+        series.room_id,
+        series.person_name,
+        series.reservation_purpose,
+        series.first_date_ordinal,
+        series.last_date_ordinal,
+        series.interval_days,
+        series.start_minute,
+        series.end_minute,
+        json.dumps(sorted(series.excluded_date_ordinals)),
+    )
+
+
+def _series_from_row(row):
+    series = RecurringSeries(
+        room_id=row[1],
+        person_name=row[2],
+        reservation_purpose=row[3],
+        first_date=date.fromordinal(row[4]),
+        last_date=date.fromordinal(row[5]),
+        interval_days=row[6],
+        start_time=time(*divmod(row[7], 60)),
+        end_time=time(*divmod(row[8], 60)),
+        series_id=row[0],
+    )
+    series.excluded_date_ordinals = set(json.loads(row[9]))
+    return series
+
+
+class SqliteReservationBook(ReservationBook):
+    # Reservations live only in the database file: listings and conflict checks are
+    # indexed range queries and every change is a short transaction, so opening a
+    # book reads just its classrooms and series, which stay in memory as in
+    # ReservationBook.
+    supports_snapshots = False
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        try:
+            self._connection = sqlite3.connect(filename)
+        except sqlite3.Error as error:
+            raise OSError("Failed to read file: {}".format(error))
+
+        try:
+            self._prepare_schema()
+            self._load_book_state()
+        except sqlite3.DatabaseError as error:
+            self._connection.close()
+            raise ValueError("Invalid SQLite book: {}".format(error))
+        except ValueError:
+            self._connection.close()
+            raise
+
+    def _prepare_schema(self):
+        schema_version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version > SCHEMA_VERSION:
+            raise ValueError("Unsupported SQLite book version: {}".format(schema_version))
+
+        # WAL keeps single-row commits cheap; readers never block the writer.
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        if schema_version < SCHEMA_VERSION:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+
+    def _load_book_state(self):
+        for room_id, building_name, capacity, equipment_data in self._connection.execute(
+            "SELECT room_id, building, capacity, equipment FROM classrooms"
+        ):
+            super()._store_classroom(Classroom(room_id, building_name, capacity, json.loads(equipment_data)))
+
+        for row in self._connection.execute("SELECT * FROM series ORDER BY series_id"):
+            super()._store_series(_series_from_row(row))
+
+        sequences = dict(self._connection.execute("SELECT name, seq FROM sqlite_sequence"))
+        self._next_reservation_id = sequences.get("reservations", 0) + 1
+        self._next_series_id = sequences.get("series", 0) + 1
+
+    @contextmanager
+    def _transaction(self):
+        try:
+            if self._transaction_states:
+                # Part of a book transaction, whose savepoint commits or rolls back.
+                yield self._connection
+                return
+            with self._connection:
+                yield self._connection
+        except sqlite3.Error as error:
+            raise OSError("Failed to save file: {}".format(error))
+
+    def _execute_savepoint(self, statement_text):
+        try:
+            self._connection.execute(statement_text)
+        except sqlite3.Error as error:
+            raise OSError("Failed to save file: {}".format(error))
+
+    @contextmanager
+    def transaction(self):
+        # A savepoint per level; the outermost release is the database commit.
+        savepoint_name = "book_transaction_{}".format(len(self._transaction_states))
+        self._execute_savepoint("SAVEPOINT " + savepoint_name)
+        try:
+            with super().transaction():
+                yield self
+        except BaseException:
+            self._execute_savepoint("ROLLBACK TO " + savepoint_name)
+            self._execute_savepoint("RELEASE " + savepoint_name)
+            raise
+        self._execute_savepoint("RELEASE " + savepoint_name)
+
+    def snapshot(self):
+        raise ValueError("Snapshots are not available for SQLite books.")
+
+    def keep_undo_history(self, step_limit):
+        raise ValueError("Undo is not available for SQLite books.")
+
+    def undo(self, step_count=1):
+        raise ValueError("Undo is not available for SQLite books.")
+
+    def _read_rows(self, query_text, parameters=()):
+        try:
+            return self._connection.execute(query_text, parameters).fetchall()
+        except sqlite3.Error as error:
+            raise OSError("Failed to read file: {}".format(error))
+
+    def _select_records(self, query_text, parameters=()):
+        # Streams the rows; a failure while reading them is reported like any
+        # other failed read.
+        try:
+            yield from starmap(reservation_record_from_fields, self._connection.execute(query_text, parameters))
+        except sqlite3.Error as error:
+            raise OSError("Failed to read file: {}".format(error))
+
+    def close(self):
+        self._connection.close()
+
+    def import_book(self, reservation_book):
+        # Copies a conflict-free book (e.g. one loaded from JSON) in one transaction,
+        # keeping its reservation and series ids.
+        if self.classrooms_by_id or self._series_by_id or self._next_reservation_id > 1:
+            raise ValueError("SQLite book is not empty.")
+
+        with self._transaction() as connection:
+            connection.executemany(_INSERT_CLASSROOM, map(_classroom_row, reservation_book.list_classrooms()))
+            connection.executemany(_INSERT_SERIES, map(_series_row, reservation_book.list_series()))
+            connection.executemany(_INSERT_RESERVATION, map(_record_row, reservation_book.iter_reservation_records()))
+        self._load_book_state()
+
+    def _store_classroom(self, classroom):
+        with self._transaction() as connection:
+            connection.execute(_INSERT_CLASSROOM, _classroom_row(classroom))
+        super()._store_classroom(classroom)
+
+    def _room_is_booked(self, room_id, date_ordinal, start_minute, end_minute):
+        booked_rows = self._read_rows(
+            "SELECT 1 FROM reservations"
+            " WHERE room_id = ? AND date_ordinal = ? AND start_minute < ? AND end_minute > ? LIMIT 1",
+            (room_id, date_ordinal, end_minute, start_minute),
+        )
+        return bool(booked_rows) or self._room_series_occupied(room_id, date_ordinal, start_minute, end_minute)
+
+    def _booked_intervals(self, room_id, person_name, date_ordinal):
+        return self._read_rows(_BOOKED_INTERVALS, (room_id, date_ordinal, person_name, date_ordinal))
+
+    def _conflict_candidates(self, new_record):
+        return list(self._select_records(_OVERLAPPING_RESERVATIONS, (
+            new_record.room_id,
+            new_record.date_ordinal,
+            new_record.end_minute,
+            new_record.start_minute,
+            new_record.person_name,
+            new_record.date_ordinal,
+            new_record.end_minute,
+            new_record.start_minute,
+        )))
+
+    def _check_series_against_bookings(self, new_series):
+        # Only dates with an overlapping booking in the series' date range are
+        # fetched, then the ones the series actually meets are checked in order.
+        candidate_date_ordinals = sorted(
+            date_ordinal
+            for (date_ordinal,) in self._read_rows(_OVERLAPPING_SERIES_DATES, (
+                new_series.room_id,
+                new_series.first_date_ordinal,
+                new_series.last_date_ordinal,
+                new_series.end_minute,
+                new_series.start_minute,
+                new_series.person_name,
+                new_series.first_date_ordinal,
+                new_series.last_date_ordinal,
+                new_series.end_minute,
+                new_series.start_minute,
+            ))
+            if new_series.occurs_on(date_ordinal)
+        )
+        for date_ordinal in candidate_date_ordinals:
+            self._check_reservation_conflicts(new_series.occurrence_record(date_ordinal), check_series=False)
+
+    def add_reservation(self, reservation):
+        validate_new_reservation(reservation, self.classrooms_by_id)
+        record = reservation_record_from_reservation(
+            reservation,
+            self._new_reservation_ids([reservation.reservation_id])[0],
+        )
+
+        if metrics.enabled:
+            started_at = perf_counter()
+        self._check_reservation_conflicts(record)
+        if metrics.enabled:
+            metrics.record_latency("book.check_conflicts", perf_counter() - started_at)
+        with self._transaction() as connection:
+            connection.execute(_INSERT_RESERVATION, _record_row(record))
+        self._generation += 1
+        self._next_reservation_id = max(self._next_reservation_id, record.reservation_id + 1)
+        if self._change_listeners:
+            self._notify_change("add_reservation", record.to_dict())
+        return record.reservation_id
+
+    def _add_records_bulk(self, new_records, check_conflicts):
+        # Only stored bookings on the dates being added can conflict, so those are
+        # the only ones read back for the sweep.
+        if metrics.enabled:
+            started_at = perf_counter()
+
+        scanned_count = len(new_records)
+        if check_conflicts:
+            existing_records = [
+                record
+                for date_ordinal in sorted({record.date_ordinal for record in new_records})
+                for record in self._select_records(
+                    "SELECT {} FROM reservations WHERE date_ordinal = ?".format(_RESERVATION_COLUMNS),
+                    (date_ordinal,),
+                )
+            ]
+            scanned_count += len(existing_records)
+            room_groups, person_groups = group_reservation_records(existing_records + new_records)
+            self._check_bulk_conflicts(new_records, room_groups, person_groups)
+
+        with self._transaction() as connection:
+            connection.executemany(_INSERT_RESERVATION, map(_record_row, new_records))
+        self._generation += 1
+        if new_records:
+            self._next_reservation_id = max(
+                self._next_reservation_id,
+                max(record.reservation_id for record in new_records) + 1,
+            )
+
+        if self._change_listeners:
+            for record in new_records:
+                self._notify_change("add_reservation", record.to_dict())
+
+        if metrics.enabled:
+            metrics.record_latency("book.add_bulk", perf_counter() - started_at)
+            metrics.increment("book.records_bulk_added", len(new_records))
+            metrics.increment("book.records_bulk_scanned", scanned_count)
+
+    def _store_series(self, series):
+        with self._transaction() as connection:
+            connection.execute(_INSERT_SERIES, _series_row(series))
+        super()._store_series(series)
+
+    def _unstore_series(self, series):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM series WHERE series_id = ?", (series.series_id,))
+        super()._unstore_series(series)
+
+    def exclude_series_occurrence(self, series_id, excluded_date):
+        series = self.get_series(series_id)
+        date_ordinal = excluded_date.toordinal()
+        if series.occurs_on(date_ordinal):
+            with self._transaction() as connection:
+                connection.execute(
+                    "UPDATE series SET excluded_dates = ? WHERE series_id = ?",
+                    (json.dumps(sorted(series.excluded_date_ordinals | {date_ordinal})), series_id),
+                )
+        return super().exclude_series_occurrence(series_id, excluded_date)
+
+    def _listing_query(self, room_id=None, reservation_date=None):
+        conditions = []
+        parameters = []
+        if room_id is not None:
+            conditions.append("room_id = ?")
+            parameters.append(room_id)
+        if reservation_date is not None:
+            conditions.append("date_ordinal = ?")
+            parameters.append(reservation_date.toordinal())
+
+        query_text = "SELECT {} FROM reservations".format(_RESERVATION_COLUMNS)
+        if conditions:
+            query_text += " WHERE " + " AND ".join(conditions)
+        return query_text + _LISTING_ORDER, parameters
+
+    def _list_single_reservation_records(self, room_id=None, reservation_date=None):
+        return list(self._select_records(*self._listing_query(room_id=room_id, reservation_date=reservation_date)))
+
+    def iter_reservation_records(self):
+        return self._select_records(*self._listing_query())
+
+    def _single_records_between(self, first_date_ordinal, last_date_ordinal):
+        return self._select_records(
+            "SELECT {} FROM reservations WHERE date_ordinal BETWEEN ? AND ?".format(_RESERVATION_COLUMNS) + _LISTING_ORDER,
+            (
+                first_date_ordinal if first_date_ordinal is not None else 0,
+                last_date_ordinal if last_date_ordinal is not None else date.max.toordinal(),
+            ),
+        )
+
+    def _query_single_records(self, query, room_ids, first_date_ordinal):
+        conditions = ["date_ordinal BETWEEN ? AND ?"]
+        parameters = [
+            first_date_ordinal if first_date_ordinal is not None else 0,
+            query.last_date_ordinal if query.last_date_ordinal is not None else date.max.toordinal(),
+        ]
+        if room_ids is not None:
+            conditions.append("room_id IN ({})".format(", ".join("?" * len(room_ids))))
+            parameters.extend(room_ids)
+        if query.person_name is not None:
+            conditions.append("person = ?")
+            parameters.append(query.person_name)
+        if query.start_minute is not None:
+            conditions.append("end_minute > ?")
+            parameters.append(query.start_minute)
+        if query.end_minute is not None:
+            conditions.append("start_minute < ?")
+            parameters.append(query.end_minute)
+        return self._select_record_batches(conditions, parameters)
+
+    def _select_record_batches(self, conditions, parameters):
+        # Keyset pagination over the listing order: each batch is a short statement
+        # that starts after the last row of the previous one, so no statement stays
+        # open while the caller consumes the records.
+        after_conditions = []
+        after_parameters = []
+        batch_size = _FIRST_QUERY_BATCH_SIZE
+        while True:
+            records = list(self._select_records(
+                "SELECT {} FROM reservations WHERE {}{} LIMIT ?".format(
+                    _RESERVATION_COLUMNS,
+                    " AND ".join(conditions + after_conditions),
+                    _LISTING_ORDER,
+                ),
+                parameters + after_parameters + [batch_size],
+            ))
+            yield from records
+            if len(records) < batch_size:
+                return
+            batch_size = min(batch_size * 4, _QUERY_BATCH_SIZE)
+            last_record = records[-1]
+            after_conditions = ["(date_ordinal, room_id, start_minute) > (?, ?, ?)"]
+            after_parameters = [last_record.date_ordinal, last_record.room_id, last_record.start_minute]
+
+    def _stored_record(self, reservation_id):
+        for record in self._select_records(
+            "SELECT {} FROM reservations WHERE reservation_id = ?".format(_RESERVATION_COLUMNS),
+            (reservation_id,),
+        ):
+            return record
+        raise NotFoundError("Reservation not found.")
+
+    def _reservation_id_in_use(self, reservation_id):
+        return bool(self._read_rows("SELECT 1 FROM reservations WHERE reservation_id = ?", (reservation_id,)))
+
+    def get_reservation(self, reservation_id):
+        return self._stored_record(reservation_id).to_reservation()
+
+    def _visible_record_at(self, reservation_number, room_id=None, reservation_date=None):
+        if reservation_number < 1 or self._series_by_id:
+            return super()._visible_record_at(reservation_number, room_id=room_id, reservation_date=reservation_date)
+
+        query_text, parameters = self._listing_query(room_id=room_id, reservation_date=reservation_date)
+        for record in self._select_records(query_text + " LIMIT 1 OFFSET ?", parameters + [reservation_number - 1]):
+            return record
+        raise NotFoundError("Reservation index out of range.")
+
+    def remove_reservation_by_id(self, reservation_id):
+        return self._remove_stored_record(self._stored_record(reservation_id)).to_reservation()
+
+    def remove_matching_reservation(self, reservation):
+        wanted_record = reservation_record_from_reservation(reservation, None)
+        for record in self._select_records(
+            "SELECT {} FROM reservations WHERE room_id = ? AND person = ? AND purpose = ?"
+            " AND date_ordinal = ? AND start_minute = ? AND end_minute = ?".format(_RESERVATION_COLUMNS),
+            _record_row(wanted_record)[1:],
+        ):
+            return self._remove_stored_record(record).to_reservation()
+        raise NotFoundError("Reservation not found.")
+
+    def _remove_stored_record(self, record):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM reservations WHERE reservation_id = ?", (record.reservation_id,))
+        self._generation += 1
+        if self._change_listeners:
+            self._notify_change("remove_reservation", record.to_dict())
+        return record
+
+    def remove_all_reservations(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM reservations")
+            connection.execute("DELETE FROM series")
+        super().remove_all_reservations()
+
+    def clear_all(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM reservations")
+            connection.execute("DELETE FROM series")
+            connection.execute("DELETE FROM classrooms")
+        super().clear_all()
+
+
+def write_sqlite_book(reservation_book, filename):
+    sqlite_book = SqliteReservationBook(filename)
+    try:
+        sqlite_book.import_book(reservation_book)
+    finally:
+        sqlite_book.close()
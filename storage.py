@@ -1,32 +1,82 @@
 import json
+import os
+import sqlite3
 from pathlib import Path
 from reservation_book import reservation_book_from_dict
+from binary_snapshot import BinarySnapshot, write_binary_snapshot, is_binary_snapshot
+from parallel_loading import reservation_book_from_dict_parallel
+from sqlite_book import SqliteReservationBook, write_sqlite_book, is_sqlite_book, is_sqlite_filename
+from metrics import metrics
+
+
+BINARY_SNAPSHOT_SUFFIX = ".crsb"
 
 
 class Storage:
+    def __init__(self, parallel_workers=None):
+        self.parallel_workers = parallel_workers
+
     def save_to_file(self, reservation_book, filename):
+        with metrics.measure("storage.save"):
+            if Path(filename).suffix == BINARY_SNAPSHOT_SUFFIX:
+                self.save_binary_snapshot(reservation_book, filename)
+            elif is_sqlite_filename(filename):
+                self.save_sqlite_book(reservation_book, filename)
+            else:
+                self.write_book_data(reservation_book.to_dict(), filename)
+
+    def save_binary_snapshot(self, reservation_book, filename):
+        self._write_atomically(write_binary_snapshot(reservation_book), filename)
+
+    def save_sqlite_book(self, reservation_book, filename):
+        file_path = Path(filename)
+        if isinstance(reservation_book, SqliteReservationBook) and Path(reservation_book.filename).resolve() == file_path.resolve():
+            # Every change has already been committed to this file.
+            return
+
+        temporary_path = file_path.with_name(file_path.name + ".tmp")
+        try:
+            temporary_path.unlink(missing_ok=True)
+            write_sqlite_book(reservation_book, temporary_path)
+            os.replace(temporary_path, file_path)
+        except (OSError, sqlite3.Error) as error:
+            raise OSError("Failed to save file: {}".format(error))
+
+        if metrics.enabled:
+            metrics.increment("storage.bytes_written", os.path.getsize(file_path))
+
+    def write_book_data(self, book_data, filename):
+        self._write_atomically(json.dumps(book_data, ensure_ascii=False, indent=2).encode("utf-8"), filename)
+
+    def _write_atomically(self, file_contents, filename):
         file_path = Path(filename)
-        book_data = reservation_book.to_dict()
+        temporary_path = file_path.with_name(file_path.name + ".tmp")
 
         try:
-            file_path.write_text(
-                json.dumps(book_data, ensure_ascii=False, indent=2),
-                encoding="utf-8",
-            )
+            with open(temporary_path, "wb") as temporary_file:
+                temporary_file.write(file_contents)
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            os.replace(temporary_path, file_path)
         except OSError as error:
             raise OSError("Failed to save file: {}".format(error))
 
-    def load_from_file(self, filename):
+        if metrics.enabled:
+            metrics.increment("storage.bytes_written", len(file_contents))
+
+    def read_book_data(self, filename):
         file_path = Path(filename)
 
         try:
-            raw_text = file_path.read_text(encoding="utf-8")
-            book_data = json.loads(raw_text)
+            raw_bytes = file_path.read_bytes()
+            if metrics.enabled:
+                metrics.increment("storage.bytes_read", len(raw_bytes))
+            book_data = json.loads(raw_bytes.decode("utf-8"))
 
             if not isinstance(book_data, dict):
                 raise ValueError("Invalid file format (root must be a JSON object).")
 
-            return reservation_book_from_dict(book_data)
+            return book_data
 
         except FileNotFoundError:
             raise FileNotFoundError("File not found: {}".format(filename))
@@ -34,3 +84,47 @@ class Storage:
             raise ValueError("Invalid JSON: {}".format(error))
         except OSError as error:
             raise OSError("Failed to read file: {}".format(error))
+
+    def open_binary_snapshot(self, filename):
+        try:
+            return BinarySnapshot(filename)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found: {}".format(filename))
+        except OSError as error:
+            raise OSError("Failed to read file: {}".format(error))
+
+    def open_sqlite_book(self, filename, create=False):
+        if not create and not Path(filename).exists():
+            raise FileNotFoundError("File not found: {}".format(filename))
+        return SqliteReservationBook(filename)
+
+    def load_from_file(self, filename, book_data_callback=None):
+        # book_data_callback, if given, receives the decoded JSON document before
+        # the book is built from it (binary and SQLite books skip it).
+        with metrics.measure("storage.load"):
+            return self._load_book(filename, book_data_callback)
+
+    def _load_book(self, filename, book_data_callback=None):
+        try:
+            binary_file = is_binary_snapshot(filename)
+            sqlite_file = not binary_file and is_sqlite_book(filename)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found: {}".format(filename))
+        except OSError as error:
+            raise OSError("Failed to read file: {}".format(error))
+
+        if binary_file:
+            if metrics.enabled:
+                metrics.increment("storage.bytes_read", os.path.getsize(filename))
+            with self.open_binary_snapshot(filename) as snapshot:
+                return snapshot.to_reservation_book()
+
+        if sqlite_file:
+            return self.open_sqlite_book(filename)
+
+        book_data = self.read_book_data(filename)
+        if book_data_callback is not None:
+            book_data_callback(book_data)
+        if self.parallel_workers is not None:
+            return reservation_book_from_dict_parallel(book_data, max_workers=self.parallel_workers)
+        return reservation_book_from_dict(book_data)
@@ -1,4 +1,4 @@
-from datetime import date, time
+from decoding import decode_date, decode_time
 
 
 class Validator:
@@ -21,32 +21,25 @@ class Validator:
 
     def parse_iso_date(self, raw_value):
         date_text = str(raw_value).strip()
-        parts = date_text.split("-")
-        if len(parts) != 3:
+        if date_text.count("-") != 2:
             raise ValueError("Date must be in format YYYY-MM-DD.")
 
         try:
-            year, month, day = (int(part) for part in parts)
-            return date(year, month, day)
+            return decode_date(date_text)
         except Exception:
             raise ValueError("Invalid date.")
 
     def parse_hhmm_time(self, raw_value):
         time_text = str(raw_value).strip()
-        parts = time_text.split(":")
-        if len(parts) != 2:
+        if time_text.count(":") != 1:
             raise ValueError("Time must be in format HH:MM.")
 
+        # Out-of-range hours and minutes are rejected by time() itself.
         try:
-            hours, minutes = (int(part) for part in parts)
+            return decode_time(time_text)
         except Exception:
             raise ValueError("Invalid time.")
 
-        if not (0 <= hours <= 23 and 0 <= minutes <= 59):
-            raise ValueError("Invalid time.")
-
-        return time(hours, minutes)
-
     def parse_equipment_list(self, raw_value):
         equipment_text = str(raw_value).strip()
         if not equipment_text: